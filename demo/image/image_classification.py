@@ -28,6 +28,15 @@ def main():
 
   app_parser = parser.add_argument_group('app')
 
+  app_parser.add_argument("--inputter",
+                      choices=["image_classification_csv_inputter",
+                               "image_classification_tfrecord_inputter"],
+                      help="Read the images listed in a CSV file, or the \
+                            shards of a manifest written by \
+                            source/tool/csv_to_tfrecord.py.",
+                      type=str,
+                      default="image_classification_csv_inputter")
+
   app_parser.add_argument("--num_classes",
                       help="Number of classes.",
                       type=int,
@@ -67,11 +76,11 @@ def main():
   if runner_config.mode == "tune":
 
     inputter_module = importlib.import_module(
-      "source.inputter.image_classification_csv_inputter")
+      "source.inputter." + app_config.inputter)
     modeler_module = importlib.import_module(
       "source.modeler.image_classification_modeler")
     runner_module = importlib.import_module(
-      "source.runner.parameter_server_runner")
+      "source.runner." + runner_config.runner)
 
     tuner.tune(app_config,
                runner_config,
@@ -105,7 +114,7 @@ def main():
       callbacks.append(callback)
 
     inputter = importlib.import_module(
-      "source.inputter.image_classification_csv_inputter").build(
+      "source.inputter." + app_config.inputter).build(
       inputter_config, augmenter)
 
     modeler = importlib.import_module(
@@ -113,7 +122,7 @@ def main():
       modeler_config, net)
 
     runner = importlib.import_module(
-      "source.runner.parameter_server_runner").build(
+      "source.runner." + runner_config.runner).build(
       runner_config, inputter, modeler, callbacks)
 
     # Run application
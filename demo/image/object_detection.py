@@ -55,6 +55,13 @@ def main():
                           help="threshold to remove weak detection",
                           type=float,
                           default=0.5)
+  app_parser.add_argument("--bucket_boundaries",
+                          help="Comma separated aspect ratios (width / \
+                                height) between the buckets of images \
+                                batched together. Empty disables the \
+                                bucketing.",
+                          type=str,
+                          default="")
 
   # Default configs
   runner_config, callback_config, inputter_config, modeler_config, app_config = \
@@ -64,7 +71,10 @@ def main():
     inputter_config,
     dataset_dir=app_config.dataset_dir,
     num_classes=app_config.num_classes,
-    resolution=app_config.resolution)
+    resolution=app_config.resolution,
+    bucket_boundaries=(
+      [float(x) for x in app_config.bucket_boundaries.split(",")]
+      if app_config.bucket_boundaries else []))
 
   modeler_config = ObjectDetectionModelerConfig(
     modeler_config,
@@ -80,7 +90,7 @@ def main():
     modeler_module = importlib.import_module(
       "source.modeler.object_detection_modeler")
     runner_module = importlib.import_module(
-      "source.runner.parameter_server_runner")
+      "source.runner." + runner_config.runner)
 
     tuner.tune(app_config,
                runner_config,
@@ -123,7 +133,7 @@ def main():
       modeler_config, net)
 
     runner = importlib.import_module(
-      "source.runner.parameter_server_runner").build(
+      "source.runner." + runner_config.runner).build(
       runner_config, inputter, modeler, callbacks)
 
     # Run application
@@ -27,6 +27,15 @@ def main():
 
   app_parser = parser.add_argument_group('app')
 
+  app_parser.add_argument("--inputter",
+                          choices=["style_transfer_csv_inputter",
+                                   "style_transfer_tfrecord_inputter"],
+                          help="Read the images listed in a CSV file, or the \
+                                shards of a manifest written by \
+                                source/tool/csv_to_tfrecord.py.",
+                          type=str,
+                          default="style_transfer_csv_inputter")
+
   app_parser.add_argument("--style_weight",
                           help="Weight for style loss",
                           default=100)
@@ -106,11 +115,11 @@ def main():
   if runner_config.mode == "tune":
 
     inputter_module = importlib.import_module(
-      "source.inputter.style_transfer_csv_inputter")
+      "source.inputter." + app_config.inputter)
     modeler_module = importlib.import_module(
       "source.modeler.style_transfer_modeler")
     runner_module = importlib.import_module(
-      "source.runner.parameter_server_runner")
+      "source.runner." + runner_config.runner)
 
     tuner.tune(app_config,
                runner_config,
@@ -146,7 +155,7 @@ def main():
       callbacks.append(callback)
 
     inputter = importlib.import_module(
-      "source.inputter.style_transfer_csv_inputter").build(
+      "source.inputter." + app_config.inputter).build(
       inputter_config, augmenter)
 
     modeler = importlib.import_module(
@@ -154,7 +163,7 @@ def main():
       modeler_config, net)
 
     runner = importlib.import_module(
-      "source.runner.parameter_server_runner").build(
+      "source.runner." + runner_config.runner).build(
       runner_config, inputter, modeler, callbacks)
 
     # Run application
@@ -89,7 +89,7 @@ def main():
     modeler_module = importlib.import_module(
       "source.modeler.text_classification_modeler")
     runner_module = importlib.import_module(
-      "source.runner.parameter_server_runner")
+      "source.runner." + runner_config.runner)
 
     tuner.tune(app_config,
                runner_config,
@@ -138,7 +138,7 @@ def main():
       modeler_config, net)
 
     runner = importlib.import_module(
-      "source.runner.parameter_server_runner").build(
+      "source.runner." + runner_config.runner).build(
       runner_config, inputter, modeler, callbacks)
 
     # Run application
@@ -361,6 +361,9 @@ def preprocess_for_train(image,
                          boxes,
                          resolution,
                          speed_mode=False):
+  # Size of the image before it is padded to resolution x resolution
+  size = tf.shape(image)[:2]
+
   if speed_mode:
     pass
   else:
@@ -444,6 +447,7 @@ def preprocess_for_train(image,
 
     # Scaling to canonical size without perspective preserved
     image, scale, translation = aspect_preserving_resize(image, resolution, depth=3, resize_mode="bilinear")
+    size = tf.minimum(tf.shape(image)[:2], resolution)
     new_image = tf.image.resize_image_with_crop_or_pad(
       image,
       resolution,
@@ -478,7 +482,7 @@ def preprocess_for_train(image,
     # caffe swaps color channels
     image = tf.concat(axis=2, values=[channels[2], channels[1], channels[0]]) 
 
-  return image, classes, boxes, scale, translation
+  return image, classes, boxes, scale, translation, size
 
 
 def preprocess_for_eval(image,
@@ -486,6 +490,9 @@ def preprocess_for_eval(image,
                         boxes,
                         resolution,
                         speed_mode=False):
+  # Size of the image, the resize stretches it without padding
+  size = tf.shape(image)[:2]
+
   if speed_mode:
     pass
   else:
@@ -506,6 +513,7 @@ def preprocess_for_eval(image,
     image, scale, translation = bilinear_resize(image, resolution, depth=3, resize_mode="bilinear")
     # Need this to make later tensor unstack working
     image.set_shape([resolution, resolution, 3])
+    size = tf.shape(image)[:2]
     x1, y1, x2, y2 = tf.unstack(boxes, 4, axis=1)
     x1 = tf.scalar_mul(scale[1], x1)
     y1 = tf.scalar_mul(scale[0], y1)
@@ -519,23 +527,29 @@ def preprocess_for_eval(image,
     boxes = boxes + [translation[1], translation[0], translation[1], translation[0]]
 
 
-  return image, classes, boxes, scale, translation
+  return image, classes, boxes, scale, translation, size
 
 
 def augment(image, classes, boxes, resolution,
-            is_training=False, speed_mode=False):
+            is_training=False, speed_mode=False, with_size=False):
+  """Augmented image, classes, boxes, scale and translation.
+
+  With with_size also the [height, width] of the image before it is padded
+  to resolution x resolution.
+  """
   if is_training:
-    return preprocess_for_train(image,
-                                classes,
-                                boxes,
-                                resolution,
-                                speed_mode=speed_mode)
+    outputs = preprocess_for_train(image,
+                                   classes,
+                                   boxes,
+                                   resolution,
+                                   speed_mode=speed_mode)
   else:
-    return preprocess_for_eval(image,
-                               classes,
-                               boxes,
-                               resolution,
-                               speed_mode=speed_mode)
+    outputs = preprocess_for_eval(image,
+                                  classes,
+                                  boxes,
+                                  resolution,
+                                  speed_mode=speed_mode)
+  return outputs if with_size else outputs[:5]
 
 def preprocess_for_export(image, resolution):
   # mean subtraction   
@@ -6,11 +6,152 @@ Licensed under
 """
 from __future__ import print_function
 
+import tensorflow as tf
+
+# Ops that wait for the next batch of a tf.data iterator
+INPUT_OPS = ["IteratorGetNext", "IteratorGetNextSync"]
+
+
+def input_wait_time(graph, step_stats):
+  """Seconds a traced session call spent waiting for the input iterator.
+
+  An op runs several times in a loop (steps_per_run), so the times of its
+  executions on a device are summed.
+  """
+  wait_micros = {}
+  for dev_stats in step_stats.dev_stats:
+    device_micros = {}
+    for node_stats in dev_stats.node_stats:
+      name = node_stats.node_name.split(":")[0]
+      try:
+        op_type = graph.get_operation_by_name(name).type
+      except KeyError:
+        continue
+      if op_type in INPUT_OPS:
+        device_micros[name] = (device_micros.get(name, 0) +
+                               node_stats.all_end_rel_micros)
+    for name, micros in device_micros.items():
+      # Count every op once, even if several devices recorded it
+      wait_micros[name] = max(wait_micros.get(name, 0), micros)
+  return sum(wait_micros.values()) / 1e6
+
+
+class InputBound(object):
+  """Share of the step time spent waiting for the input.
+
+  Traces a session call every input_stall_every_n_iter calls, see
+  input_wait_time. Used by the speed callbacks: run_options in
+  before_step, add in after_step, log every log_every_n_iter steps and
+  report after the run.
+  """
+  def __init__(self, config):
+    self.config = config
+    self.num_calls = 0
+
+    # Since the last log and over the whole run
+    self.input_wait_time = 0.0
+    self.traced_time = 0.0
+    self.run_input_wait_time = 0.0
+    self.run_traced_time = 0.0
+
+  def run_options(self):
+    """RunOptions of the next session call, to trace it now and then."""
+    every_n_iter = self.config.input_stall_every_n_iter
+    self.num_calls = self.num_calls + 1
+    if every_n_iter > 0 and self.num_calls % every_n_iter == 0:
+      return tf.RunOptions(trace_level=tf.RunOptions.SOFTWARE_TRACE)
+    else:
+      return None
+
+  def add(self, graph, context):
+    if context.run_metadata is not None:
+      wait_time = input_wait_time(graph, context.run_metadata.step_stats)
+      step_time = context.time_after_step - context.time_before_step
+      self.input_wait_time = self.input_wait_time + wait_time
+      self.traced_time = self.traced_time + step_time
+      self.run_input_wait_time = self.run_input_wait_time + wait_time
+      self.run_traced_time = self.run_traced_time + step_time
+
+  def message(self, wait_time, traced_time):
+    percent = 100.0 * wait_time / traced_time
+    message = "Input bound: " + "{0:.1f}".format(percent) + "%"
+    if percent > 100.0 * self.config.input_stall_threshold:
+      message = message + " (input pipeline stalls)"
+    return message
+
+  def log(self):
+    """Message of the calls traced since the last log, None without any."""
+    if self.traced_time > 0:
+      message = self.message(self.input_wait_time, self.traced_time)
+      self.input_wait_time = 0.0
+      self.traced_time = 0.0
+      return message
+    else:
+      return None
+
+  def report(self):
+    if self.run_traced_time > 0:
+      print("\n" + self.message(self.run_input_wait_time,
+                                self.run_traced_time) +
+            " of " + "{0:.2f}".format(self.run_traced_time) + "s traced.")
+      if (self.run_input_wait_time >
+          self.config.input_stall_threshold * self.run_traced_time):
+        print("Warning: the run is input bound, speed up the inputter "
+              "(more parallel calls, prefetching, caching).")
+
+
+class StepContext(object):
+  """Information about a session call, shared with every callback.
+
+  Everything is filled from the main session call, so callbacks do not
+  need to run the session themselves:
+    global_step: global step after the call (number of steps run so far
+                 outside of training).
+    num_steps: number of steps run by the call (see steps_per_run).
+    time_before_step, time_after_step: wall-clock time around the call.
+    outputs: the fetched run ops, by name.
+    fetches: the fetched values of the tensors registered by callbacks.
+    accumulation_steps: number of batches whose gradients are applied by
+                        a single step (see accumulation_steps).
+    run_metadata: RunMetadata of the call if a callback asked for a trace
+                  (see Callback.run_options), None otherwise.
+  """
+  def __init__(self, global_step, num_steps,
+               time_before_step, time_after_step,
+               outputs, fetches, accumulation_steps=1, run_metadata=None):
+    self.global_step = global_step
+    self.num_steps = num_steps
+    self.time_before_step = time_before_step
+    self.time_after_step = time_after_step
+    self.outputs = outputs
+    self.fetches = fetches
+    self.accumulation_steps = accumulation_steps
+    self.run_metadata = run_metadata
+
+  def copy(self):
+    return StepContext(self.global_step, self.num_steps,
+                       self.time_before_step, self.time_after_step,
+                       dict(self.outputs), dict(self.fetches),
+                       self.accumulation_steps, self.run_metadata)
+
 
 class Callback(object):
   def __init__(self, config):
     self.config = config
 
+    # Sync-only callbacks always run after_step on the main thread,
+    # for example because they modify the feed_dict or need the session
+    # state right after the step.
+    self.sync_only = False
+
+    # Tensors to fetch along with the main run ops, by name. Register them
+    # in before_run, read the values from context.fetches in after_step.
+    self.fetches = {}
+
+    # RunOptions of the next main session call, for example to trace it.
+    # Set in before_step, the trace is in context.run_metadata.
+    self.run_options = None
+
   def before_run(self, *argv):
     pass
 
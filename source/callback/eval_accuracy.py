@@ -22,7 +22,7 @@ class EvalAccuracy(Callback):
     eval_accuracy = self.accumulated_accuracy / self.global_step
     print("Evaluation accuracy: " + "{0:.4f}".format(eval_accuracy))
 
-  def after_step(self, sess, outputs_dict, feed_dict=None):
+  def after_step(self, sess, outputs_dict, feed_dict=None, context=None):
 
     self.global_step = self.global_step + 1
 
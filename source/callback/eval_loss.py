@@ -22,7 +22,7 @@ class EvalLoss(Callback):
     eval_loss = self.accumulated_loss / self.global_step
     print("Evaluation loss: " + "{0:.4f}".format(eval_loss))
 
-  def after_step(self, sess, outputs_dict, feed_dict=None):
+  def after_step(self, sess, outputs_dict, feed_dict=None, context=None):
     self.global_step = self.global_step + 1
 
     self.accumulated_loss = (self.accumulated_loss +
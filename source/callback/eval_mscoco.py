@@ -63,7 +63,7 @@ class EvalMSCOCO(Callback):
     else:
       print("Found no valid detection. Consider re-train your model.")
 
-  def after_step(self, sess, outputs_dict, feed_dict=None):
+  def after_step(self, sess, outputs_dict, feed_dict=None, context=None):
 
     num_images = len(outputs_dict["image_id"])
     # print(num_images)
@@ -4,11 +4,11 @@ Licensed under
 ==========================================================================
 
 """
-import time
+from __future__ import print_function
 
 import tensorflow as tf
 
-from .callback import Callback
+from .callback import Callback, InputBound
 
 
 class EvalSpeed(Callback):
@@ -20,20 +20,26 @@ class EvalSpeed(Callback):
     self.accumulated_num_samples = 0.0
     self.accumulated_time = 0.0
     self.batch_size = self.config.batch_size_per_gpu * self.config.gpu_count
+
     self.global_step = 0.0
+    self.input_bound = InputBound(self.config)
 
   def before_step(self, sess):
-    self.time_before_step = time.time()
+    self.run_options = self.input_bound.run_options()
 
-  def after_step(self, sess, outputs_dict, feed_dict=None):
-    self.time_after_step = time.time()
+  def after_run(self, sess):
+    self.input_bound.report()
 
+  def after_step(self, sess, outputs_dict, feed_dict=None, context=None):
     self.global_step = self.global_step + 1
 
     self.accumulated_num_samples = (self.accumulated_num_samples +
                                     self.batch_size)
-    self.accumulated_time = (self.accumulated_time + self.time_after_step -
-                             self.time_before_step)
+    self.accumulated_time = (self.accumulated_time +
+                             context.time_after_step -
+                             context.time_before_step)
+
+    self.input_bound.add(self.graph, context)
 
     every_n_iter = self.config.log_every_n_iter
 
@@ -42,7 +48,13 @@ class EvalSpeed(Callback):
                              self.accumulated_time)
       self.accumulated_num_samples = 0.0
       self.accumulated_time = 0.0
-      return {"speed": "Speed: " + "{0:.4f}".format(num_samples_per_sec)}
+      return_dict = {
+        "speed": "Speed: " + "{0:.4f}".format(num_samples_per_sec)}
+
+      input_bound = self.input_bound.log()
+      if input_bound:
+        return_dict["input_bound"] = input_bound
+      return return_dict
     else:
       return {}
 
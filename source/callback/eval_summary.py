@@ -49,7 +49,7 @@ class EvalSummary(Callback):
       if not os.path.exists(path_result_file):
         with open(path_result_file, 'w'): pass
 
-  def after_step(self, sess, outputs_dict, feed_dict=None):
+  def after_step(self, sess, outputs_dict, feed_dict=None, context=None):
     if not self.accumulated_summary:
       self.accumulated_summary = outputs_dict
     else:
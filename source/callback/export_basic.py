@@ -76,7 +76,7 @@ class ExportBasic(Callback):
     pass
 
 
-  def after_step(self, sess, outputs_dict, feed_dict=None):
+  def after_step(self, sess, outputs_dict, feed_dict=None, context=None):
     pass
 
 
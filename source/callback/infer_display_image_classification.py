@@ -16,7 +16,7 @@ class InferDisplayImageClassification(Callback):
   def before_run(self, sess):
     self.graph = tf.get_default_graph()
 
-  def after_step(self, sess, outputs_dict, feed_dict=None):
+  def after_step(self, sess, outputs_dict, feed_dict=None, context=None):
     for p, c in zip(outputs_dict["probabilities"],
                     outputs_dict["classes"]):
       print("Predict: " + str(c) + ", Probability: " + str(p[c]))
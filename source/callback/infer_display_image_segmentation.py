@@ -16,6 +16,8 @@ from .callback import Callback
 class InferDisplayImageSegmentation(Callback):
   def __init__(self, config):
     super(InferDisplayImageSegmentation, self).__init__(config)
+    # matplotlib has to draw from the main thread
+    self.sync_only = True
 
   def render_label(self, label, num_classes, label_colors):
 
@@ -41,7 +43,7 @@ class InferDisplayImageSegmentation(Callback):
     self.colors = np.random.randint(255,
                                     size=(self.config.num_classes, 3))
 
-  def after_step(self, sess, outputs_dict, feed_dict=None):
+  def after_step(self, sess, outputs_dict, feed_dict=None, context=None):
     for p, c in zip(outputs_dict["probabilities"],
                     outputs_dict["classes"]):
 
@@ -41,6 +41,8 @@ COLORS = plt.cm.hsv(np.linspace(0, 1, 121)).tolist()
 class InferDisplayObjectDetection(Callback):
   def __init__(self, config):
     super(InferDisplayObjectDetection, self).__init__(config)
+    # matplotlib has to draw from the main thread
+    self.sync_only = True
 
   def before_run(self, sess):
     self.graph = tf.get_default_graph()
@@ -135,7 +137,7 @@ class InferDisplayObjectDetection(Callback):
       plt.imshow(input_image)
       plt.show()
 
-  def after_step(self, sess, outputs_dict, feed_dict=None):
+  def after_step(self, sess, outputs_dict, feed_dict=None, context=None):
     self.display_ori(outputs_dict)
 
 
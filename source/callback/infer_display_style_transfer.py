@@ -15,6 +15,8 @@ from .callback import Callback
 class InferDisplayStyleTransfer(Callback):
   def __init__(self, config):
     super(InferDisplayStyleTransfer, self).__init__(config)
+    # matplotlib has to draw from the main thread
+    self.sync_only = True
 
   def render_label(self, label, num_classes, label_colors):
 
@@ -39,7 +41,7 @@ class InferDisplayStyleTransfer(Callback):
     self.graph = tf.get_default_graph()
     self.RGB_MEAN = [123.68, 116.78, 103.94]
 
-  def after_step(self, sess, outputs_dict, feed_dict=None):
+  def after_step(self, sess, outputs_dict, feed_dict=None, context=None):
     for input_image, output_image in zip(
       outputs_dict["input"], outputs_dict["output"]):
 
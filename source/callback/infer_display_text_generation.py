@@ -27,6 +27,8 @@ def softmax(x):
 class InferDisplayTextGeneration(Callback):
   def __init__(self, config):
     super(InferDisplayTextGeneration, self).__init__(config)
+    # Feeds the sampled item and the RNN state to the next step
+    self.sync_only = True
     self.input = ""
     self.output = ""
 
@@ -41,7 +43,7 @@ class InferDisplayTextGeneration(Callback):
       print(self.input.split()[0] + " " + self.output)
     print('-------------------------------------------------')
 
-  def after_step(self, sess, outputs_dict, feed_dict=None):
+  def after_step(self, sess, outputs_dict, feed_dict=None, context=None):
     items = outputs_dict["items"]
     for i, l in zip(outputs_dict["inputs"], outputs_dict["logits"]):
 
@@ -0,0 +1,132 @@
+"""
+Copyright 2018 Lambda Labs. All Rights Reserved.
+Licensed under
+==========================================================================
+
+"""
+from __future__ import print_function
+import os
+import json
+import collections
+
+import tensorflow as tf
+from tensorflow.python.client import timeline
+
+from .callback import Callback
+
+
+class Profiler(Callback):
+  """Trace a step every profile_every_n_iter steps.
+
+  Writes the Chrome trace of every traced step (open it in
+  chrome://tracing) and ranks the ops and the name scopes by their compute
+  time, averaged over the traced steps.
+  """
+  def __init__(self, config):
+    super(Profiler, self).__init__(config)
+    # The trace options must be reset right after the traced step
+    self.sync_only = True
+
+  def before_run(self, sess):
+    self.graph = tf.get_default_graph()
+    self.profile_dir = os.path.join(self.config.model_dir, "profile")
+    if not os.path.isdir(self.profile_dir):
+      os.makedirs(self.profile_dir)
+
+    self.op_times = collections.defaultdict(float)
+    self.scope_times = collections.defaultdict(float)
+    self.num_traced_steps = 0
+
+    # Skip the first steps, they also warm up the devices
+    self.global_step = 0
+    self.next_trace_step = self.config.profile_every_n_iter
+
+  def before_step(self, sess):
+    if self.global_step >= self.next_trace_step:
+      self.run_options = tf.RunOptions(
+        trace_level=tf.RunOptions.FULL_TRACE)
+
+  def op_type(self, node_name):
+    try:
+      return self.graph.get_operation_by_name(node_name).type
+    except KeyError:
+      # For example memory copies
+      return node_name
+
+  def scope(self, node_name):
+    return "/".join(node_name.split("/")[:self.config.profile_scope_depth])
+
+  def collect(self, step_stats):
+    devices = [dev_stats.device for dev_stats in step_stats.dev_stats]
+    for dev_stats in step_stats.dev_stats:
+      # GPU kernels show up per stream and summed over all streams (and
+      # the device itself only records the launches), count them once
+      if "/stream:" in dev_stats.device:
+        if not dev_stats.device.endswith("/stream:all"):
+          continue
+      elif dev_stats.device + "/stream:all" in devices:
+        continue
+
+      for node_stats in dev_stats.node_stats:
+        node_name = node_stats.node_name.split(":")[0]
+        micros = node_stats.all_end_rel_micros
+        self.op_times[self.op_type(node_name)] += micros
+        self.scope_times[self.scope(node_name)] += micros
+
+  def ranking(self, times):
+    total = max(sum(times.values()), 1)
+    return [{"name": name,
+             "ms_per_step": times[name] / 1000.0 / self.num_traced_steps,
+             "percent": 100.0 * times[name] / total}
+            for name in sorted(times, key=times.get, reverse=True)]
+
+  def report(self):
+    ranking = {"num_traced_steps": self.num_traced_steps,
+               "ops": self.ranking(self.op_times),
+               "scopes": self.ranking(self.scope_times)}
+    with open(os.path.join(self.profile_dir, "profile.json"), "w") as f:
+      json.dump(ranking, f, indent=2)
+
+    lines = []
+    for key in ["ops", "scopes"]:
+      lines.append("{:<60}{:>14}{:>8}".format(key, "ms/step", "%"))
+      for x in ranking[key][:self.config.profile_top_n]:
+        lines.append("{:<60}{:>14.3f}{:>8.1f}".format(
+          x["name"], x["ms_per_step"], x["percent"]))
+      lines.append("")
+    report = "\n".join(lines)
+    with open(os.path.join(self.profile_dir, "profile.txt"), "w") as f:
+      f.write(report)
+    return report
+
+  def after_step(self, sess, outputs_dict, feed_dict=None, context=None):
+    self.global_step = context.global_step
+
+    if self.run_options is None or context.run_metadata is None:
+      return {}
+
+    self.run_options = None
+    self.next_trace_step = (context.global_step +
+                            self.config.profile_every_n_iter)
+
+    step_stats = context.run_metadata.step_stats
+    trace = timeline.Timeline(step_stats, graph=self.graph)
+    trace_path = os.path.join(
+      self.profile_dir, "timeline_{}.json".format(context.global_step))
+    with open(trace_path, "w") as f:
+      f.write(trace.generate_chrome_trace_format())
+
+    self.num_traced_steps = self.num_traced_steps + 1
+    self.collect(step_stats)
+    self.report()
+    return {}
+
+  def after_run(self, sess):
+    if self.num_traced_steps > 0:
+      print("\nProfile of " + str(self.num_traced_steps) +
+            " steps (" + self.profile_dir + "):")
+      print(self.report())
+
+
+def build(config):
+  return Profiler(config)
@@ -16,21 +16,25 @@ class TrainAccuracy(Callback):
   def before_run(self, sess):
     self.graph = tf.get_default_graph()
     self.accumulated_accuracy = 0.0
+    self.accumulated_steps = 0
 
-  def after_step(self, sess, outputs_dict, feed_dict=None):
+  def after_step(self, sess, outputs_dict, feed_dict=None, context=None):
 
-    global_step_op = self.graph.get_tensor_by_name("global_step:0")
+    global_step = context.global_step
 
-    global_step = sess.run(global_step_op)
+    # A session call can run more than one step (steps_per_run)
+    num_steps = context.num_steps
 
     self.accumulated_accuracy = (self.accumulated_accuracy +
-                                 outputs_dict["accuracy"])
+                                 outputs_dict["accuracy"] * num_steps)
+    self.accumulated_steps = self.accumulated_steps + num_steps
 
     every_n_iter = self.config.log_every_n_iter
 
-    if global_step % every_n_iter == 0:
-      running_accuracy = self.accumulated_accuracy / every_n_iter
+    if global_step % every_n_iter < num_steps:
+      running_accuracy = self.accumulated_accuracy / self.accumulated_steps
       self.accumulated_accuracy = 0.0
+      self.accumulated_steps = 0
       return {"accuracy": "Accuracy: " + "{0:.4f}".format(running_accuracy)}
     else:
       return {}
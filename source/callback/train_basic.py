@@ -9,6 +9,7 @@ from __future__ import print_function
 import os
 import sys
 import glob
+import time
 
 import tensorflow as tf
 
@@ -18,10 +19,16 @@ from .callback import Callback
 class TrainBasic(Callback):
   def __init__(self, config):
     super(TrainBasic, self).__init__(config)
+    # Checkpoints must see the variables right after the step
+    self.sync_only = True
 
   def before_run(self, sess):
     self.graph = tf.get_default_graph()
 
+    # In distributed training only the chief (worker 0) initializes, restores
+    # and saves the variables
+    self.is_chief = (self.config.worker_index == 0)
+
     # Create saver
     self.saver = tf.train.Saver(
       max_to_keep=self.config.keep_checkpoint_max,
@@ -30,7 +37,13 @@ class TrainBasic(Callback):
     if not os.path.isdir(self.config.model_dir):
       os.makedirs(self.config.model_dir)
 
-    if tf.train.checkpoint_exists(
+    if not self.is_chief:
+      print("Wait for the chief to initialize global variables ... ")
+      uninitialized_vars = tf.report_uninitialized_variables(
+        tf.global_variables())
+      while len(sess.run(uninitialized_vars)) > 0:
+        time.sleep(1)
+    elif tf.train.checkpoint_exists(
       os.path.join(self.config.model_dir, "*ckpt*")):
       self.saver.restore(sess,
                          tf.train.latest_checkpoint(
@@ -52,7 +65,7 @@ class TrainBasic(Callback):
         print("Start training from step " + str(global_step))
 
         # Restore some weights from pre-trained model
-        if self.config.pretrained_model:
+        if self.config.pretrained_model and self.is_chief:
           self.config.pretrained_model = os.path.expanduser(
             self.config.pretrained_model)
           print("Try to initialize weights from pre-trained model.")
@@ -85,6 +98,9 @@ class TrainBasic(Callback):
         print("Resume training from step " + str(global_step))
 
   def after_run(self, sess):
+    if not self.is_chief:
+      return
+
     max_step_op = self.graph.get_tensor_by_name("max_step:0")
     max_step = sess.run(max_step_op)
 
@@ -96,13 +112,14 @@ class TrainBasic(Callback):
                                   global_step=max_step)
       print("Checkpoint " + save_path + " has been saved.")
 
-  def after_step(self, sess, outputs_dict, feed_dict=None):
-
+  def after_step(self, sess, outputs_dict, feed_dict=None, context=None):
+    global_step = context.global_step
 
-    global_step_op = self.graph.get_tensor_by_name("global_step:0")
-    global_step = sess.run(global_step_op)
+    # A session call can run more than one step (steps_per_run)
+    num_steps = context.num_steps
 
-    if global_step % self.config.save_checkpoints_steps == 0:
+    if (self.is_chief and
+        global_step % self.config.save_checkpoints_steps < num_steps):
       save_path = self.saver.save(
         sess,
         os.path.join(self.config.model_dir,
@@ -16,18 +16,24 @@ class TrainLoss(Callback):
   def before_run(self, sess):
     self.graph = tf.get_default_graph()
     self.accumulated_loss = 0.0
+    self.accumulated_steps = 0
 
-  def after_step(self, sess, outputs_dict, feed_dict=None):
-    global_step_op = self.graph.get_tensor_by_name("global_step:0")
-    global_step = sess.run(global_step_op)
+  def after_step(self, sess, outputs_dict, feed_dict=None, context=None):
+    global_step = context.global_step
 
-    self.accumulated_loss = self.accumulated_loss + outputs_dict["loss"]
+    # A session call can run more than one step (steps_per_run)
+    num_steps = context.num_steps
+
+    self.accumulated_loss = (self.accumulated_loss +
+                             outputs_dict["loss"] * num_steps)
+    self.accumulated_steps = self.accumulated_steps + num_steps
 
     every_n_iter = self.config.log_every_n_iter
 
-    if global_step % every_n_iter == 0:
-      loss = self.accumulated_loss / every_n_iter
+    if global_step % every_n_iter < num_steps:
+      loss = self.accumulated_loss / self.accumulated_steps
       self.accumulated_loss = 0.0
+      self.accumulated_steps = 0
       # print("loss: " + "{0:.4f}".format(loss))
       return {"loss": "Loss: " + "{0:.4f}".format(loss)}
     else:
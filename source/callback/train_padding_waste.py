@@ -0,0 +1,57 @@
+"""
+Copyright 2018 Lambda Labs. All Rights Reserved.
+Licensed under
+==========================================================================
+
+"""
+from __future__ import print_function
+import tensorflow as tf
+
+from .callback import Callback
+
+
+class TrainPaddingWaste(Callback):
+  """Share of the batched image pixels that are padding.
+
+  Needs a modeler that returns "padding_waste", for example the object
+  detection modeler. Logs the share of the current epoch every
+  log_every_n_iter steps and prints it at the end of every epoch.
+  """
+  def __init__(self, config):
+    super(TrainPaddingWaste, self).__init__(config)
+
+  def before_run(self, sess):
+    self.graph = tf.get_default_graph()
+    steps_per_epoch_op = self.graph.get_tensor_by_name("steps_per_epoch:0")
+    self.steps_per_epoch = sess.run(steps_per_epoch_op)
+    self.accumulated_waste = 0.0
+    self.accumulated_steps = 0
+
+  def after_step(self, sess, outputs_dict, feed_dict=None, context=None):
+    if "padding_waste" not in outputs_dict:
+      return {}
+
+    global_step = context.global_step
+
+    # A session call can run more than one step (steps_per_run)
+    num_steps = context.num_steps
+
+    self.accumulated_waste = (self.accumulated_waste +
+                              outputs_dict["padding_waste"] * num_steps)
+    self.accumulated_steps = self.accumulated_steps + num_steps
+    waste = self.accumulated_waste / self.accumulated_steps
+
+    if global_step % self.steps_per_epoch < num_steps:
+      print("Epoch {} padding waste: {:.2f}%".format(
+        global_step // self.steps_per_epoch, 100.0 * waste))
+      self.accumulated_waste = 0.0
+      self.accumulated_steps = 0
+
+    if global_step % self.config.log_every_n_iter < num_steps:
+      return {"padding_waste": "Padding: " + "{0:.2f}%".format(100.0 * waste)}
+    else:
+      return {}
+
+
+def build(config):
+  return TrainPaddingWaste(config)
@@ -4,11 +4,11 @@ Licensed under
 ==========================================================================
 
 """
-import time
+from __future__ import print_function
 
 import tensorflow as tf
 
-from .callback import Callback
+from .callback import Callback, InputBound
 
 
 class TrainSpeed(Callback):
@@ -18,34 +18,63 @@ class TrainSpeed(Callback):
   def before_run(self, sess):
     self.graph = tf.get_default_graph()
     self.accumulated_num_samples = 0.0
+    self.accumulated_num_steps = 0.0
     self.accumulated_time = 0.0
     self.batch_size = self.config.batch_size_per_gpu * self.config.gpu_count
 
+    self.input_bound = InputBound(self.config)
+
   def before_step(self, sess):
-    self.time_before_step = time.time()
+    self.run_options = self.input_bound.run_options()
+
+  def after_run(self, sess):
+    self.input_bound.report()
+
+  def after_step(self, sess, outputs_dict, feed_dict=None, context=None):
+    global_step = context.global_step
 
-  def after_step(self, sess, outputs_dict, feed_dict=None):
-    self.time_after_step = time.time()
+    # A session call can run more than one step (steps_per_run)
+    num_steps = context.num_steps
 
-    global_step_op = self.graph.get_tensor_by_name("global_step:0")
-    global_step = sess.run(global_step_op)
+    # A step can accumulate the gradients of several batches
+    num_batches = num_steps * context.accumulation_steps
 
     self.accumulated_num_samples = (self.accumulated_num_samples +
-                                    self.batch_size)
-    self.accumulated_time = (self.accumulated_time + self.time_after_step -
-                             self.time_before_step)
+                                    self.batch_size * num_batches)
+    self.accumulated_num_steps = self.accumulated_num_steps + num_steps
+    self.accumulated_time = (self.accumulated_time +
+                             context.time_after_step -
+                             context.time_before_step)
+
+    self.input_bound.add(self.graph, context)
 
     every_n_iter = self.config.log_every_n_iter
 
-    if global_step % every_n_iter == 0:
+    if global_step % every_n_iter < num_steps:
       num_samples_per_sec = (self.accumulated_num_samples /
                              self.accumulated_time)
+      return_dict = {
+        "speed": "Speed: " + "{0:.4f}".format(num_samples_per_sec)}
+
+      if context.accumulation_steps > 1:
+        # Micro-batches and effective (accumulated) batches per second
+        num_batches_per_sec = num_samples_per_sec / self.batch_size
+        num_steps_per_sec = (self.accumulated_num_steps /
+                             self.accumulated_time)
+        return_dict["effective_speed"] = (
+          "Batches/s: " + "{0:.4f}".format(num_batches_per_sec) + " " +
+          "Effective batches/s: " + "{0:.4f}".format(num_steps_per_sec))
+
+      input_bound = self.input_bound.log()
+      if input_bound:
+        return_dict["input_bound"] = input_bound
+
       self.accumulated_num_samples = 0.0
+      self.accumulated_num_steps = 0.0
       self.accumulated_time = 0.0
-      return {"speed": "Speed: " + "{0:.4f}".format(num_samples_per_sec)}
+      return return_dict
     else:
       return {}
 
-
 def build(config):
   return TrainSpeed(config)
@@ -30,13 +30,14 @@ class TrainSummary(Callback):
     self.summary_writer.flush()
     self.summary_writer.close()
 
-  def after_step(self, sess, outputs_dict, feed_dict=None):
+  def after_step(self, sess, outputs_dict, feed_dict=None, context=None):
 
-    global_step_op = self.graph.get_tensor_by_name("global_step:0")
+    global_step = context.global_step
 
-    global_step = sess.run(global_step_op)
+    # A session call can run more than one step (steps_per_run)
+    num_steps = context.num_steps
 
-    if global_step % self.config.save_summary_steps == 0:
+    if global_step % self.config.save_summary_steps < num_steps:
       self.summary_writer.add_summary(outputs_dict["summary"],
                                       global_step)
 
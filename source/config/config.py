@@ -23,7 +23,28 @@ class RunnerConfig(Config):
                summary_names,
                reduce_ops,
                train_reduce_ops,
-               eval_reduce_ops):
+               eval_reduce_ops,
+               steps_per_run=1,
+               async_callbacks=False,
+               callback_queue_size=2,
+               runner="parameter_server_runner",
+               device_type="gpu",
+               all_reduce_alg="ring",
+               all_reduce_num_subchunks=1,
+               gradient_bucket_mb=0,
+               sparse_gradient_dedup=False,
+               accumulation_steps=1,
+               cluster_spec=None,
+               job_name="worker",
+               task_index=0,
+               variable_placement="single",
+               ps_devices=("/cpu:0",),
+               tower_weights=(),
+               tower_weights_warmup_steps=0,
+               xla="off",
+               xla_excluded_ops=(),
+               graph_cache_dir="",
+               stage_inputs=False):
     super(RunnerConfig, self).__init__(
       mode, batch_size_per_gpu, gpu_count)
 
@@ -31,6 +52,27 @@ class RunnerConfig(Config):
     self.reduce_ops = reduce_ops
     self.train_reduce_ops = train_reduce_ops
     self.eval_reduce_ops = eval_reduce_ops
+    self.steps_per_run = steps_per_run
+    self.async_callbacks = async_callbacks
+    self.callback_queue_size = callback_queue_size
+    self.runner = runner
+    self.device_type = device_type
+    self.all_reduce_alg = all_reduce_alg
+    self.all_reduce_num_subchunks = all_reduce_num_subchunks
+    self.gradient_bucket_mb = gradient_bucket_mb
+    self.sparse_gradient_dedup = sparse_gradient_dedup
+    self.accumulation_steps = accumulation_steps
+    self.cluster_spec = cluster_spec
+    self.job_name = job_name
+    self.task_index = task_index
+    self.variable_placement = variable_placement
+    self.ps_devices = list(ps_devices)
+    self.tower_weights = list(tower_weights)
+    self.tower_weights_warmup_steps = tower_weights_warmup_steps
+    self.xla = xla
+    self.xla_excluded_ops = list(xla_excluded_ops)
+    self.graph_cache_dir = graph_cache_dir
+    self.stage_inputs = stage_inputs
 
 
 class CallbackConfig(Config):
@@ -51,7 +93,14 @@ class CallbackConfig(Config):
                export_dir,
                export_version,
                input_ops,
-               output_ops):
+               output_ops,
+               num_workers=1,
+               worker_index=0,
+               profile_every_n_iter=100,
+               profile_top_n=20,
+               profile_scope_depth=2,
+               input_stall_every_n_iter=100,
+               input_stall_threshold=0.2):
 
     super(CallbackConfig, self).__init__(
       mode, batch_size_per_gpu, gpu_count)
@@ -70,6 +119,13 @@ class CallbackConfig(Config):
     self.export_version = export_version
     self.input_ops = input_ops
     self.output_ops = output_ops
+    self.num_workers = num_workers
+    self.worker_index = worker_index
+    self.profile_every_n_iter = profile_every_n_iter
+    self.profile_top_n = profile_top_n
+    self.profile_scope_depth = profile_scope_depth
+    self.input_stall_every_n_iter = input_stall_every_n_iter
+    self.input_stall_threshold = input_stall_threshold
 
 
 class InputterConfig(Config):
@@ -83,7 +139,17 @@ class InputterConfig(Config):
                eval_dataset_meta,
                test_samples,
                augmenter,
-               augmenter_speed_mode):
+               augmenter_speed_mode,
+               accumulation_steps=1,
+               num_workers=1,
+               worker_index=0,
+               num_parallel_calls=0,
+               prefetch_buffer_size=0,
+               map_and_batch=True,
+               interleave_cycle_length=4,
+               input_probe_steps=0,
+               shuffle_buffer_size=1000,
+               preprocess_cache=""):
 
     super(InputterConfig, self).__init__(
       mode, batch_size_per_gpu, gpu_count)
@@ -95,6 +161,16 @@ class InputterConfig(Config):
     self.test_samples = test_samples
     self.augmenter = augmenter
     self.augmenter_speed_mode = augmenter_speed_mode
+    self.accumulation_steps = accumulation_steps
+    self.num_workers = num_workers
+    self.worker_index = worker_index
+    self.num_parallel_calls = num_parallel_calls
+    self.prefetch_buffer_size = prefetch_buffer_size
+    self.map_and_batch = map_and_batch
+    self.interleave_cycle_length = interleave_cycle_length
+    self.input_probe_steps = input_probe_steps
+    self.shuffle_buffer_size = shuffle_buffer_size
+    self.preprocess_cache = preprocess_cache
 
 
 class ModelerConfig(Config):
@@ -110,7 +186,11 @@ class ModelerConfig(Config):
                skip_l2_loss_vars,
                l2_weight_decay,
                network,
-               tune_config_path):
+               tune_config_path,
+               accumulation_steps=1,
+               mixed_precision=False,
+               initial_loss_scale=2.0 ** 15,
+               loss_scale_increment_steps=2000):
 
     super(ModelerConfig, self).__init__(
       mode, batch_size_per_gpu, gpu_count)
@@ -124,3 +204,7 @@ class ModelerConfig(Config):
     self.l2_weight_decay = l2_weight_decay
     self.network = network
     self.tune_config_path = tune_config_path
+    self.accumulation_steps = accumulation_steps
+    self.mixed_precision = mixed_precision
+    self.initial_loss_scale = initial_loss_scale
+    self.loss_scale_increment_steps = loss_scale_increment_steps
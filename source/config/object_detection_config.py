@@ -15,7 +15,8 @@ class ObjectDetectionInputterConfig(Config):
                default_inputter_config,
                dataset_dir="",
                num_classes=81,
-               resolution=512):
+               resolution=512,
+               bucket_boundaries=()):
 
     # default_inputter_config.dataset_meta = (
     #   None if not default_inputter_config.dataset_meta
@@ -30,6 +31,7 @@ class ObjectDetectionInputterConfig(Config):
     self.dataset_dir = dataset_dir
     self.num_classes = num_classes
     self.resolution = resolution
+    self.bucket_boundaries = list(bucket_boundaries)
 
 
 class ObjectDetectionModelerConfig(Config):
@@ -0,0 +1,120 @@
+"""
+Copyright 2018 Lambda Labs. All Rights Reserved.
+Licensed under
+==========================================================================
+
+Parsed annotations of a MSCOCO instances_*.json file.
+
+The boxes of all images are cleaned up at once with numpy and grouped by
+image. The result is cached in an npz file next to the json file, keyed by
+its path, size and modification time, so later runs skip the json.
+"""
+from __future__ import print_function
+import os
+import json
+
+import numpy as np
+
+
+# Bump to parse the annotations again after changing parse
+VERSION = 1
+
+FIELDS = ["image_ids", "file_names", "offsets", "category_ids", "boxes",
+          "is_crowd", "cat_ids", "cat_names"]
+
+
+def cache_path(annotation_file):
+  return os.path.splitext(annotation_file)[0] + ".npz"
+
+
+def cache_key(annotation_file):
+  stat = os.stat(annotation_file)
+  return json.dumps({"version": VERSION,
+                     "path": os.path.abspath(annotation_file),
+                     "size": stat.st_size,
+                     "mtime": stat.st_mtime}, sort_keys=True)
+
+
+def parse(annotation_file):
+  """Valid boxes of every image, sorted by image id.
+
+  Boxes are clipped to the image and normalized to [0, 1]. Boxes marked
+  ignore, with area <= 1 or smaller than 4 pixels are dropped. The boxes
+  of the i-th image are boxes[offsets[i]:offsets[i + 1]], in the order of
+  the json file.
+  """
+  with open(annotation_file) as f:
+    dataset = json.load(f)
+
+  images = sorted(dataset["images"], key=lambda img: img["id"])
+  image_ids = np.asarray([img["id"] for img in images], dtype=np.int64)
+  widths = np.asarray([img["width"] for img in images], dtype=np.float64)
+  heights = np.asarray([img["height"] for img in images], dtype=np.float64)
+  file_names = np.asarray([img["file_name"] for img in images])
+
+  anns = dataset.get("annotations", [])
+  ann_image_ids = np.asarray([ann["image_id"] for ann in anns],
+                             dtype=np.int64)
+  bbox = np.asarray([ann["bbox"] for ann in anns],
+                    dtype=np.float64).reshape(-1, 4)
+  area = np.asarray([ann["area"] for ann in anns], dtype=np.float64)
+  category_ids = np.asarray([ann["category_id"] for ann in anns],
+                            dtype=np.int64)
+  is_crowd = np.asarray([ann["iscrowd"] for ann in anns], dtype=np.int8)
+  ignore = np.asarray([ann.get("ignore", 0) for ann in anns], dtype=np.int8)
+
+  # Row of the image of every annotation
+  rows = np.searchsorted(image_ids, ann_image_ids)
+  width = widths[rows]
+  height = heights[rows]
+
+  x1 = np.clip(bbox[:, 0], 0, width - 1)
+  y1 = np.clip(bbox[:, 1], 0, height - 1)
+  x2 = np.clip(bbox[:, 0] + bbox[:, 2], 0, width - 1)
+  y2 = np.clip(bbox[:, 1] + bbox[:, 3], 0, height - 1)
+  w = x2 - x1
+  h = y2 - y1
+
+  valid = (ignore != 1) & (area > 1) & (w > 0) & (h > 0) & (w * h >= 4)
+  boxes = np.stack([x1 / width, y1 / height, x2 / width, y2 / height],
+                   axis=1)
+
+  # Group by image, keep the order of the json file within an image
+  rows = rows[valid]
+  order = np.argsort(rows, kind="mergesort")
+  rows = rows[order]
+
+  cats = dataset["categories"]
+  return {"image_ids": image_ids,
+          "file_names": file_names,
+          "offsets": np.searchsorted(rows, np.arange(len(image_ids) + 1)),
+          "category_ids": category_ids[valid][order],
+          "boxes": boxes[valid][order].astype(np.float32),
+          "is_crowd": is_crowd[valid][order],
+          "cat_ids": np.asarray([cat["id"] for cat in cats], dtype=np.int64),
+          "cat_names": np.asarray([cat["name"] for cat in cats])}
+
+
+def load(annotation_file):
+  """Parsed annotations of the json file, from the cache if it is valid."""
+  path = cache_path(annotation_file)
+  key = cache_key(annotation_file)
+
+  try:
+    with np.load(path) as cache:
+      if str(cache["key"]) == key:
+        return {name: cache[name] for name in FIELDS}
+  except (IOError, OSError, KeyError, ValueError):
+    pass
+
+  print("Parse " + annotation_file)
+  annotations = parse(annotation_file)
+
+  try:
+    # Rename, so an interrupted save never leaves a broken cache
+    tmp_path = os.path.splitext(path)[0] + ".tmp.npz"
+    np.savez(tmp_path, key=np.asarray(key), **annotations)
+    os.rename(tmp_path, path)
+  except (IOError, OSError) as e:
+    print("Cannot save the cache of {}: {}".format(annotation_file, e))
+  return annotations
@@ -27,6 +27,9 @@ class ImageClassificationSynInputter(Inputter):
   def create_nonreplicated_fn(self):
     batch_size = (self.config.batch_size_per_gpu *
                   self.config.gpu_count)
+    if self.config.mode == "train":
+      # A step applies the gradients of accumulation_steps batches
+      batch_size = batch_size * self.config.accumulation_steps
     max_step = (self.get_num_samples() * self.config.epochs // batch_size)
     tf.constant(max_step, name="max_step")
 
@@ -64,19 +67,21 @@ class ImageClassificationSynInputter(Inputter):
         lambda s: tf.constant(label_value, label_dtype, s), label_shape)
 
     dataset = tf.data.Dataset.from_tensor_slices(
-      (image_element, label_element)).repeat(self.config.epochs)
+      (image_element, label_element))
 
-    dataset = dataset.map(
-      lambda image, label: self.parse_fn(image, label),
-      num_parallel_calls=4)
+    dataset = self.shard(dataset)
+
+    dataset = dataset.repeat(self.config.epochs)
 
-    dataset = dataset.apply(
-        tf.contrib.data.batch_and_drop_remainder(batch_size))
+    dataset = self.map_and_batch(
+      dataset,
+      lambda image, label: self.parse_fn(image, label),
+      batch_size)
 
-    dataset = dataset.prefetch(2)
+    dataset = self.prefetch(dataset)
 
-    iterator = dataset.make_one_shot_iterator()
-    return iterator.get_next()
+    self.iterator = dataset.make_one_shot_iterator()
+    return self.iterator.get_next()
 
 
 def build(config, augmenter):
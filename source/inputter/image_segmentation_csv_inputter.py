@@ -5,8 +5,6 @@ Licensed under
 
 """
 from __future__ import print_function
-import os
-import csv
 
 import tensorflow as tf
 
@@ -19,6 +17,7 @@ class ImageSegmentationCSVInputter(Inputter):
     super(ImageSegmentationCSVInputter, self).__init__(config, augmenter)
 
     self.num_samples = -1
+    self.index_columns = 2
 
     if self.config.mode == "infer":
       self.test_samples = self.config.test_samples
@@ -30,39 +29,23 @@ class ImageSegmentationCSVInputter(Inputter):
       elif self.config.mode == "export":
         self.num_samples = 1        
       else:
-        self.num_samples = 0
-        for meta in self.config.dataset_meta:
-          with open(meta) as f:
-            parsed = csv.reader(f, delimiter=",", quotechar="'")
-            self.num_samples += len(list(parsed))
+        self.read_indexes()
+        self.num_samples = sum(self.meta_sizes)
     return self.num_samples
 
   def get_samples_fn(self):
-    if self.config.mode == "infer":
-      images_path = self.test_samples
-      labels_path = self.test_samples
-    elif self.config.mode == "train" or \
-            self.config.mode == "eval":
-      for meta in self.config.dataset_meta:
-        assert os.path.exists(meta), (
-          "Cannot find dataset_meta file {}.".format(meta))
-
-      images_path = []
-      labels_path = []
-
-      for meta in self.config.dataset_meta:
-        dirname = os.path.dirname(meta)
-        with open(meta) as f:
-          parsed = csv.reader(f, delimiter=",", quotechar="'")
-          for row in parsed:
-            images_path.append(os.path.join(dirname, row[0]))
-            labels_path.append(os.path.join(dirname, row[1]))
-
+    # Training and evaluation read the samples of the dataset_meta files
+    # through their indexes, see indexed_dataset
+    images_path = self.test_samples
+    labels_path = self.test_samples
     return (images_path, labels_path)
 
   def create_nonreplicated_fn(self):
     batch_size = (self.config.batch_size_per_gpu *
                   self.config.gpu_count)
+    if self.config.mode == "train":
+      # A step applies the gradients of accumulation_steps batches
+      batch_size = batch_size * self.config.accumulation_steps
     max_step = (self.get_num_samples() * self.config.epochs // batch_size)
     tf.constant(max_step, name="max_step")
 
@@ -70,6 +53,13 @@ class ImageSegmentationCSVInputter(Inputter):
     """Parse a single input sample
     """
     image = tf.read_file(image_path)
+    label = (None if self.config.mode == "infer" else
+             tf.read_file(label_path))
+    return self.decode_fn(image, label)
+
+  def decode_fn(self, image, label):
+    """Decode (and augment) the encoded image and label of a sample
+    """
     image = tf.image.decode_png(image, channels=self.config.image_depth)
 
     if self.config.mode == "infer":
@@ -78,7 +68,6 @@ class ImageSegmentationCSVInputter(Inputter):
       label = image[0]
       return image, label
     else:
-      label = tf.read_file(label_path)
       label = tf.image.decode_png(label, channels=1)
       label = tf.cast(label, dtype=tf.int64)
 
@@ -106,26 +95,25 @@ class ImageSegmentationCSVInputter(Inputter):
       batch_size = (self.config.batch_size_per_gpu *
                     self.config.gpu_count)
 
-      samples = self.get_samples_fn()
+      if self.config.mode == "infer":
+        dataset = tf.data.Dataset.from_tensor_slices(self.get_samples_fn())
+      else:
+        dataset = self.indexed_dataset()
 
-      dataset = tf.data.Dataset.from_tensor_slices(samples)
+      dataset = self.shard(dataset)
 
       if self.config.mode == "train":
-        dataset = dataset.shuffle(self.get_num_samples())
+        dataset = self.shuffle(dataset, self.indexed_sample_bytes())
 
-      dataset = dataset.repeat(self.config.epochs)
-
-      dataset = dataset.map(
+      dataset = self.preprocess(
+        dataset,
         lambda image, label: self.parse_fn(image, label),
-        num_parallel_calls=4)
-
-      dataset = dataset.apply(
-          tf.contrib.data.batch_and_drop_remainder(batch_size))
+        batch_size)
 
-      dataset = dataset.prefetch(2)
+      dataset = self.prefetch(dataset)
 
-      iterator = dataset.make_one_shot_iterator()
-      return iterator.get_next()
+      self.iterator = dataset.make_one_shot_iterator()
+      return self.iterator.get_next()
 
 
 def build(config, augmenter):
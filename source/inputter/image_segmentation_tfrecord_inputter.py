@@ -0,0 +1,26 @@
+"""
+Copyright 2018 Lambda Labs. All Rights Reserved.
+Licensed under
+==========================================================================
+
+"""
+from __future__ import print_function
+
+import tensorflow as tf
+
+from .inputter import TFRecordInputter
+from .image_segmentation_csv_inputter import ImageSegmentationCSVInputter
+
+
+class ImageSegmentationTFRecordInputter(TFRecordInputter, ImageSegmentationCSVInputter):
+  """ImageSegmentationCSVInputter that reads train and eval from TFRecord shards."""
+  def parse_example(self, serialized):
+    features = tf.parse_single_example(
+      serialized,
+      features={"image": tf.FixedLenFeature([], tf.string),
+                "label": tf.FixedLenFeature([], tf.string)})
+    return self.decode_fn(features["image"], features["label"])
+
+
+def build(config, augmenter):
+  return ImageSegmentationTFRecordInputter(config, augmenter)
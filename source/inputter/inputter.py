@@ -5,16 +5,439 @@ Licensed under
 
 """
 from __future__ import print_function
+import os
+import json
+import time
+import inspect
+import hashlib
+import multiprocessing
+
+import numpy as np
+
+import tensorflow as tf
+
+from . import manifest_index
+
+# Let tf.data tune the parallelism (not available in older tensorflow)
+AUTOTUNE = getattr(tf.contrib.data, "AUTOTUNE", None)
+
+# Hits and misses of the preprocess cache in this process
+PREPROCESS_CACHE_STATS = {"hits": 0, "misses": 0}
+
+# Inputter options that do not change the preprocessed samples
+PREPROCESS_CACHE_IGNORED_FIELDS = [
+  "batch_size_per_gpu", "gpu_count", "epochs", "accumulation_steps",
+  "train_dataset_meta", "eval_dataset_meta", "num_parallel_calls",
+  "prefetch_buffer_size", "map_and_batch", "interleave_cycle_length",
+  "input_probe_steps", "shuffle_buffer_size", "preprocess_cache"]
+
+# Batches of prefetch_buffer_size tried by probe
+PREFETCH_CANDIDATES = [1, 2, 4, 8]
 
 
 class Inputter(object):
   def __init__(self, config, augmenter):
     self.config = config
     self.augmenter = augmenter
+    self.iterator = None
+
+    # Number of samples of every dataset_meta file, set by read_indexes
+    self.meta_sizes = []
+
+    # Path columns and integer label column of the CSV dataset_meta rows
+    self.index_columns = 1
+    self.index_label_column = None
+    self.indexes = []
+
+    # Orders of the generator samples drawn by epoch_order
+    self.num_epoch_orders = 0
+
+    # Set while fill_preprocess_cache builds the input pipeline
+    self.filling_cache = False
 
   def get_num_samples(self, *argv):
     pass
 
+  def data_files(self):
+    """Files the samples are read from, e.g. the dataset_meta files.
+
+    A change of their size or modification time invalidates the graph and
+    preprocess caches.
+    """
+    return [meta for meta in (self.config.dataset_meta or [])
+            if os.path.isfile(meta)]
+
+  def shard(self, dataset):
+    """Keep the samples of this worker in distributed training.
+
+    Shard before shuffling, so the workers read disjoint samples.
+    """
+    if self.config.num_workers > 1:
+      dataset = dataset.shard(self.config.num_workers,
+                              self.config.worker_index)
+    return dataset
+
+  def num_parallel_calls(self):
+    if self.config.num_parallel_calls > 0:
+      return self.config.num_parallel_calls
+    elif AUTOTUNE is not None:
+      return AUTOTUNE
+    else:
+      return multiprocessing.cpu_count()
+
+  def shuffle_seed(self):
+    # The workers shard after the first level of the shuffle, so they need
+    # the same order of files and blocks
+    return 0 if self.config.num_workers > 1 else None
+
+  def epoch_order(self, num_samples):
+    """Order of the samples of a generator.
+
+    The generator is called anew every epoch, in training every call draws
+    a new permutation, the first level of the shuffle.
+    """
+    if self.config.mode != "train":
+      return range(num_samples)
+    seed = self.shuffle_seed()
+    if seed is not None:
+      seed = seed + self.num_epoch_orders
+    self.num_epoch_orders = self.num_epoch_orders + 1
+    return np.random.RandomState(seed).permutation(num_samples)
+
+  def shuffle(self, dataset, sample_bytes=0):
+    """Second level of the training shuffle.
+
+    The first level shuffles the order of the files, shards or blocks of
+    samples every epoch, then a buffer of shuffle_buffer_size samples mixes
+    them. A sample drawn from the buffer is a uniform pick among the
+    buffered samples, which come from the blocks read last. The buffer
+    only moves a sample about shuffle_buffer_size positions, a buffer of
+    the whole dataset is a uniform shuffle.
+
+    Args:
+      sample_bytes: estimated size of a sample, to report the memory of the
+        buffer.
+    """
+    buffer_size = self.config.shuffle_buffer_size
+    if self.get_num_samples() > 0:
+      buffer_size = min(buffer_size, self.get_num_samples())
+    print("Shuffle buffer: {} samples, about {:.1f} MB".format(
+      buffer_size, buffer_size * sample_bytes / 1024.0 / 1024.0))
+    return dataset.shuffle(buffer_size)
+
+  def read_indexes(self):
+    """ManifestIndex of every CSV dataset_meta file."""
+    if not self.indexes:
+      for meta in self.config.dataset_meta:
+        assert os.path.exists(meta), (
+          "Cannot find dataset_meta file {}.".format(meta))
+      self.indexes = [
+        manifest_index.ManifestIndex(meta,
+                                     self.index_columns,
+                                     self.index_label_column)
+        for meta in self.config.dataset_meta]
+      self.meta_sizes = [index.num_samples for index in self.indexes]
+    return self.indexes
+
+  def indexed_dataset(self):
+    """Samples of the CSV dataset_meta files, read through their indexes.
+
+    Every file is read once into a string tensor and the paths are cut out
+    of it at the offsets of the index, so the paths are never held in
+    python lists. The offsets, lengths and labels are read from the .npy
+    files of the index by the pipeline as well, so they are no constants of
+    the graph. interleave_cycle_length files are read in parallel.
+    Training reads the files and blocks of shuffle_buffer_size rows of
+    every file in a random order, the first level of the shuffle.
+    """
+    indexes = self.read_indexes()
+    num_files = len(indexes)
+
+    metas = tf.constant(self.config.dataset_meta)
+    prefixes = tf.constant([os.path.join(os.path.dirname(meta), "")
+                            for meta in self.config.dataset_meta])
+    sizes = tf.constant(self.meta_sizes, tf.int64)
+
+    if all(index.saved for index in indexes):
+      # Path, header size and array of offsets, lengths (and labels)
+      arrays = list(zip(*[index.arrays() for index in indexes]))
+      paths = [tf.constant([path for path, _, _ in x]) for x in arrays]
+      headers = [tf.constant([header for _, header, _ in x], tf.int64)
+                 for x in arrays]
+      num_bytes = [tf.constant([x.nbytes for _, _, x in y], tf.int64)
+                   for y in arrays]
+
+      def read_rows(i):
+        rows = []
+        for path, header, size in zip(paths, headers, num_bytes):
+          data = tf.substr(tf.read_file(path[i]), header[i], size[i])
+          rows.append(tf.decode_raw(data, tf.int64))
+        rows[0] = tf.reshape(rows[0], [-1, self.index_columns])
+        rows[1] = tf.reshape(rows[1], [-1, self.index_columns])
+        return tuple(rows)
+    else:
+      # An index that could not be saved only lives in memory
+      begins = tf.constant(np.cumsum([0] + self.meta_sizes[:-1]), tf.int64)
+      rows = [np.concatenate([index.offsets for index in indexes]),
+              np.concatenate([index.lengths for index in indexes])]
+      if self.index_label_column is not None:
+        rows.append(np.concatenate([index.labels for index in indexes]))
+      rows = [tf.constant(x) for x in rows]
+
+      def read_rows(i):
+        return tuple(x[begins[i]:begins[i] + sizes[i]] for x in rows)
+
+    def cut(file, row):
+      contents, prefix = file
+      offsets, lengths = row[:2]
+      sample = tuple(
+        tf.string_join([prefix, tf.substr(contents, offsets[i], lengths[i])])
+        for i in range(self.index_columns)) + tuple(row[2:])
+      return sample if len(sample) > 1 else sample[0]
+
+    cycle_length = self.config.interleave_cycle_length
+    block_size = max(self.config.shuffle_buffer_size, 1)
+    training = (self.config.mode == "train")
+
+    def file_dataset(i):
+      file = tf.data.Dataset.from_tensors((tf.read_file(metas[i]),
+                                           prefixes[i]))
+      file_rows = read_rows(i)
+
+      if training:
+        # First level of the shuffle: blocks of block_size rows in a new
+        # order every epoch, cycle_length blocks at a time
+        def block_dataset(j):
+          return tf.data.Dataset.from_tensor_slices(
+            tuple(x[j * block_size:(j + 1) * block_size] for x in file_rows))
+
+        num_blocks = (sizes[i] + block_size - 1) // block_size
+        file_rows = tf.data.Dataset.range(num_blocks).shuffle(
+          num_blocks, seed=self.shuffle_seed()).apply(
+            tf.contrib.data.parallel_interleave(block_dataset,
+                                                cycle_length=cycle_length))
+      else:
+        file_rows = tf.data.Dataset.from_tensor_slices(file_rows)
+
+      return tf.data.Dataset.zip((file.repeat(), file_rows)).map(cut)
+
+    files = tf.data.Dataset.range(num_files)
+    if training:
+      files = files.shuffle(num_files, seed=self.shuffle_seed())
+    return files.apply(
+      tf.contrib.data.parallel_interleave(
+        file_dataset, cycle_length=min(cycle_length, num_files)))
+
+  def indexed_sample_bytes(self):
+    """Average size of a sample of indexed_dataset."""
+    indexes = self.read_indexes()
+    num_samples = max(sum(self.meta_sizes), 1)
+    sample_bytes = sum(
+      float(np.sum(index.lengths)) +
+      index.num_samples * self.index_columns * len(os.path.dirname(meta))
+      for index, meta in zip(indexes, self.config.dataset_meta)) / num_samples
+    if self.index_label_column is not None:
+      sample_bytes = sample_bytes + 8
+    return sample_bytes
+
+  def read_manifests(self):
+    """Shards and number of samples of the dataset_meta manifests.
+
+    A manifest is written by source/tool/csv_to_tfrecord.py, the paths of
+    its shards are relative to it.
+    """
+    shards = []
+    num_samples = 0
+    for meta in self.config.dataset_meta:
+      with open(meta) as f:
+        manifest = json.load(f)
+      dirname = os.path.dirname(meta)
+      for shard in manifest["shards"]:
+        shards.append(os.path.join(dirname, shard["path"]))
+        num_samples += shard["num_samples"]
+    return shards, num_samples
+
+  def tfrecord_dataset(self, shards):
+    """Serialized examples of the shards.
+
+    Training shuffles the order of the shards (anew every time the dataset
+    is repeated), then the samples with shuffle.
+    """
+    dataset = tf.data.Dataset.from_tensor_slices(shards)
+
+    dataset = self.shard(dataset)
+
+    if self.config.mode == "train":
+      dataset = dataset.shuffle(len(shards))
+
+    dataset = dataset.apply(tf.contrib.data.parallel_interleave(
+      tf.data.TFRecordDataset,
+      cycle_length=min(self.config.interleave_cycle_length, len(shards)),
+      sloppy=(self.config.mode == "train")))
+
+    if self.config.mode == "train":
+      sample_bytes = (sum(os.path.getsize(shard) for shard in shards) /
+                      float(max(self.get_num_samples(), 1)))
+      dataset = self.shuffle(dataset, sample_bytes)
+
+    return dataset
+
+  def caching(self):
+    # Only eval and infer preprocess the samples the same way every time
+    return (bool(self.config.preprocess_cache) and
+            self.config.mode in ["eval", "infer"])
+
+  def preprocess_cache_path(self):
+    """File of the cache, keyed by the samples and how they are parsed."""
+    cache_dir = os.path.expanduser(self.config.preprocess_cache)
+    if not os.path.isdir(cache_dir):
+      os.makedirs(cache_dir)
+
+    fields = {key: value for key, value in vars(self.config).items()
+              if key not in PREPROCESS_CACHE_IGNORED_FIELDS}
+    # A changed data file invalidates the cache
+    fields["dataset_meta_stats"] = [
+      (os.path.getmtime(path), os.path.getsize(path))
+      for path in self.data_files()]
+    key = json.dumps(fields, sort_keys=True, default=str)
+    key = key + type(self).__name__
+    if self.augmenter:
+      key = key + inspect.getsource(self.augmenter)
+    return os.path.join(cache_dir,
+                        hashlib.sha1(key.encode("utf-8")).hexdigest())
+
+  def cache_preprocessed(self, dataset, map_fn):
+    """Parse the samples once, later runs read them from the cache.
+
+    tf.data only keeps a cache that has been read to the end, so a miss
+    reads the whole dataset once before the run, see fill_preprocess_cache.
+    The memory cache only lives in this run: the first epoch fills it, the
+    later epochs read it.
+    """
+    dataset = dataset.map(map_fn, num_parallel_calls=self.num_parallel_calls())
+    if self.config.preprocess_cache == "memory":
+      return dataset.cache()
+
+    path = self.preprocess_cache_path()
+    dataset = dataset.cache(path)
+
+    if self.filling_cache:
+      return dataset
+
+    if tf.gfile.Exists(path + ".index"):
+      PREPROCESS_CACHE_STATS["hits"] += 1
+      print("Preprocess cache hit: " + path)
+    else:
+      PREPROCESS_CACHE_STATS["misses"] += 1
+      print("Preprocess cache miss, fill " + path)
+      self.fill_preprocess_cache()
+
+    print("Preprocess cache hits: {} misses: {}".format(
+      PREPROCESS_CACHE_STATS["hits"], PREPROCESS_CACHE_STATS["misses"]))
+    return dataset
+
+  def fill_preprocess_cache(self):
+    """Read one epoch of input_fn in a separate graph, like probe.
+
+    Keeps the iterator and session of the fill out of the model graph.
+    """
+    epochs = self.config.epochs
+    self.config.epochs = 1
+    self.filling_cache = True
+    try:
+      with tf.Graph().as_default():
+        batch = self.input_fn()
+        with tf.Session(
+            config=tf.ConfigProto(allow_soft_placement=True)) as sess:
+          try:
+            while True:
+              sess.run(batch)
+          except tf.errors.OutOfRangeError:
+            pass
+    finally:
+      self.config.epochs = epochs
+      self.filling_cache = False
+      self.iterator = None
+
+  def preprocess(self, dataset, map_fn, batch_size):
+    """Repeat the samples for all epochs, parse and batch them."""
+    if self.caching():
+      dataset = self.cache_preprocessed(dataset, map_fn)
+      dataset = dataset.repeat(self.config.epochs)
+      return dataset.apply(
+        tf.contrib.data.batch_and_drop_remainder(batch_size))
+    else:
+      dataset = dataset.repeat(self.config.epochs)
+      return self.map_and_batch(dataset, map_fn, batch_size)
+
+  def map_and_batch(self, dataset, map_fn, batch_size):
+    if self.config.map_and_batch:
+      # Fused: the parsed samples are written straight into the batch
+      return dataset.apply(tf.contrib.data.map_and_batch(
+        map_fn, batch_size,
+        num_parallel_calls=self.num_parallel_calls(),
+        drop_remainder=True))
+    else:
+      dataset = dataset.map(map_fn,
+                            num_parallel_calls=self.num_parallel_calls())
+      return dataset.apply(
+        tf.contrib.data.batch_and_drop_remainder(batch_size))
+
+  def prefetch(self, dataset):
+    buffer_size = self.config.prefetch_buffer_size
+    if buffer_size <= 0:
+      buffer_size = AUTOTUNE if AUTOTUNE is not None else 2
+    return dataset.prefetch(buffer_size)
+
+  def probe_speed(self):
+    """Batches per second of input_fn, built in a separate graph."""
+    with tf.Graph().as_default():
+      batch = self.input_fn()
+      with tf.Session() as sess:
+        # The first batch also fills the buffers
+        sess.run(batch)
+        num_batches = 0
+        time_before = time.time()
+        try:
+          for _ in range(self.config.input_probe_steps):
+            sess.run(batch)
+            num_batches = num_batches + 1
+        except tf.errors.OutOfRangeError:
+          pass
+        return num_batches / max(time.time() - time_before, 1e-6)
+
+  def probe(self):
+    """Pick the pipeline knobs by the measured speed of the input pipeline.
+
+    Runs input_probe_steps batches of input_fn for every candidate
+    num_parallel_calls, then for every candidate prefetch_buffer_size with
+    the fastest num_parallel_calls.
+    """
+    if (self.config.input_probe_steps <= 0 or
+        self.config.mode not in ["train", "eval"]):
+      return
+
+    num_cpus = multiprocessing.cpu_count()
+    candidates = [
+      ("num_parallel_calls",
+       sorted(set([2 ** i for i in range(num_cpus.bit_length())] +
+                  [num_cpus]))),
+      ("prefetch_buffer_size", PREFETCH_CANDIDATES)]
+
+    print("Probe input pipeline (" + str(self.config.input_probe_steps) +
+          " batches each):")
+    for name, values in candidates:
+      results = []
+      for value in values:
+        setattr(self.config, name, value)
+        speed = self.probe_speed()
+        print("{}: {:<6} batches/s: {:.2f}".format(name, value, speed))
+        results.append((speed, value))
+      setattr(self.config, name, max(results)[1])
+      print("Use " + name + " " + str(getattr(self.config, name)))
+
+    self.iterator = None
+
   def parse_fn(self, mode, *argv):
     pass
 
@@ -22,5 +445,43 @@ class Inputter(object):
     pass
 
 
+class TFRecordInputter(object):
+  """Read the samples of train and eval from the sharded TFRecord files.
+
+  dataset_meta are manifests written by source/tool/csv_to_tfrecord.py.
+  Mixed in before a CSV inputter, which reads the test samples of infer
+  and export. Subclasses define parse_example, the parse_fn of a
+  serialized example.
+  """
+  def get_num_samples(self):
+    if self.num_samples < 0 and self.config.mode in ["train", "eval"]:
+      _, self.num_samples = self.read_manifests()
+    return super(TFRecordInputter, self).get_num_samples()
+
+  def parse_example(self, serialized):
+    pass
+
+  def input_fn(self, test_samples=[]):
+    if self.config.mode not in ["train", "eval"]:
+      return super(TFRecordInputter, self).input_fn(test_samples)
+
+    batch_size = (self.config.batch_size_per_gpu *
+                  self.config.gpu_count)
+
+    shards, _ = self.read_manifests()
+
+    dataset = self.tfrecord_dataset(shards)
+
+    dataset = self.preprocess(
+      dataset,
+      lambda serialized: self.parse_example(serialized),
+      batch_size)
+
+    dataset = self.prefetch(dataset)
+
+    self.iterator = dataset.make_one_shot_iterator()
+    return self.iterator.get_next()
+
+
 def build(config, augmenter):
   return Inputter(config, augmenter)
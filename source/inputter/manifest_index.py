@@ -0,0 +1,171 @@
+"""
+Copyright 2018 Lambda Labs. All Rights Reserved.
+Licensed under
+==========================================================================
+
+Binary index of a CSV dataset_meta file.
+
+The index keeps the byte offset and length of the leading (path) columns of
+every row and the integer labels in numpy arrays, stored next to the CSV
+file in <meta>.index/. It is built on the first use and memory mapped
+afterwards, so counting and enumerating the samples never parse the CSV
+file again. A change of the size or modification time of the CSV file
+rebuilds the index.
+"""
+from __future__ import print_function
+import os
+import json
+
+import numpy as np
+
+
+# Bump to rebuild the indexes written by older code
+VERSION = 1
+
+DELIMITER = b","
+QUOTECHAR = b"'"
+
+
+def index_dir(meta):
+  return meta + ".index"
+
+
+def split_fields(line, num_fields):
+  """Byte spans (begin, length) of the first num_fields fields of a row.
+
+  Quoted fields may contain the delimiter but no (escaped) quotechar.
+  """
+  spans = []
+  pos = 0
+  for i in range(num_fields):
+    if i > 0:
+      if line[pos:pos + 1] != DELIMITER:
+        raise ValueError(
+          "Expected {} columns in row {!r}.".format(num_fields, line))
+      pos = pos + 1
+
+    if line[pos:pos + 1] == QUOTECHAR:
+      end = line.find(QUOTECHAR, pos + 1)
+      if end < 0:
+        raise ValueError("Unterminated quote in row {!r}.".format(line))
+      spans.append((pos + 1, end - pos - 1))
+      pos = end + 1
+    else:
+      end = line.find(DELIMITER, pos)
+      end = len(line) if end < 0 else end
+      spans.append((pos, end - pos))
+      pos = end
+  return spans
+
+
+class ManifestIndex(object):
+  """Rows of a CSV dataset_meta file.
+
+  Attributes:
+    num_samples: number of (non-empty) rows.
+    offsets: int64 array [num_samples, columns], byte offset of every path
+      column in the CSV file.
+    lengths: int64 array [num_samples, columns], byte length of every path
+      column.
+    labels: int64 array [num_samples] of the label column, None without
+      label column.
+    saved: whether the arrays are in the .npy files of paths.
+  """
+  def __init__(self, meta, columns, label_column=None):
+    self.meta = meta
+    self.columns = columns
+    self.label_column = label_column
+
+    stat = os.stat(meta)
+    self.key = {"version": VERSION,
+                "mtime": stat.st_mtime,
+                "size": stat.st_size,
+                "columns": columns,
+                "label_column": label_column}
+
+    self.saved = self.load()
+    if not self.saved:
+      self.build()
+      self.saved = self.save()
+
+    self.num_samples = len(self.offsets)
+
+  def paths(self):
+    return [os.path.join(index_dir(self.meta), name + ".npy")
+            for name in ["offsets", "lengths", "labels"]]
+
+  def arrays(self):
+    """(path, header size, array) of offsets, lengths and labels.
+
+    The data of an array starts after the header of its .npy file.
+    """
+    return [(path, os.path.getsize(path) - array.nbytes, array)
+            for path, array in zip(self.paths(),
+                                   [self.offsets, self.lengths, self.labels])
+            if array is not None]
+
+  def load(self):
+    info_path = os.path.join(index_dir(self.meta), "index.json")
+    try:
+      with open(info_path) as f:
+        if json.load(f) != self.key:
+          return False
+    except (IOError, OSError, ValueError):
+      return False
+
+    offsets_path, lengths_path, labels_path = self.paths()
+    self.offsets = np.load(offsets_path, mmap_mode="r")
+    self.lengths = np.load(lengths_path, mmap_mode="r")
+    self.labels = (None if self.label_column is None else
+                   np.load(labels_path, mmap_mode="r"))
+    return True
+
+  def build(self):
+    print("Build the index of " + self.meta)
+    num_fields = self.columns
+    if self.label_column is not None:
+      num_fields = max(num_fields, self.label_column + 1)
+
+    offsets = []
+    lengths = []
+    labels = []
+    with open(self.meta, "rb") as f:
+      offset = 0
+      for line in f:
+        row = line.rstrip(b"\r\n")
+        if row:
+          spans = split_fields(row, num_fields)
+          for begin, length in spans[:self.columns]:
+            offsets.append(offset + begin)
+            lengths.append(length)
+          if self.label_column is not None:
+            begin, length = spans[self.label_column]
+            labels.append(int(row[begin:begin + length]))
+        offset = offset + len(line)
+
+    self.offsets = np.array(offsets, np.int64).reshape(-1, self.columns)
+    self.lengths = np.array(lengths, np.int64).reshape(-1, self.columns)
+    self.labels = (None if self.label_column is None else
+                   np.array(labels, np.int64))
+
+  def save(self):
+    path = index_dir(self.meta)
+    info_path = os.path.join(path, "index.json")
+    offsets_path, lengths_path, labels_path = self.paths()
+    try:
+      if not os.path.isdir(path):
+        os.makedirs(path)
+      # The arrays are only valid once index.json is written
+      if os.path.exists(info_path):
+        os.remove(info_path)
+      np.save(offsets_path, self.offsets)
+      np.save(lengths_path, self.lengths)
+      if self.labels is not None:
+        np.save(labels_path, self.labels)
+      with open(info_path, "w") as f:
+        json.dump(self.key, f)
+      return True
+    except (IOError, OSError) as e:
+      # For example a read-only dataset directory, keep the index in memory
+      print("Cannot save the index of {}: {}".format(self.meta, e))
+      return False
@@ -11,8 +11,8 @@ import math
 
 import tensorflow as tf
 
+from . import coco_annotations
 from .inputter import Inputter
-from pycocotools.coco import COCO
 from source.augmenter.external import vgg_preprocessing
 
 
@@ -36,65 +36,72 @@ class ObjectDetectionMSCOCOInputter(Inputter):
     self.class_id_to_category_id = None
     self.cat_names = None
 
-    # Has to be more than num_gpu * batch_size_per_gpu
-    # Otherwise no valid batch will be produced    
-    self.TRAIN_NUM_SAMPLES = 117266 # train2014 + valminusminival2014
-    self.EVAL_NUM_SAMPLES = 4952 # val2017 (same as test-dev2015)
+    # Derived from the annotations, has to be more than
+    # num_gpu * batch_size_per_gpu. Otherwise no valid batch will be produced
+    self.TRAIN_NUM_SAMPLES = None
+    self.EVAL_NUM_SAMPLES = None
 
     if self.config.mode == "infer":
       self.test_samples = self.config.test_samples
+      self.build_gt_columns()
     elif self.config.mode == "export":
       pass
     else:
-      self.parse_coco()
+      self.build_gt_columns(self.parse_coco())
+      if self.config.mode == "train":
+        self.TRAIN_NUM_SAMPLES = len(self.image_ids)
+      else:
+        self.EVAL_NUM_SAMPLES = len(self.image_ids)
 
     self.num_samples = self.get_num_samples()
 
+  def annotation_files(self):
+    return [os.path.join(self.config.dataset_dir,
+                         "annotations",
+                         "instances_" + name_meta + ".json")
+            for name_meta in self.config.dataset_meta]
 
-  def parse_coco(self):
-    samples = []
-    for name_meta in self.config.dataset_meta:
-      annotation_file = os.path.join(
-        self.config.dataset_dir,
-        "annotations",
-        "instances_" + name_meta + ".json")
+  def data_files(self):
+    if self.config.mode in ["train", "eval"]:
+      return [path for path in self.annotation_files()
+              if os.path.isfile(path)]
+    return []
 
-      coco = COCO(annotation_file)
+  def parse_coco(self):
+    """Annotations of all dataset_meta files, one row per image."""
+    columns = {"image_ids": [], "file_names": [], "counts": [],
+               "classes": [], "boxes": [], "is_crowd": []}
+    for name_meta, annotation_file in zip(self.config.dataset_meta,
+                                          self.annotation_files()):
+      annotations = coco_annotations.load(annotation_file)
 
-      cat_ids = coco.getCatIds()
-      self.cat_names = [c["name"] for c in coco.loadCats(cat_ids)]
+      cat_ids = [int(v) for v in annotations["cat_ids"]]
+      self.cat_names = [str(name) for name in annotations["cat_names"]]
 
       # background has class id of 0
       self.category_id_to_class_id = {
         v: i + 1 for i, v in enumerate(cat_ids)}
       self.class_id_to_category_id = {
         v: k for k, v in self.category_id_to_class_id.items()}
-
-      img_ids = coco.getImgIds()
-      img_ids.sort()
-
-      # list of dict, each has keys: height,width,id,file_name
-      imgs = coco.loadImgs(img_ids)
-
-      for img in imgs:
-        img["file_name"] = os.path.join(
-          self.config.dataset_dir,
-          JSON_TO_IMAGE[name_meta],
-          img["file_name"])
-
-      if self.config.mode == "train":
-        for img in imgs:
-          self.parse_gt(coco, self.category_id_to_class_id, img)
-
-      samples.extend(imgs)
-
-    # Filter out images that has no object.
-    if self.config.mode == "train":
-      samples = list(filter(
-        lambda sample: len(
-          sample['boxes'][sample['is_crowd'] == 0]) > 0, samples))
-
-    self.samples = samples
+      class_ids = np.zeros([max(cat_ids) + 1], dtype=np.int64)
+      class_ids[cat_ids] = np.arange(1, len(cat_ids) + 1)
+
+      image_dir = os.path.join(self.config.dataset_dir,
+                               JSON_TO_IMAGE[name_meta])
+
+      columns["image_ids"].append(annotations["image_ids"])
+      columns["file_names"].extend(
+        os.path.join(image_dir, str(file_name))
+        for file_name in annotations["file_names"])
+      columns["counts"].append(np.diff(annotations["offsets"]))
+      columns["classes"].append(class_ids[annotations["category_ids"]])
+      columns["boxes"].append(annotations["boxes"])
+      columns["is_crowd"].append(annotations["is_crowd"])
+
+    for key in columns:
+      if key != "file_names":
+        columns[key] = np.concatenate(columns[key])
+    return columns
 
   def get_num_samples(self):
     if not hasattr(self, 'num_samples'):
@@ -108,90 +115,97 @@ class ObjectDetectionMSCOCOInputter(Inputter):
         self.num_samples = self.TRAIN_NUM_SAMPLES
     return self.num_samples
 
-  def get_samples_fn(self):
-    # Args:
-    # Returns:
-    #     sample["id"]: int64, image id
-    #     sample["file_name"]: , string, path to image
-    #     sample["class"]: (...,), int64
-    #     sample["boxes"]: (..., 4), float32
-    # Read image
+  def build_gt_columns(self, columns=None):
+    """Columnar ground truth of the samples, built once.
+
+    The boxes and classes of all images are concatenated into flat arrays,
+    the objects of the i-th image are
+    gt_boxes[gt_offsets[i]:gt_offsets[i + 1]]. Training removes the crowd
+    objects and the images without other objects, evaluation the images
+    without objects.
+
+    Args:
+      columns: annotations of parse_coco, None in inference.
+    """
     if self.config.mode == "infer":
-      for file_name in self.test_samples:
-        yield (0,
-               file_name,
-               np.empty([1], dtype=np.int32),
-               np.empty([1, 4]))
-    elif self.config.mode == "eval":
-      for sample in self.samples[0:self.num_samples]:
-        yield(sample["id"],
-              sample["file_name"],
-              np.empty([1], dtype=np.int32),
-              np.empty([1, 4]))
+      self.image_ids = np.zeros([len(self.test_samples)], dtype=np.int64)
+      self.file_names = list(self.test_samples)
+      counts = np.zeros([len(self.test_samples)], dtype=np.int64)
+      classes = np.zeros([0], dtype=np.int64)
+      boxes = np.zeros([0, 4], dtype=np.float32)
     else:
-      for sample in self.samples[0:self.num_samples]:
-        # remove crowd objects
-        mask = sample['is_crowd'] == 0
-        sample["class"] = sample["class"][mask]
-        sample["boxes"] = sample["boxes"][mask, :]
-        sample["is_crowd"] = sample["is_crowd"][mask]
-
-        yield (sample["id"],
-               sample["file_name"],
-               sample["class"],
-               sample["boxes"])
-
-  def parse_gt(self, coco, category_id_to_class_id, img):
-    ann_ids = coco.getAnnIds(imgIds=img["id"], iscrowd=None)
-    objs = coco.loadAnns(ann_ids)
-
-    # clean-up boxes
-    valid_objs = []
-    width = img["width"]
-    height = img["height"]
-
-    for obj in objs:
-      if obj.get("ignore", 0) == 1:
-          continue
-      x1, y1, w, h = obj["bbox"]
-
-      x1 = float(x1)
-      y1 = float(y1)
-      x2 = float(x1 + w)
-      y2 = float(y1 + h)
-
-      x1 = max(0, min(float(x1), width - 1))
-      y1 = max(0, min(float(y1), height - 1))
-      x2 = max(0, min(float(x2), width - 1))
-      y2 = max(0, min(float(y2), height - 1))
-
-      w = x2 - x1
-      h = y2 - y1
-
-      if obj['area'] > 1 and w > 0 and h > 0 and w * h >= 4:
-        # normalize box to [0, 1]
-        obj['bbox'] = [x1 / float(width), y1 / float(height), x2 / float(width), y2 / float(height)]
-        valid_objs.append(obj)
-
-    boxes = np.asarray([obj['bbox'] for obj in valid_objs], dtype='float32')  # (n, 4)
-
-    cls = np.asarray([
-        category_id_to_class_id[obj['category_id']]
-        for obj in valid_objs], dtype='int32')  # (n,)
-
-    is_crowd = np.asarray([obj['iscrowd'] for obj in valid_objs], dtype='int8')
-
-    img['boxes'] = boxes # nx4
-    img['class'] = cls # n, always >0
-    img['is_crowd'] = is_crowd # n,
+      counts = columns["counts"]
+      classes = columns["classes"]
+      boxes = columns["boxes"]
+
+      if self.config.mode == "train":
+        keep = columns["is_crowd"] == 0
+        rows = np.repeat(np.arange(len(counts)), counts)[keep]
+        classes = classes[keep]
+        boxes = boxes[keep]
+        counts = np.bincount(rows, minlength=len(counts))
+
+      images = np.flatnonzero(counts > 0)
+      self.image_ids = columns["image_ids"][images]
+      self.file_names = [columns["file_names"][i] for i in images]
+      counts = counts[images]
+
+      if self.config.mode != "train":
+        # Evaluation has no ground truth in the pipeline
+        counts = np.zeros_like(counts)
+        classes = classes[:0]
+        boxes = boxes[:0]
+
+    self.gt_classes = classes.astype(np.int64)
+    self.gt_boxes = boxes.astype(np.float32).reshape(-1, 4)
+    self.gt_offsets = np.cumsum(np.append(0, counts)).astype(np.int64)
+
+  def gt_dataset(self):
+    """Samples (image id, file name, classes, boxes) of the ground truth.
+
+    Training shuffles the indices of all images every epoch (a uniform and
+    cheap shuffle, an int64 per image), the samples are gathered
+    afterwards.
+    """
+    image_ids = tf.constant(self.image_ids)
+    file_names = tf.constant(self.file_names)
+    offsets = tf.constant(self.gt_offsets)
+    gt_classes = tf.constant(self.gt_classes)
+    gt_boxes = tf.constant(self.gt_boxes)
+
+    def gather(i):
+      if self.config.mode == "train":
+        classes = gt_classes[offsets[i]:offsets[i + 1]]
+        boxes = gt_boxes[offsets[i]:offsets[i + 1]]
+      else:
+        classes = tf.zeros([1], dtype=tf.int64)
+        boxes = tf.zeros([1, 4], dtype=tf.float32)
+      return image_ids[i], file_names[i], classes, boxes
+
+    dataset = tf.data.Dataset.range(len(self.file_names))
+
+    dataset = self.shard(dataset)
+
+    if self.config.mode == "train":
+      num_images = len(self.file_names)
+      print("Shuffle buffer: {} image indices, about {:.1f} MB".format(
+        num_images, num_images * 8 / 1024.0 / 1024.0))
+      dataset = dataset.shuffle(num_images, seed=self.shuffle_seed())
+
+    return dataset.map(gather, num_parallel_calls=self.num_parallel_calls())
 
   def create_nonreplicated_fn(self):
     batch_size = (self.config.batch_size_per_gpu *
                   self.config.gpu_count)
+    if self.config.mode == "train":
+      # A step applies the gradients of accumulation_steps batches
+      batch_size = batch_size * self.config.accumulation_steps
 
     max_step = (self.get_num_samples() * self.config.epochs // batch_size)
 
     tf.constant(max_step, name="max_step")
+    tf.constant(max(self.get_num_samples() // batch_size, 1),
+                name="steps_per_epoch")
 
   def parse_fn(self, image_id, file_name, classes, boxes):
     """Parse a single input sample
@@ -202,17 +216,52 @@ class ObjectDetectionMSCOCOInputter(Inputter):
 
     scale = [0, 0]
     translation = [0, 0]
+    # Size of the image without the padding of the augmenter, to bucket
+    # the samples and measure the padding of the batch
+    size = tf.shape(image)[:2]
     if self.augmenter:
       is_training = (self.config.mode == "train")
-      image, classes, boxes, scale, translation = self.augmenter.augment(
-        image,
-        classes,
-        boxes,
-        self.config.resolution,
-        is_training=is_training,
-        speed_mode=False)
+      image, classes, boxes, scale, translation, size = (
+        self.augmenter.augment(
+          image,
+          classes,
+          boxes,
+          self.config.resolution,
+          is_training=is_training,
+          speed_mode=False,
+          with_size=True))
+
+    return ([image_id], image, classes, boxes, scale, translation,
+            [file_name], size)
+
+  def padded_batch(self, dataset, batch_size):
+    """Batch the samples, padding the images to the largest of the batch.
+
+    With bucket_boundaries (aspect ratios width / height) the samples are
+    grouped by the bucket of the aspect ratio of their unpadded image
+    first, so images of a batch have similar shapes. This only saves
+    padding if the augmenter outputs images of different shapes; the
+    ssd_augmenter pads every image to resolution x resolution.
+    """
+    padded_shapes = ([None], [None, None, 3], [None], [None, 4], [None],
+                     [None], [None], [2])
+
+    if not self.config.bucket_boundaries:
+      return dataset.padded_batch(batch_size, padded_shapes=padded_shapes)
+
+    boundaries = tf.constant(self.config.bucket_boundaries, dtype=tf.float32)
 
-    return ([image_id], image, classes, boxes, scale, translation, [file_name])
+    def bucket(*sample):
+      size = tf.to_float(sample[-1])
+      aspect_ratio = size[1] / tf.maximum(size[0], 1.0)
+      return tf.reduce_sum(
+        tf.to_int64(tf.greater_equal(aspect_ratio, boundaries)))
+
+    def batch(key, window):
+      return window.padded_batch(batch_size, padded_shapes=padded_shapes)
+
+    return dataset.apply(tf.contrib.data.group_by_window(
+      bucket, batch, window_size=batch_size))
 
   def input_fn(self, test_samples=[]):
     if self.config.mode == "export":
@@ -231,31 +280,25 @@ class ObjectDetectionMSCOCOInputter(Inputter):
       batch_size = (self.config.batch_size_per_gpu *
                     self.config.gpu_count)
 
-      dataset = tf.data.Dataset.from_generator(
-        generator=lambda: self.get_samples_fn(),
-        output_types=(tf.int64,
-                      tf.string,
-                      tf.int64,
-                      tf.float32))
-
-      if self.config.mode == "train":
-        dataset = dataset.shuffle(self.get_num_samples())
+      dataset = self.gt_dataset()
 
-      dataset = dataset.repeat(self.config.epochs)
+      map_fn = (lambda image_id, file_name, classes, boxes: self.parse_fn(
+        image_id, file_name, classes, boxes))
 
-      dataset = dataset.map(
-        lambda image_id, file_name, classes, boxes: self.parse_fn(
-          image_id, file_name, classes, boxes),
-        num_parallel_calls=12)
+      if self.caching():
+        dataset = self.cache_preprocessed(dataset, map_fn)
+        dataset = dataset.repeat(self.config.epochs)
+      else:
+        dataset = dataset.repeat(self.config.epochs)
+        dataset = dataset.map(map_fn,
+                              num_parallel_calls=self.num_parallel_calls())
 
-      dataset = dataset.padded_batch(
-        batch_size,
-        padded_shapes=([None], [None, None, 3], [None], [None, 4], [None], [None], [None]))
+      dataset = self.padded_batch(dataset, batch_size)
 
-      dataset = dataset.prefetch(2)
+      dataset = self.prefetch(dataset)
 
-      iterator = dataset.make_one_shot_iterator()
-      return iterator.get_next()
+      self.iterator = dataset.make_one_shot_iterator()
+      return self.iterator.get_next()
 
 
 def build(config, augmenter):
@@ -0,0 +1,25 @@
+"""
+Copyright 2018 Lambda Labs. All Rights Reserved.
+Licensed under
+==========================================================================
+
+"""
+from __future__ import print_function
+
+import tensorflow as tf
+
+from .inputter import TFRecordInputter
+from .style_transfer_csv_inputter import StyleTransferCSVInputter
+
+
+class StyleTransferTFRecordInputter(TFRecordInputter, StyleTransferCSVInputter):
+  """StyleTransferCSVInputter that reads train and eval from TFRecord shards."""
+  def parse_example(self, serialized):
+    features = tf.parse_single_example(
+      serialized,
+      features={"image": tf.FixedLenFeature([], tf.string)})
+    return self.decode_fn(features["image"])
+
+
+def build(config, augmenter):
+  return StyleTransferTFRecordInputter(config, augmenter)
@@ -68,6 +68,9 @@ class TextClassificationInputter(Inputter):
   def create_nonreplicated_fn(self):
     batch_size = (self.config.batch_size_per_gpu *
                   self.config.gpu_count)
+    if self.config.mode == "train":
+      # A step applies the gradients of accumulation_steps batches
+      batch_size = batch_size * self.config.accumulation_steps
     max_step = (self.get_num_samples() * self.config.epochs // batch_size)
     tf.constant(max_step, name="max_step")
 
@@ -84,8 +87,8 @@ class TextClassificationInputter(Inputter):
     return self.config.epochs
 
   def get_samples_fn(self):
-    for encode_sentence, label, mask in zip(self.encode_sentences, self.labels, self.encode_masks):
-      yield encode_sentence, label, mask
+    for i in self.epoch_order(len(self.encode_sentences)):
+      yield self.encode_sentences[i], self.labels[i], self.encode_masks[i]
 
   def input_fn(self, test_samples=[]):
     batch_size = (self.config.batch_size_per_gpu *
@@ -106,18 +109,22 @@ class TextClassificationInputter(Inputter):
           output_types=(tf.int32, tf.int32, tf.int32),
           output_shapes=(self.config.max_length, 1, self.config.max_length))
 
+        dataset = self.shard(dataset)
+
         if self.config.mode == "train":
-          dataset = dataset.shuffle(self.get_num_samples())
+          # Two int32 sequences and the label
+          dataset = self.shuffle(dataset,
+                                 (2 * self.config.max_length + 1) * 4)
 
         dataset = dataset.repeat(self.config.epochs)
 
         dataset = dataset.apply(
             tf.contrib.data.batch_and_drop_remainder(batch_size))
 
-        dataset = dataset.prefetch(2)
+        dataset = self.prefetch(dataset)
 
-        iterator = dataset.make_one_shot_iterator()
-        return iterator.get_next()
+        self.iterator = dataset.make_one_shot_iterator()
+        return self.iterator.get_next()
 
 
 def build(config, augmenter, encoder):
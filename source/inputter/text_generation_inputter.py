@@ -80,6 +80,9 @@ class TextGenerationInputter(Inputter):
   def create_nonreplicated_fn(self):
     batch_size = (self.config.batch_size_per_gpu *
                   self.config.gpu_count)
+    if self.config.mode == "train":
+      # A step applies the gradients of accumulation_steps batches
+      batch_size = batch_size * self.config.accumulation_steps
     max_step = (self.get_num_samples() * self.config.epochs // batch_size)
     tf.constant(max_step, name="max_step")
 
@@ -134,19 +137,19 @@ class TextGenerationInputter(Inputter):
           generator=lambda: self.get_samples_fn(),
           output_types=(tf.int32, tf.int32))
 
+        dataset = self.shard(dataset)
+
         dataset = dataset.repeat(self.config.epochs)
 
-        dataset = dataset.map(
+        dataset = self.map_and_batch(
+          dataset,
           lambda inputs, outputs: self.parse_fn(inputs, outputs),
-          num_parallel_calls=4)
-
-        dataset = dataset.apply(
-            tf.contrib.data.batch_and_drop_remainder(batch_size))
+          batch_size)
 
-        dataset = dataset.prefetch(2)
+        dataset = self.prefetch(dataset)
 
-        iterator = dataset.make_one_shot_iterator()
-        return iterator.get_next()
+        self.iterator = dataset.make_one_shot_iterator()
+        return self.iterator.get_next()
       else:
         return (tf.zeros([batch_size, self.max_length], tf.int32),
                 tf.zeros([batch_size, self.max_length], tf.int32))
@@ -8,18 +8,96 @@ from __future__ import print_function
 # import importlib
 
 import tensorflow as tf
+from tensorflow.contrib.framework import nest
+
+from source.optimizer.loss_scale import DynamicLossScaleOptimizer
+
+
+def float16_getter(getter, *args, **kwargs):
+  # Store float32 master variables, give the network a float16 copy
+  if kwargs.get("dtype") == tf.float16:
+    kwargs["dtype"] = tf.float32
+    return tf.cast(getter(*args, **kwargs), tf.float16)
+  return getter(*args, **kwargs)
+
+
+def mixed_precision_net(net):
+  """Build a network in float16 with float32 master variables.
+
+  Float32 tensors among the arguments, also inside tuples and lists of
+  tensors, are cast to float16, so layers create (and cast) their variables
+  in float16, and float16 outputs are cast back to float32 for the loss. A
+  network without a float32 input (for example the text networks, which
+  embed integer token ids) would stay in float32, so it raises a ValueError
+  instead.
+  """
+  def cast(x, src_dtype, dst_dtype):
+    if isinstance(x, tf.Tensor) and x.dtype == src_dtype:
+      return tf.cast(x, dst_dtype)
+    return x
+
+  def is_tensors(x):
+    # Tensors nested in tuples and lists. Dicts (feed_dict_seq) are filled
+    # by the network and other lists are data, both are passed as they are
+    if isinstance(x, (list, tuple)):
+      return len(x) > 0 and all(is_tensors(y) for y in x)
+    return isinstance(x, tf.Tensor)
+
+  def cast_inputs(x):
+    if not is_tensors(x):
+      return x, 0
+    num_floats = sum(y.dtype == tf.float32 for y in nest.flatten(x))
+    return nest.map_structure(
+      lambda y: cast(y, tf.float32, tf.float16), x), num_floats
+
+  def _net(*args, **kwargs):
+    inputs = [cast_inputs(x) for x in args]
+    args = [x for x, _ in inputs]
+    num_floats = sum(n for _, n in inputs)
+    for key in kwargs:
+      kwargs[key], n = cast_inputs(kwargs[key])
+      num_floats = num_floats + n
+    if not num_floats:
+      raise ValueError(
+        "mixed_precision casts the float32 inputs of the network to "
+        "float16, {} has none and would stay float32.".format(
+          getattr(net, "__module__", net)))
+
+    with tf.variable_scope(tf.get_variable_scope(),
+                           custom_getter=float16_getter,
+                           auxiliary_name_scope=False):
+      outputs = net(*args, **kwargs)
+    return nest.map_structure(
+      lambda x: cast(x, tf.float16, tf.float32), outputs)
+  return _net
 
 
 class Modeler(object):
   def __init__(self, config, net):
     self.config = config
+    # Module of the network, for example to hash its source
+    self.network = net
     self.net = net.net
 
+    # Ops of the network that XLA should not compile
+    self.xla_excluded_ops = list(getattr(net, "XLA_EXCLUDED_OPS", []))
+
+    if self.config.mixed_precision:
+      self.net = mixed_precision_net(self.net)
+
     self.train_vars = []
     self.feed_dict_pre = {}
     self.feed_dict_seq = {}
     self.skip_l2_loss_vars = []
 
+    # The towers can get batches of different sizes (tower_weights), the
+    # loss has to be a mean over the samples of the tower
+    self.uneven_batch_split = True
+
+    # Loss scale shared by all towers (mixed_precision only)
+    self.loss_scale = None
+    self.loss_scale_good_steps = None
+
   def create_nonreplicated_fn(self, *argv):
     raise NotImplementedError()
 
@@ -86,11 +164,46 @@ class Modeler(object):
       [tf.nn.l2_loss(v) for v in l2_var_list])
     return loss_l2
 
+  def create_loss_scale_optimizer(self, optimizer):
+    if self.loss_scale is None:
+      with tf.device("/cpu:0"):
+        self.loss_scale = tf.get_variable(
+          "loss_scale",
+          shape=[],
+          dtype=tf.float32,
+          initializer=tf.constant_initializer(self.config.initial_loss_scale),
+          trainable=False)
+        self.loss_scale_good_steps = tf.get_variable(
+          "loss_scale_good_steps",
+          shape=[],
+          dtype=tf.int32,
+          initializer=tf.zeros_initializer(),
+          trainable=False)
+    return DynamicLossScaleOptimizer(
+      optimizer,
+      self.loss_scale,
+      self.loss_scale_good_steps,
+      increment_every_n_steps=self.config.loss_scale_increment_steps)
+
+  def clip_gradient(self, grad, clipping):
+    if isinstance(grad, tf.IndexedSlices):
+      # Clip the values only, clip_by_value would densify the gradient
+      return tf.IndexedSlices(
+        self.clip_gradient(grad.values, clipping),
+        grad.indices, grad.dense_shape)
+    clipped_grad = tf.clip_by_value(grad, -clipping, clipping)
+    if self.config.mixed_precision:
+      # Keep inf and nan, so the loss scaler skips the step
+      clipped_grad = tf.where(tf.is_finite(grad), clipped_grad, grad)
+    return clipped_grad
+
   def create_grad_fn(self, loss, clipping=None):
     self.optimizer = self.create_optimizer(self.learning_rate)
+    if self.config.mixed_precision:
+      self.optimizer = self.create_loss_scale_optimizer(self.optimizer)
     grads = self.optimizer.compute_gradients(loss, var_list=self.train_vars)
     if clipping:
-      grads = [(tf.clip_by_value(g, -clipping, clipping), v) for g, v in grads]
+      grads = [(self.clip_gradient(g, clipping), v) for g, v in grads]
     return grads
 
   def create_learning_rate_fn(self, global_step):
@@ -102,7 +215,11 @@ class Modeler(object):
     bs_per_gpu = self.config.batch_size_per_gpu
     gpu_count = self.config.gpu_count
 
-    batches_per_epoch = (self.num_samples / (bs_per_gpu * gpu_count))
+    # Boundaries are in optimizer steps, each of them applies the gradients
+    # of accumulation_steps batches
+    batches_per_epoch = (self.num_samples /
+                         (bs_per_gpu * gpu_count *
+                          self.config.accumulation_steps))
     boundaries = self.config.piecewise_boundaries
     boundaries = [int(batches_per_epoch * boundary) for boundary in boundaries]
 
@@ -19,6 +19,9 @@ class ObjectDetectionModeler(Modeler):
     self.encode_gt = net.encode_gt
     self.detect = net.detect
 
+    # The anchors are matched for batch_size_per_gpu images
+    self.uneven_batch_split = False
+
     # self.config.L2_REGULARIZATION = 0.00025
 
   def get_dataset_info(self, inputter):
@@ -92,12 +95,23 @@ class ObjectDetectionModeler(Modeler):
 
       grads = self.create_grad_fn(loss)
 
-      return {"loss": loss,
-              "class_losses": class_losses,
-              "bboxes_losses": bboxes_losses,
-              "grads": grads,
-              "learning_rate": self.learning_rate,
-              "gt_bboxes": gt[1]}
+      outputs = {"loss": loss,
+                 "class_losses": class_losses,
+                 "bboxes_losses": bboxes_losses,
+                 "grads": grads,
+                 "learning_rate": self.learning_rate,
+                 "gt_bboxes": gt[1]}
+
+      if len(inputs) > 7:
+        # Share of the batched image pixels that are padding
+        image_shape = tf.shape(inputs[1])
+        image_pixels = tf.to_float(tf.reduce_sum(
+          tf.reduce_prod(inputs[7], axis=1)))
+        batch_pixels = tf.to_float(
+          image_shape[0] * image_shape[1] * image_shape[2])
+        outputs["padding_waste"] = 1.0 - image_pixels / batch_pixels
+
+      return outputs
     elif self.config.mode == 'eval':
       feat_classes, feat_bboxes = outputs
       detection_scores, detection_labels, detection_bboxes, detection_anchors = self.create_detect_fn(feat_classes, feat_bboxes)
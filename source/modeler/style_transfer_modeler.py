@@ -156,10 +156,15 @@ class StyleTransferModeler(Modeler):
       style_features_source[style_layer] = \
           self.compute_gram(layer, self.config.data_format)
 
+    # Mean over the images of the tower, which can get fewer or more than
+    # batch_size_per_gpu of them (tower_weights)
+    batch_size = tf.to_float(tf.shape(outputs)[0])
+
     # Content loss
-    content_size = tf.to_float(
-      (self.tensor_size(content_features_source[self.content_layers]) *
-       self.config.batch_size_per_gpu))
+    content_size = (
+      tf.to_float(
+        self.tensor_size(content_features_source[self.content_layers])) *
+      batch_size)
 
     loss_content = (self.config.content_weight *
                     (2 * tf.nn.l2_loss(
@@ -178,13 +183,13 @@ class StyleTransferModeler(Modeler):
                         style_size)
     loss_style = (self.config.style_weight *
                   tf.reduce_sum(style_loss) /
-                  self.config.batch_size_per_gpu)
+                  batch_size)
 
     # TV loss
     loss_tv = self.compute_tv_loss(outputs,
                                    self.config.data_format,
                                    self.config.tv_weight,
-                                   self.config.batch_size_per_gpu)
+                                   batch_size)
 
     # L2 loss
     loss_l2 = self.l2_regularization()
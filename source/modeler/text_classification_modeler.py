@@ -16,6 +16,9 @@ class TextClassificationModeler(Modeler):
 
     self.warmup_proportion = 0.1
 
+    # The networks build their states for batch_size_per_gpu sentences
+    self.uneven_batch_split = False
+
   def get_dataset_info(self, inputter):
     self.num_samples = inputter.get_num_samples()
     self.vocab_size = inputter.get_vocab_size()
@@ -24,7 +27,8 @@ class TextClassificationModeler(Modeler):
 
     if self.config.mode == "train":
       batch_size = (self.config.batch_size_per_gpu *
-                    self.config.gpu_count)
+                    self.config.gpu_count *
+                    self.config.accumulation_steps)
       self.num_train_steps = int(
           self.num_samples / batch_size * float(self.epochs))
       self.num_warmup_steps = int(self.num_train_steps * self.warmup_proportion)
@@ -111,24 +115,10 @@ class TextClassificationModeler(Modeler):
     return optimizer
 
   def create_grad_fn(self, loss, device_id=None, clipping=None):
-
-    # Only update global step for the first GPU
-    if device_id == 0 and self.config.optimizer == "custom":
-
-      op_update_global_step = self.global_step.assign(self.global_step + 1)
-
-      with tf.control_dependencies([op_update_global_step]):
-        self.optimizer = self.create_optimizer(self.learning_rate)
-        grads = self.optimizer.compute_gradients(loss, var_list=self.train_vars)
-        if clipping:
-          grads = [(tf.clip_by_value(g, -clipping, clipping), v) for g, v in grads]
-    else:
-        self.optimizer = self.create_optimizer(self.learning_rate)
-        grads = self.optimizer.compute_gradients(loss, var_list=self.train_vars)
-        if clipping:
-          grads = [(tf.clip_by_value(g, -clipping, clipping), v) for g, v in grads]      
-
-    return grads
+    # The global step is incremented by the optimizer (once per update,
+    # also with the custom optimizer)
+    return super(TextClassificationModeler, self).create_grad_fn(
+      loss, clipping)
 
   def model_fn(self, x, device_id=None):
     if self.config.mode == "export":
@@ -16,6 +16,9 @@ class TextGenerationModeler(Modeler):
     super(TextGenerationModeler, self).__init__(config, net)
     self.grad_clip = 5.
 
+    # The network builds its states for batch_size_per_gpu sequences
+    self.uneven_batch_split = False
+
   def get_dataset_info(self, inputter):
     self.seq_length = inputter.get_max_length()
     self.num_samples = inputter.get_num_samples()
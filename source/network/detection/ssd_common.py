@@ -180,7 +180,119 @@ def decode_bboxes_batch(boxes, anchors, batch_size):
   return boxes
 
 
+def batch_iou(anchors, boxes):
+  """
+  Args:
+      anchors: num_anchors x 4, float32
+      boxes: batch_size x num_obj x 4, float32
+  Returns:
+      iou: batch_size x num_anchors x num_obj, float32
+  """
+  ax1, ay1, ax2, ay2 = [tf.reshape(x, [1, -1, 1])
+                        for x in tf.unstack(anchors, 4, axis=1)]
+  bx1, by1, bx2, by2 = [tf.expand_dims(x, 1)
+                        for x in tf.unstack(boxes, 4, axis=2)]
+
+  iw = tf.maximum(tf.minimum(ax2, bx2) - tf.maximum(ax1, bx1), 0.0)
+  ih = tf.maximum(tf.minimum(ay2, by2) - tf.maximum(ay1, by1), 0.0)
+  inter = iw * ih
+  union = (ax2 - ax1) * (ay2 - ay1) + (bx2 - bx1) * (by2 - by1) - inter
+  return inter / union
+
+
+def first_argmax(x, axis):
+  # Like np.argmax, the first index on ties
+  size = tf.shape(x)[axis]
+  shape = [1, 1, 1]
+  shape[axis] = -1
+  idx = tf.reshape(tf.range(size), shape)
+  is_max = tf.equal(x, tf.reduce_max(x, axis=axis, keepdims=True))
+  return tf.reduce_min(idx + size * (1 - tf.to_int32(is_max)), axis=axis)
+
+
+def batch_gather(params, indices):
+  # params[i, indices[i, j]] for every i, j
+  batch_idx = tf.tile(tf.expand_dims(tf.range(tf.shape(indices)[0]), 1),
+                      [1, tf.shape(indices)[1]])
+  return tf.gather_nd(params, tf.stack([batch_idx, indices], axis=2))
+
+
 def encode_gt(labels, boxes, anchors_map, batch_size):
+  """Match the anchors to the objects of the whole batch, in the graph.
+
+  The same matching as encode_gt_py_func: every anchor takes the object
+  with the highest IoU (foreground above HARD_MINING_FG_IOU, background
+  below HARD_MINING_BG_IOU), then every object takes the anchor with its
+  highest IoU.
+
+  The matching holds several dense batch_size x num_anchors x num_obj
+  tensors (IoU, argmax and reverse matching) at a time. One float32 of
+  them is 53 MB for 32 images with 50 objects and the 8732 anchors of
+  ssd300, 150 MB with the 24564 anchors of ssd512. num_obj is the largest
+  number of objects of an image of the batch (padded_batch), so batches
+  with crowded images need the most. source/tool/benchmark_anchor_matching.py
+  reports the memory the matching allocates.
+
+  Args:
+      labels: batch_size x num_obj, int64. Padded objects have label 0.
+      boxes: batch_size x num_obj x 4, float32
+      anchors_map: num_anchors x 4
+  Returns:
+      gt_labels: batch_size x num_anchors, int64
+      gt_bboxes: batch_size x num_anchors x 4, float32, encoded
+      gt_masks: batch_size x num_anchors, int32. foreground = 1,
+                background = -1, neutral = 0
+  """
+  num_anchors = anchors_map.shape[0]
+  anchors = tf.constant(anchors_map, dtype=tf.float32)
+
+  # Padded objects never match
+  valid = tf.expand_dims(tf.to_float(tf.greater(labels, 0)), 1)
+  iou = batch_iou(anchors, boxes) * valid - (1.0 - valid)
+
+  # Forward selection
+  max_iou = tf.reduce_max(iou, axis=2)
+  max_idx = first_argmax(iou, axis=2)
+  is_bg = tf.less(max_iou, HARD_MINING_BG_IOU)
+  fg_labels = batch_gather(labels, max_idx)
+  fg_masks = tf.where(tf.greater(max_iou, HARD_MINING_FG_IOU),
+                      tf.ones_like(max_idx),
+                      -tf.to_int32(is_bg))
+  # Set the bg object to class 0
+  fg_labels = tf.where(is_bg, tf.zeros_like(fg_labels), fg_labels)
+
+  # Reverse selection
+  # Make sure every gt object is matched to at least one anchor, the last
+  # object wins if several pick the same anchor
+  best_anchor = first_argmax(iou, axis=1)
+  matched = tf.to_int32(tf.equal(
+    tf.reshape(tf.range(num_anchors), [1, -1, 1]),
+    tf.expand_dims(best_anchor, 1))) * tf.to_int32(valid)
+  obj_idx = tf.reshape(tf.range(tf.shape(labels)[1]), [1, 1, -1])
+  reverse_idx = tf.reduce_max(matched * (obj_idx + 1), axis=2) - 1
+  is_reverse = tf.greater_equal(reverse_idx, 0)
+
+  idx = tf.where(is_reverse, reverse_idx, max_idx)
+  gt_labels = tf.where(is_reverse, batch_gather(labels, idx), fg_labels)
+  gt_masks = tf.where(is_reverse, tf.ones_like(fg_masks), fg_masks)
+  gt_bboxes = batch_gather(boxes, idx)
+
+  # Encode the shift between gt_bboxes and anchors_map
+  gt_bboxes = encode_bbox(tf.reshape(gt_bboxes, [-1, 4]),
+                          tf.tile(anchors, [tf.shape(labels)[0], 1]))
+
+  # scale with variance
+  gt_bboxes = tf.reshape(gt_bboxes, [-1, num_anchors, 4]) * tf.constant(
+    [1.0 / v for v in PRIOR_VARIANCE], dtype=tf.float32)
+
+  gt_labels.set_shape([batch_size, num_anchors])
+  gt_bboxes.set_shape([batch_size, num_anchors, 4])
+  gt_masks.set_shape([batch_size, num_anchors])
+  return gt_labels, gt_bboxes, gt_masks
+
+
+def encode_gt_py_func(labels, boxes, anchors_map, batch_size):
+  """encode_gt with the matching of every image in numpy (tf.py_func)."""
 
   def compute_gt(l, b):
     # Input:
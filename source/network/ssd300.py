@@ -10,6 +10,10 @@ from source.network.detection import ssd_common
 CLASS_WEIGHTS = 1.0
 BBOXES_WEIGHTS = 1.0
 
+# Data dependent shapes (ground truth encoding and post-processing)
+XLA_EXCLUDED_OPS = ["PyFunc", "Where",
+                    "NonMaxSuppressionV2", "NonMaxSuppressionV3"]
+
 # Priorboxes
 ANCHORS_STRIDE = [8, 16, 32, 64, 100, 300]
 ANCHORS_ASPECT_RATIOS = [[2], [2, 3], [2, 3], [2, 3], [2], [2]]
@@ -27,7 +31,7 @@ ANCHORS_MAP, NUM_ANCHORS = ssd_common.get_anchors(ANCHORS_STRIDE,
 
 
 def encode_gt(inputs, batch_size):
-  image_id, image, labels, boxes, scale, translation, file_name = inputs
+  image_id, image, labels, boxes, scale, translation, file_name = inputs[:7]
   gt_labels, gt_bboxes, gt_masks = ssd_common.encode_gt(labels, boxes, ANCHORS_MAP, batch_size)
   return gt_labels, gt_bboxes, gt_masks
 
@@ -47,7 +51,7 @@ def net(inputs,
         feature_net_path,
         data_format="channels_last"):
 
-  image_id, image, labels, boxes, scale, translation, file_name = inputs
+  image_id, image, labels, boxes, scale, translation, file_name = inputs[:7]
   
   feature_net = getattr(
     importlib.import_module("source.network." + feature_net),
@@ -72,7 +72,13 @@ class AdamWeightDecayOptimizer(tf.train.Optimizer):
           [param.assign(next_param),
            m.assign(next_m),
            v.assign(next_v)])
-    return tf.group(*assignments, name=name)
+
+    if global_step is None:
+      return tf.group(*assignments, name=name)
+
+    # Increment the global step once the variables have been updated
+    with tf.control_dependencies(assignments):
+      return tf.group(tf.assign_add(global_step, 1), name=name)
 
   def _do_use_weight_decay(self, param_name):
     """Whether to use L2 weight decay for `param_name`."""
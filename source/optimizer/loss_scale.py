@@ -0,0 +1,102 @@
+"""
+Copyright 2018 Lambda Labs. All Rights Reserved.
+Licensed under
+==========================================================================
+
+"""
+import tensorflow as tf
+
+
+class DynamicLossScaleOptimizer(tf.train.Optimizer):
+  """Wrap an optimizer with dynamic loss scaling for float16 training.
+
+  compute_gradients multiplies the loss by the loss scale, so that small
+  float16 gradients do not flush to zero, and divides the gradients by it
+  again. apply_gradients skips the update when a gradient is not finite and
+  divides the scale by scale_factor. After increment_every_n_steps finite
+  steps in a row, the scale is multiplied by scale_factor.
+
+  Several instances (for example one per tower) can share the loss_scale
+  and good_steps variables. Only the apply_gradients call that is given the
+  global step updates them.
+  """
+
+  def __init__(self,
+               optimizer,
+               loss_scale,
+               good_steps,
+               increment_every_n_steps=2000,
+               scale_factor=2.0,
+               name="DynamicLossScaleOptimizer"):
+    """Constructs a DynamicLossScaleOptimizer."""
+    super(DynamicLossScaleOptimizer, self).__init__(False, name)
+
+    self.optimizer = optimizer
+    self.loss_scale = loss_scale
+    self.good_steps = good_steps
+    self.increment_every_n_steps = increment_every_n_steps
+    self.scale_factor = scale_factor
+
+  def compute_gradients(self, loss, var_list=None, **kwargs):
+    """See base class."""
+    loss_scale = tf.cast(self.loss_scale, loss.dtype)
+    grads_and_vars = self.optimizer.compute_gradients(
+      loss * loss_scale, var_list=var_list, **kwargs)
+
+    inv_loss_scale = 1.0 / self.loss_scale
+    unscaled_grads_and_vars = []
+    for grad, var in grads_and_vars:
+      if isinstance(grad, tf.IndexedSlices):
+        grad = tf.IndexedSlices(
+          grad.values * tf.cast(inv_loss_scale, grad.values.dtype),
+          grad.indices, grad.dense_shape)
+      elif grad is not None:
+        grad = grad * tf.cast(inv_loss_scale, grad.dtype)
+      unscaled_grads_and_vars.append((grad, var))
+    return unscaled_grads_and_vars
+
+  def apply_gradients(self, grads_and_vars, global_step=None, name=None):
+    """See base class."""
+    grads_and_vars = list(grads_and_vars)
+
+    is_finite = []
+    for grad, _ in grads_and_vars:
+      if grad is None:
+        continue
+      if isinstance(grad, tf.IndexedSlices):
+        grad = grad.values
+      is_finite.append(tf.reduce_all(tf.is_finite(grad)))
+    is_finite = tf.reduce_all(tf.stack(is_finite))
+
+    # Skip the step (including the global step increment) on overflow
+    apply_op = tf.cond(
+      is_finite,
+      lambda: tf.group(self.optimizer.apply_gradients(
+        grads_and_vars, global_step=global_step)),
+      tf.no_op)
+
+    if global_step is None:
+      return tf.group(apply_op, name=name)
+    return tf.group(apply_op, self.update_loss_scale(is_finite), name=name)
+
+  def update_loss_scale(self, is_finite):
+
+    def increment_fn():
+      increment = tf.greater_equal(self.good_steps + 1,
+                                   self.increment_every_n_steps)
+      loss_scale = tf.where(increment,
+                            self.loss_scale * self.scale_factor,
+                            self.loss_scale)
+      good_steps = tf.where(increment,
+                            tf.zeros_like(self.good_steps),
+                            self.good_steps + 1)
+      return tf.group(tf.assign(self.loss_scale, loss_scale),
+                      tf.assign(self.good_steps, good_steps))
+
+    def decrement_fn():
+      loss_scale = tf.maximum(self.loss_scale / self.scale_factor, 1.0)
+      return tf.group(tf.assign(self.loss_scale, loss_scale),
+                      tf.assign(self.good_steps,
+                                tf.zeros_like(self.good_steps)))
+
+    return tf.cond(is_finite, increment_fn, decrement_fn)
@@ -0,0 +1,92 @@
+"""
+Copyright 2018 Lambda Labs. All Rights Reserved.
+Licensed under
+==========================================================================
+
+"""
+from __future__ import print_function
+import sys
+import threading
+
+import six
+from six.moves import queue
+
+
+class CallbackExecutor(object):
+  """Run the after_step of callbacks on worker threads.
+
+  Each callback gets its own worker thread and bounded FIFO queue, so
+  every step is processed, in order, by every callback while the runner
+  moves on to the next session call. No step is dropped: when a queue is
+  full, submit blocks (backpressure), so callbacks that accumulate over
+  the steps (summaries, padding waste) see all of them. The messages a
+  callback returns are kept in order as well until they are popped.
+  """
+  def __init__(self, callbacks, queue_size=2):
+    self.callbacks = callbacks
+    self.queue_size = queue_size
+
+    self.queues = []
+    self.threads = []
+    self.messages = {}
+    self.lock = threading.Lock()
+    self.error = None
+
+  def start(self, sess):
+    for callback in self.callbacks:
+      q = queue.Queue(maxsize=self.queue_size)
+      thread = threading.Thread(target=self.worker,
+                                args=(callback, q, sess))
+      thread.daemon = True
+      thread.start()
+      self.queues.append(q)
+      self.threads.append(thread)
+
+  def worker(self, callback, q, sess):
+    while True:
+      item = q.get()
+      try:
+        if item is None:
+          return
+        feed_dict, context = item
+        if self.error is None:
+          return_dict = callback.after_step(sess, context.outputs,
+                                            feed_dict, context)
+          if return_dict:
+            with self.lock:
+              self.messages.setdefault(callback, []).append(return_dict)
+      except Exception:
+        self.error = sys.exc_info()
+      finally:
+        q.task_done()
+
+  def check_error(self):
+    if self.error is not None:
+      error, self.error = self.error, None
+      six.reraise(*error)
+
+  def submit(self, feed_dict, context):
+    self.check_error()
+    for q in self.queues:
+      # Callbacks may keep a reference to (and modify) the outputs_dict,
+      # so every callback gets its own copy.
+      q.put((dict(feed_dict), context.copy()))
+
+  def pop_messages(self):
+    """Messages returned since the last call, a list by callback."""
+    with self.lock:
+      messages, self.messages = self.messages, {}
+    return messages
+
+  def flush(self):
+    for q in self.queues:
+      q.join()
+    self.check_error()
+
+  def stop(self):
+    for q in self.queues:
+      q.put(None)
+    for thread in self.threads:
+      thread.join()
+    self.queues = []
+    self.threads = []
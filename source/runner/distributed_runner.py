@@ -0,0 +1,70 @@
+"""
+Copyright 2018 Lambda Labs. All Rights Reserved.
+Licensed under
+==========================================================================
+
+"""
+import tensorflow as tf
+
+from .parameter_server_runner import ParameterServerRunner
+
+
+class DistributedRunner(ParameterServerRunner):
+  """Data parallel training across processes and machines.
+
+  Between-graph replication driven by a cluster spec: every worker process
+  builds its own graph over its local GPUs, the variables live on the ps
+  tasks and every worker applies its gradients asynchronously. Worker 0 is
+  the chief, it initializes (or restores) and saves the variables. ps tasks
+  only serve the variables.
+  """
+  def __init__(self, config, inputter, modeler, callbacks):
+    super(DistributedRunner, self).__init__(config,
+                                            inputter,
+                                            modeler,
+                                            callbacks)
+    self.cluster = tf.train.ClusterSpec(self.config.cluster_spec)
+    self.server = tf.train.Server(self.cluster,
+                                  job_name=self.config.job_name,
+                                  task_index=self.config.task_index,
+                                  config=self.session_config)
+    self.session_target = self.server.target
+    self.worker_device = "/job:worker/task:{}".format(self.config.task_index)
+
+  def create_session_config(self):
+    session_config = super(DistributedRunner, self).create_session_config()
+
+    if self.config.job_name == "worker":
+      # Only talk to the parameter servers and to this worker
+      session_config.device_filters.extend(
+        ["/job:ps",
+         "/job:worker/task:{}".format(self.config.task_index)])
+
+    return session_config
+
+  def create_accumulator(self, name, shape=(), dtype=tf.float32,
+                         device="/cpu:0"):
+    # Accumulators belong to this worker, keep them off the parameter servers
+    device = tf.DeviceSpec.from_string(device)
+    device.job = "worker"
+    device.task = self.config.task_index
+    return super(DistributedRunner, self).create_accumulator(
+      name, shape, dtype, device.to_string())
+
+  def create_graph(self):
+    # Variables go to the ps tasks (round robin), the other ops stay on the
+    # devices of this worker
+    with tf.device(tf.train.replica_device_setter(
+        worker_device=self.worker_device,
+        cluster=self.cluster)):
+      super(DistributedRunner, self).create_graph()
+
+  def run(self):
+    if self.config.job_name == "ps":
+      self.server.join()
+    else:
+      super(DistributedRunner, self).run()
+
+
+def build(config, inputter, modeler, callbacks):
+  return DistributedRunner(config, inputter, modeler, callbacks)
@@ -0,0 +1,101 @@
+"""
+Copyright 2018 Lambda Labs. All Rights Reserved.
+Licensed under
+==========================================================================
+
+"""
+from __future__ import print_function
+import os
+import json
+import inspect
+import hashlib
+
+import tensorflow as tf
+
+# Runner options that do not change the graph
+IGNORED_FIELDS = ["graph_cache_dir", "async_callbacks", "callback_queue_size"]
+
+PY_FUNC_OPS = ["PyFunc", "PyFuncStateless", "EagerPyFunc"]
+
+VARIABLE_PREFIX = "variable:"
+
+
+def cache_key(configs, modules, files=()):
+  """Hash of the configs, of the source of the modules (e.g. network) and of
+  the size and modification time of the data files.
+
+  The graph holds constants derived from the data files (number of steps,
+  sample lists and indexes), so a changed file builds the graph again.
+  """
+  fields = []
+  for config in configs:
+    fields.append({key: value for key, value in vars(config).items()
+                   if key not in IGNORED_FIELDS})
+  fields.append([(os.path.abspath(path),
+                  os.path.getsize(path),
+                  os.path.getmtime(path)) for path in files])
+  key = json.dumps(fields, sort_keys=True, default=str)
+  for module in modules:
+    key = key + inspect.getsource(module)
+  key = key + tf.__version__
+  return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def uses_py_func(graph_def):
+  """Python functions only live in the process that built the graph."""
+  nodes = list(graph_def.node)
+  for function in graph_def.library.function:
+    nodes.extend(function.node_def)
+  return any(node.op in PY_FUNC_OPS for node in nodes)
+
+
+def to_names(x):
+  if x is None:
+    return None
+  elif isinstance(x, (list, tuple)):
+    return [to_names(y) for y in x]
+  elif isinstance(x, tf.Variable):
+    return VARIABLE_PREFIX + x.name
+  else:
+    return x.name
+
+
+def from_names(graph, x):
+  if x is None:
+    return None
+  elif isinstance(x, list):
+    return [from_names(graph, y) for y in x]
+  elif x.startswith(VARIABLE_PREFIX):
+    variables = (graph.get_collection(tf.GraphKeys.GLOBAL_VARIABLES) +
+                 graph.get_collection(tf.GraphKeys.LOCAL_VARIABLES))
+    name = x[len(VARIABLE_PREFIX):]
+    return next(v for v in variables if v.name == name)
+  else:
+    return graph.as_graph_element(x)
+
+
+def save(path, graph, state):
+  """Write the MetaGraph and the state of the runner (a json file)."""
+  if not os.path.isdir(path):
+    os.makedirs(path)
+  tf.train.export_meta_graph(os.path.join(path, "graph.meta"),
+                             graph=graph,
+                             clear_devices=False)
+  with open(os.path.join(path, "state.json"), "w") as f:
+    json.dump(state, f)
+
+
+def exists(path):
+  return os.path.isfile(os.path.join(path, "state.json"))
+
+
+def load_state(path):
+  with open(os.path.join(path, "state.json")) as f:
+    return json.load(f)
+
+
+def import_graph(path, input_map=None):
+  """Import the MetaGraph into the default graph."""
+  tf.train.import_meta_graph(os.path.join(path, "graph.meta"),
+                             clear_devices=False,
+                             input_map=input_map)
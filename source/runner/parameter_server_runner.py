@@ -4,9 +4,14 @@ Licensed under
 ==========================================================================
 
 """
+from __future__ import print_function
+import re
+
 import tensorflow as tf
 
 from .runner import Runner
+from . import placement
+from . import xla
 
 
 class ParameterServerRunner(Runner):
@@ -16,12 +21,33 @@ class ParameterServerRunner(Runner):
                                                 modeler,
                                                 callbacks)
     self.ps_ops = ["Variable", "VariableV2", "AutoReloadVariable"]
+    self.placement = placement.build(self.config.variable_placement,
+                                     self.config.ps_devices)
+
+    # Samples of the batch for every tower, None splits it evenly
+    self.tower_sizes = None
+    self.tower_weights_op = None
+    self.tower_sizes_var = None
+    self.num_measured_steps = 0
+    self.tower_times = [0.0] * self.config.gpu_count
+    self.graph_state_attrs.append("tower_sizes_var")
+
+    # Puts of the staging areas that copy the next batch to the towers
+    self.stage_ops = []
+
+  def device_name(self, idx):
+    return "/gpu:{}".format(idx)
 
   def assign_to_device(self, device, ps_device="/cpu:0"):
       def _assign(op):
           node_def = op if isinstance(op, tf.NodeDef) else op.node_def
           if node_def.op in self.ps_ops:
-              device_name =  ps_device
+              if node_def.device:
+                  # Explicitly placed, for example accumulators
+                  device_name = node_def.device
+              else:
+                  device_name = self.placement.place(node_def, device,
+                                                     ps_device)
           else:
               device_name =  device
 
@@ -34,6 +60,11 @@ class ParameterServerRunner(Runner):
 
 
   def batch_split(self, batch, idx):
+    if self.tower_sizes is not None:
+      begin = sum(self.tower_sizes[:idx])
+      end = begin + self.tower_sizes[idx]
+      return tuple(x[begin:end] for x in batch)
+
     bs_per_gpu = self.config.batch_size_per_gpu
     batch_per_gpu = ()
     for x in batch:
@@ -41,12 +72,206 @@ class ParameterServerRunner(Runner):
                        (x[idx * bs_per_gpu:(idx + 1) * bs_per_gpu],))
     return batch_per_gpu
 
+  def staging(self):
+    # Loops fetch the batches inside the session call, nothing to overlap
+    return (self.config.stage_inputs and
+            not (self.config.mode == "train" and
+                 (self.config.steps_per_run > 1 or
+                  self.config.accumulation_steps > 1)))
+
+  def staging_area(self, tensors):
+    shapes = None
+    if all(x.shape.is_fully_defined() for x in tensors):
+      shapes = [x.shape for x in tensors]
+    area = tf.contrib.staging.StagingArea([x.dtype for x in tensors],
+                                          shapes=shapes)
+    self.stage_ops.append(area.put(list(tensors)))
+
+    staged = area.get()
+    if not isinstance(staged, (list, tuple)):
+      staged = [staged]
+    return list(staged)
+
+  def stage_batch(self, batch):
+    """Copy the slice of a tower to its device one step ahead.
+
+    The put reads the next batch while the towers compute on the batch
+    staged by the previous step, so the copies overlap with the compute.
+    Only the float tensors (images, features) go to the device. Integer
+    and string tensors (labels, image ids, file names) are staged in a
+    second area on the host, which has the kernels for them; the towers
+    copy what they use. Both areas are filled and read in the same steps,
+    so they hold the same batch.
+    """
+    if not self.staging():
+      return batch
+
+    on_device = [x.dtype.is_floating for x in batch]
+    staged = list(batch)
+    for device in [True, False]:
+      idx = [i for i in range(len(batch)) if on_device[i] == device]
+      if not idx:
+        continue
+      tensors = [batch[i] for i in idx]
+      if device:
+        tensors = self.staging_area(tensors)
+      else:
+        # Leave the device function of the tower
+        with tf.device(None), tf.device("/cpu:0"):
+          tensors = self.staging_area(tensors)
+      for i, x in zip(idx, tensors):
+        staged[i] = x
+    return tuple(staged)
+
+  def split_sizes(self, weights):
+    """Split the batch proportionally to the weights of the towers."""
+    total = self.config.batch_size_per_gpu * self.config.gpu_count
+    weights = [float(w) / sum(weights) for w in weights]
+    sizes = [max(1, int(w * total)) for w in weights]
+
+    # Hand out (or take back) the rounding error, largest weights first
+    order = sorted(range(len(sizes)), key=lambda i: -weights[i])
+    i = 0
+    while sum(sizes) != total:
+      j = order[i % len(order)]
+      if sum(sizes) < total:
+        sizes[j] = sizes[j] + 1
+      elif sizes[j] > 1:
+        sizes[j] = sizes[j] - 1
+      i = i + 1
+    return sizes
+
+  def create_tower_sizes(self):
+    weights = self.config.tower_weights
+    warmup_steps = self.config.tower_weights_warmup_steps
+    if not weights and warmup_steps == 0:
+      return
+
+    if not self.modeler.uneven_batch_split:
+      raise ValueError(
+        "%s needs batch_size_per_gpu samples in every tower, use an even "
+        "split without tower_weights." % type(self.modeler).__name__)
+
+    if not weights:
+      weights = [1.0] * self.config.gpu_count
+    if len(weights) != self.config.gpu_count:
+      raise ValueError("Expect %d tower weights, got %d" %
+                       (self.config.gpu_count, len(weights)))
+
+    sizes = self.split_sizes(weights)
+    if warmup_steps > 0:
+      # Measured during the warm-up steps, so the sizes can change
+      self.tower_sizes_var = tf.get_variable(
+        "tower_sizes",
+        initializer=tf.constant(sizes, dtype=tf.int32),
+        trainable=False,
+        collections=[tf.GraphKeys.LOCAL_VARIABLES])
+      self.loop_vars.append(self.tower_sizes_var)
+      sizes = self.tower_sizes_var.read_value()
+      self.tower_sizes = tf.unstack(sizes)
+    else:
+      self.tower_sizes = sizes
+
+    # Share of every tower, to weight its gradients and outputs
+    self.tower_weights_op = (
+      tf.cast(sizes, tf.float32) /
+      (self.config.batch_size_per_gpu * self.config.gpu_count))
+
+  def weighted_sum(self, tensors, towers):
+    """Sum of the tensors of the given towers, weighted by their share."""
+    return tf.add_n([x * tf.cast(self.tower_weights_op[i], x.dtype)
+                     for x, i in zip(tensors, towers)])
+
+  def tower_time(self, step_stats, idx):
+    """Compute time (in microseconds) of a tower in a traced step."""
+    device = tf.DeviceSpec.from_string(self.device_name(idx))
+    tower_time = 0
+    for dev_stats in step_stats.dev_stats:
+      # For example /job:localhost/replica:0/task:0/device:GPU:0/stream:all
+      m = re.search(r"device:([A-Za-z]+):(\d+)", dev_stats.device)
+      if (m and m.group(1).upper() == device.device_type.upper() and
+          int(m.group(2)) == device.device_index):
+        tower_time = max(tower_time,
+                         sum(node_stats.all_end_rel_micros
+                             for node_stats in dev_stats.node_stats))
+    return tower_time
+
+  def measure_towers(self, run_metadata):
+    self.num_measured_steps = self.num_measured_steps + 1
+    if self.num_measured_steps == 1:
+      # The first step also warms up the devices
+      return
+
+    for i in range(self.config.gpu_count):
+      self.tower_times[i] = (self.tower_times[i] +
+                             self.tower_time(run_metadata.step_stats, i))
+
+    if self.num_measured_steps == self.config.tower_weights_warmup_steps:
+      if min(self.tower_times) <= 0:
+        print("\nCould not measure every tower, keep the batch split.")
+        return
+      sizes = self.sess.run(self.tower_sizes_var)
+      speeds = [size / t for size, t in zip(sizes, self.tower_times)]
+      sizes = self.split_sizes(speeds)
+      self.tower_sizes_var.load(sizes, self.sess)
+      print("\nMeasured tower batch sizes: " + str(sizes))
+
+  def measuring_towers(self):
+    return (self.tower_sizes_var is not None and
+            self.num_measured_steps < self.config.tower_weights_warmup_steps)
+
+  def before_step(self):
+    if self.measuring_towers():
+      self.run_options = tf.RunOptions(
+        trace_level=tf.RunOptions.SOFTWARE_TRACE)
+    super(ParameterServerRunner, self).before_step()
+
+  def after_step(self):
+    if self.measuring_towers():
+      self.measure_towers(self.run_metadata)
+    super(ParameterServerRunner, self).after_step()
+
+  def average_sparse_gradients(self, grads, towers=None):
+    """Average IndexedSlices without converting them to dense tensors.
+
+    The indices and values of all towers are concatenated, so the result
+    is as large as the rows actually looked up instead of vocab x dim.
+    With sparse_gradient_dedup the values of duplicated indices are summed.
+    """
+    indices = tf.concat([g.indices for g in grads], 0)
+    if self.tower_weights_op is None:
+      values = tf.concat([g.values for g in grads], 0) * (1.0 / len(grads))
+    else:
+      if towers is None:
+        towers = range(len(grads))
+      values = tf.concat(
+        [g.values * tf.cast(self.tower_weights_op[i], g.values.dtype)
+         for g, i in zip(grads, towers)], 0)
+
+    if self.config.sparse_gradient_dedup:
+      indices, segment_ids = tf.unique(indices)
+      values = tf.unsorted_segment_sum(values, segment_ids,
+                                       tf.shape(indices)[0])
+
+    return tf.IndexedSlices(values, indices, grads[0].dense_shape)
+
   def average_gradients(self, tower_grads):
     average_grads = []
 
     for grad_and_vars in zip(*tower_grads):
       # Note that each grad_and_vars looks like the following:
       #   ((grad0_gpu0, var0_gpu0), ... , (grad0_gpuN, var0_gpuN))
+      towers = [i for i, (g, _) in enumerate(grad_and_vars) if g is not None]
+      # Gradients of the variable in the towers that have one
+      var_grads = [grad_and_vars[i][0] for i in towers]
+      if var_grads and all(isinstance(g, tf.IndexedSlices)
+                           for g in var_grads):
+        # For example the gradients of tf.nn.embedding_lookup
+        average_grads.append(
+          (self.average_sparse_gradients(var_grads, towers),
+           grad_and_vars[0][1]))
+        continue
+
       grads = []
       for g, _ in grad_and_vars:
         if g is not None:
@@ -57,9 +282,13 @@ class ParameterServerRunner(Runner):
           grads.append(expanded_g)
 
       if grads:
-        # Average over the "tower" dimension.
-        grad = tf.concat(grads, 0)
-        grad = tf.reduce_mean(grad, 0)
+        if self.tower_weights_op is not None:
+          # Towers with more samples weigh more
+          grad = self.weighted_sum(var_grads, towers)
+        else:
+          # Average over the "tower" dimension.
+          grad = tf.concat(grads, 0)
+          grad = tf.reduce_mean(grad, 0)
 
         # Keep in mind that the Variables are redundant because they are shared
         # across towers. So we will just return the first tower"s pointer to
@@ -69,20 +298,93 @@ class ParameterServerRunner(Runner):
         average_grads.append(grad_and_var)
     return average_grads
 
+  def fused_average_gradients(self, tower_grads):
+    """Average the gradients in size-bounded buckets.
+
+    The gradients of every tower are flattened and packed into buckets of
+    at most gradient_bucket_mb. Each bucket is reduced with a single add_n
+    and split back into the variables, which needs far fewer ops than
+    averaging every variable on its own. Sparse gradients and gradients
+    without a static shape keep the per-variable path.
+    """
+    num_towers = len(tower_grads)
+    bucket_bytes = self.config.gradient_bucket_mb * 1024 * 1024
+
+    # Group the dense gradients by dtype, they are concatenated
+    dense = {}
+    others = []
+    for grad_and_vars in zip(*tower_grads):
+      grads = [g for g, _ in grad_and_vars]
+      v = grad_and_vars[0][1]
+      if (any(g is None or isinstance(g, tf.IndexedSlices) for g in grads) or
+          not v.shape.is_fully_defined()):
+        others.append(grad_and_vars)
+      else:
+        dense.setdefault(v.dtype.base_dtype, []).append(grad_and_vars)
+
+    buckets = []
+    for dtype in dense:
+      bucket = []
+      size = 0
+      for grad_and_vars in dense[dtype]:
+        v = grad_and_vars[0][1]
+        num_bytes = v.shape.num_elements() * dtype.size
+        if bucket and size + num_bytes > bucket_bytes:
+          buckets.append(bucket)
+          bucket = []
+          size = 0
+        bucket.append(grad_and_vars)
+        size = size + num_bytes
+      if bucket:
+        buckets.append(bucket)
+
+    average_grads = []
+    for bucket in buckets:
+      # Flatten on the device that computed the gradients
+      flat_grads = []
+      for i in range(num_towers):
+        with tf.device(bucket[0][i][0].device):
+          flat_grads.append(tf.concat(
+            [tf.reshape(grad_and_vars[i][0], [-1])
+             for grad_and_vars in bucket], 0))
+
+      if self.tower_weights_op is None:
+        grad = tf.add_n(flat_grads) * (1.0 / num_towers)
+      else:
+        grad = self.weighted_sum(flat_grads, range(num_towers))
+
+      variables = [grad_and_vars[0][1] for grad_and_vars in bucket]
+      sizes = [v.shape.num_elements() for v in variables]
+      for g, v in zip(tf.split(grad, sizes), variables):
+        average_grads.append((tf.reshape(g, v.shape), v))
+
+    if others:
+      average_grads.extend(self.average_gradients(list(zip(*others))))
+
+    return average_grads
+
   def reduce_op(self, x):
     if isinstance(x[0], list):
-      return self.average_gradients(x)
+      # Own name scope, so profiles show the cost of the averaging
+      with tf.name_scope("average_gradients"):
+        if self.config.gradient_bucket_mb > 0:
+          return self.fused_average_gradients(x)
+        return self.average_gradients(x)
+    elif self.tower_weights_op is not None and x[0].shape.ndims == 0:
+      return self.weighted_sum(x, range(len(x)))
     else:
       return tf.reduce_mean(x)
 
-  def replicate_graph(self):
+  def replicate_graph(self, batch=None):
 
-    batch = self.inputter.input_fn()
+    if batch is None:
+      batch = self.inputter.input_fn()
 
     if self.config.mode == "infer":
-      with tf.device(self.assign_to_device("/gpu:{}".format(0),
+      with tf.device(self.assign_to_device(self.device_name(0),
                      ps_device="/cpu:0")):
-        ops = self.modeler.model_fn(batch)
+        with xla.jit_scope(self.config.xla):
+          ops = self.modeler.model_fn(batch)
         return ops
 
     else:
@@ -91,12 +393,13 @@ class ParameterServerRunner(Runner):
         output = {}
         # Map
         for i in range(self.config.gpu_count):
-          with tf.device(self.assign_to_device("/gpu:{}".format(i),
+          with tf.device(self.assign_to_device(self.device_name(i),
                          ps_device="/cpu:0")):          
           # with tf.device("/device:GPU:{}".format(i)):
             # Split input data across multiple devices
-            x = self.batch_split(batch, i)
-            y = self.modeler.model_fn(x, i)
+            x = self.stage_batch(self.batch_split(batch, i))
+            with xla.jit_scope(self.config.xla):
+              y = self.modeler.model_fn(x, i)
 
             # Gather output across multiple devices
             if i == 0:
@@ -113,11 +416,12 @@ class ParameterServerRunner(Runner):
         # For example, in the case of saving results for evaluated by external tools.
         # Map
         for i in range(self.config.gpu_count):
-          with tf.device(self.assign_to_device("/gpu:{}".format(i),
+          with tf.device(self.assign_to_device(self.device_name(i),
                          ps_device="/cpu:0")):
             # Split input data across multiple devices
-            x = self.batch_split(batch, i)
-            y = self.modeler.model_fn(x)
+            x = self.stage_batch(self.batch_split(batch, i))
+            with xla.jit_scope(self.config.xla):
+              y = self.modeler.model_fn(x)
             # Gather output across multiple devices
             if i == 0:
               for key in y:
@@ -127,8 +431,176 @@ class ParameterServerRunner(Runner):
                 ops[key].extend(y[key])
       return ops
 
+  def create_accumulator(self, name, shape=(), dtype=tf.float32,
+                         device="/cpu:0"):
+    # Local variable so it is not saved into (or restored from) checkpoints
+    with tf.device(device):
+      var = tf.get_variable(
+        name,
+        shape=shape,
+        dtype=dtype,
+        initializer=tf.zeros_initializer(),
+        trainable=False,
+        collections=[tf.GraphKeys.LOCAL_VARIABLES])
+    self.loop_vars.append(var)
+    return var
+
+  def replicate_graph_accumulate(self, get_batch=None):
+    """Accumulate the gradients of accumulation_steps batches.
+
+    The batches run in a tf.while_loop. Their gradients are summed into
+    non-trainable accumulators, placed next to the variables like the
+    slots of the optimizer, and the average is returned as "grads", so the
+    variables (and the global step) are updated once. Every other output
+    is averaged over the batches.
+    """
+    if get_batch is None:
+      # Build the input pipeline outside the loop, read from it inside
+      self.inputter.input_fn()
+      get_batch = self.inputter.iterator.get_next
+
+    accumulation_steps = self.config.accumulation_steps
+
+    accumulators = {}
+    grad_accumulators = []
+    nested = []
+
+    def accumulate_grad(acc, grad, first):
+      if isinstance(grad, tf.IndexedSlices):
+        # Only add the rows that were looked up
+        reset = tf.cond(first,
+                        lambda: tf.group(tf.assign(acc, tf.zeros_like(acc))),
+                        tf.no_op)
+        with tf.control_dependencies([reset]):
+          return tf.scatter_add(acc, grad.indices,
+                                tf.cast(grad.values, acc.dtype.base_dtype))
+      grad = tf.cast(grad, acc.dtype.base_dtype)
+      return tf.cond(first,
+                     lambda: tf.group(tf.assign(acc, grad)),
+                     lambda: tf.group(tf.assign_add(acc, grad)))
+
+    def body(step):
+      first = tf.equal(step, 0)
+
+      # The batch norm updates of every batch run inside the loop
+      update_ops = tf.get_collection_ref(tf.GraphKeys.UPDATE_OPS)
+      num_update_ops = len(update_ops)
+
+      ops = self.replicate_graph(get_batch())
+
+      updates = update_ops[num_update_ops:]
+      del update_ops[num_update_ops:]
+
+      # ReplicatedRunner returns one list of gradients per tower
+      grads = ops.pop("grads")
+      nested.append(isinstance(grads[0], list))
+      for tower_grads in (grads if nested[0] else [grads]):
+        tower_accumulators = []
+        for g, v in tower_grads:
+          acc = self.create_accumulator(
+            "grad_accumulator/" + v.op.name, v.shape, v.dtype.base_dtype,
+            v.device)
+          updates.append(accumulate_grad(acc, g, first))
+          tower_accumulators.append((acc, v))
+        grad_accumulators.append(tower_accumulators)
+
+      for key in ops:
+        if key not in accumulators:
+          accumulators[key] = self.create_accumulator(
+            "accumulation_accumulator/" + key)
+        acc = accumulators[key]
+        value = tf.cast(ops[key], tf.float32)
+        updates.append(tf.assign(acc, tf.where(first, value, acc + value)))
+
+      with tf.control_dependencies(updates):
+        return step + 1
+
+    num_batches = tf.while_loop(
+      lambda step: step < accumulation_steps,
+      body,
+      [tf.constant(0)],
+      parallel_iterations=1,
+      back_prop=False)
+
+    ops = {}
+    with tf.control_dependencies([num_batches]):
+      for key in accumulators:
+        ops[key] = accumulators[key].read_value() / accumulation_steps
+
+      grads = []
+      for tower_accumulators in grad_accumulators:
+        tower_grads = []
+        for acc, v in tower_accumulators:
+          with tf.device(acc.device):
+            tower_grads.append(
+              (acc.read_value() * (1.0 / accumulation_steps), v))
+        grads.append(tower_grads)
+      ops["grads"] = grads if nested[0] else grads[0]
+    return ops
+
+  def replicate_graph_loop(self):
+    """Run several training steps inside a single session call.
+
+    The replicated train step is wrapped in a tf.while_loop. Every output
+    except the gradients is averaged over the steps of the loop, so
+    callbacks see one aggregated value per session call. The number of
+    steps actually run is returned as "num_steps".
+    """
+    assert self.config.reduce_ops, (
+      "steps_per_run > 1 requires reduce_ops.")
+
+    # Build the input pipeline outside the loop, read from it inside
+    self.inputter.input_fn()
+    iterator = self.inputter.iterator
+
+    self.num_steps_op = tf.placeholder_with_default(
+      self.config.steps_per_run, shape=[], name="num_steps")
+
+    accumulators = {}
+
+    def body(step):
+      if self.config.accumulation_steps > 1:
+        ops = self.replicate_graph_accumulate(iterator.get_next)
+      else:
+        ops = self.replicate_graph(iterator.get_next())
+
+      updates = []
+      for key in ops:
+        if key == "grads":
+          updates.append(self.create_train_op(ops[key]))
+        else:
+          if key not in accumulators:
+            accumulators[key] = self.create_accumulator(
+              "loop_accumulator/" + key)
+          acc = accumulators[key]
+          value = tf.cast(ops[key], tf.float32)
+          # Restart the sum on the first step of every session call
+          updates.append(tf.assign(
+            acc, tf.where(tf.equal(step, 0), value, acc + value)))
+
+      with tf.control_dependencies(updates):
+        return step + 1
+
+    num_steps = tf.while_loop(
+      lambda step: step < self.num_steps_op,
+      body,
+      [tf.constant(0)],
+      parallel_iterations=1,
+      back_prop=False)
+
+    ops = {}
+    with tf.control_dependencies([num_steps]):
+      for key in accumulators:
+        ops[key] = (accumulators[key].read_value() /
+                    tf.cast(num_steps, tf.float32))
+      ops["num_steps"] = tf.identity(num_steps)
+    return ops
+
   def create_graph(self):
 
+    # Tune the input pipeline before it is built for real
+    self.inputter.probe()
+
     with tf.device("/cpu:0"):
 
       nonreplicated_fns = [self.modeler.create_nonreplicated_fn,
@@ -137,6 +609,8 @@ class ParameterServerRunner(Runner):
       for fn in nonreplicated_fns:
         fn()
 
+      self.create_tower_sizes()
+
       # reduced_ops = self.replicate_graph()
 
       # self.run_ops, self.run_ops_names = self.collect_ops(reduced_ops)
@@ -145,14 +619,26 @@ class ParameterServerRunner(Runner):
       # self.global_step_op = self.graph.get_tensor_by_name("global_step:0")
       # self.max_step_op = self.graph.get_tensor_by_name("max_step:0")
 
-    reduced_ops = self.replicate_graph()
+    if self.config.mode == "train" and self.config.steps_per_run > 1:
+      reduced_ops = self.replicate_graph_loop()
+    elif self.config.mode == "train" and self.config.accumulation_steps > 1:
+      reduced_ops = self.replicate_graph_accumulate()
+    else:
+      reduced_ops = self.replicate_graph()
 
     self.run_ops, self.run_ops_names = self.collect_ops(reduced_ops)
 
+    if self.stage_ops:
+      self.stage_op = tf.group(*self.stage_ops)
+
     self.graph = tf.get_default_graph()
     self.global_step_op = self.graph.get_tensor_by_name("global_step:0")
     self.max_step_op = self.graph.get_tensor_by_name("max_step:0")
 
+    if self.config.variable_placement != "single":
+      print("Variable placement (" + self.config.variable_placement + "):")
+      print(self.placement.report())
+
 
 def build(config, inputter, modeler, callbacks):
   return ParameterServerRunner(config, inputter, modeler, callbacks)
@@ -0,0 +1,96 @@
+"""
+Copyright 2018 Lambda Labs. All Rights Reserved.
+Licensed under
+==========================================================================
+
+"""
+from __future__ import print_function
+import collections
+
+import tensorflow as tf
+
+
+def variable_bytes(node_def):
+  shape = tf.TensorShape(node_def.attr["shape"].shape)
+  if not shape.is_fully_defined():
+    return 0
+  dtype = tf.as_dtype(node_def.attr["dtype"].type).base_dtype
+  return shape.num_elements() * dtype.size
+
+
+class Placement(object):
+  """Choose the parameter device of every variable.
+
+  Keeps the bytes placed on every device, so the balance can be checked
+  with report().
+  """
+  def __init__(self, ps_devices):
+    self.ps_devices = ps_devices
+    self.bytes_per_device = collections.OrderedDict(
+      (d, 0) for d in ps_devices)
+    self.vars_per_device = collections.OrderedDict(
+      (d, 0) for d in ps_devices)
+
+  def choose(self, node_def, device, ps_device):
+    raise NotImplementedError()
+
+  def place(self, node_def, device, ps_device):
+    """Returns the device of a variable.
+
+    Args:
+      node_def: NodeDef of the variable.
+      device: device of the tower that creates the variable.
+      ps_device: parameter device requested by the runner.
+    """
+    ps_device = self.choose(node_def, device, ps_device)
+    self.bytes_per_device[ps_device] = (
+      self.bytes_per_device.get(ps_device, 0) + variable_bytes(node_def))
+    self.vars_per_device[ps_device] = (
+      self.vars_per_device.get(ps_device, 0) + 1)
+    return ps_device
+
+  def report(self):
+    total = float(max(sum(self.bytes_per_device.values()), 1))
+    lines = ["{:<20}{:>12}{:>14}{:>8}".format(
+      "device", "variables", "MB", "%")]
+    for d in self.bytes_per_device:
+      num_bytes = self.bytes_per_device[d]
+      lines.append("{:<20}{:>12}{:>14.2f}{:>8.1f}".format(
+        d, self.vars_per_device[d], num_bytes / 1024.0 / 1024.0,
+        100.0 * num_bytes / total))
+    return "\n".join(lines)
+
+
+class SinglePlacement(Placement):
+  """Every variable on the device requested by the runner."""
+  def choose(self, node_def, device, ps_device):
+    return ps_device
+
+
+class RoundRobinPlacement(Placement):
+  """Cycle through the parameter devices."""
+  def __init__(self, ps_devices):
+    super(RoundRobinPlacement, self).__init__(ps_devices)
+    self.next_device = 0
+
+  def choose(self, node_def, device, ps_device):
+    ps_device = self.ps_devices[self.next_device]
+    self.next_device = (self.next_device + 1) % len(self.ps_devices)
+    return ps_device
+
+
+class GreedyPlacement(Placement):
+  """Put every variable on the parameter device with the fewest bytes."""
+  def choose(self, node_def, device, ps_device):
+    return min(self.ps_devices, key=lambda d: self.bytes_per_device[d])
+
+
+PLACEMENTS = {"single": SinglePlacement,
+              "round_robin": RoundRobinPlacement,
+              "greedy": GreedyPlacement}
+
+
+def build(name, ps_devices):
+  if name not in PLACEMENTS:
+    raise ValueError("Variable placement [%s] was not recognized" % name)
+  return PLACEMENTS[name](ps_devices)
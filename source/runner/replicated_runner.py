@@ -0,0 +1,223 @@
+"""
+Copyright 2018 Lambda Labs. All Rights Reserved.
+Licensed under
+==========================================================================
+
+"""
+import tensorflow as tf
+from tensorflow.contrib import all_reduce
+
+from . import xla
+from .parameter_server_runner import ParameterServerRunner
+
+
+# Scope of the variable copies of the i-th tower (i > 0)
+REPLICA_SCOPE = "replica_{}"
+
+
+class ReplicatedRunner(ParameterServerRunner):
+  """Keep a copy of the variables on every device.
+
+  Gradients are all-reduced across the towers and every tower applies the
+  update to its own copy. Tower 0 owns the variables that are saved in
+  checkpoints, so checkpoints are interchangeable with the
+  ParameterServerRunner. The copies of the other towers live in
+  LOCAL_VARIABLES and are broadcast from tower 0 before the first step.
+  """
+  def __init__(self, config, inputter, modeler, callbacks):
+    super(ReplicatedRunner, self).__init__(config,
+                                           inputter,
+                                           modeler,
+                                           callbacks)
+    self.tower_optimizers = []
+    self.replica_vars = []
+    self.broadcast_op = None
+    self.graph_state_attrs.extend(["replica_vars", "broadcast_op"])
+
+  def create_session_config(self):
+    session_config = super(ReplicatedRunner, self).create_session_config()
+
+    if self.config.device_type == "cpu":
+      # Virtual CPU devices, for example to run on a machine without GPU
+      session_config.device_count["CPU"] = self.config.gpu_count
+      session_config.device_count["GPU"] = 0
+
+    return session_config
+
+  def device_name(self, idx):
+    return "/{}:{}".format(self.config.device_type, idx)
+
+  def all_reduce_fn(self, grads):
+    num_towers = len(grads)
+
+    def un_op(x):
+      return x * (1.0 / num_towers)
+
+    if self.config.all_reduce_alg == "ring":
+      return all_reduce.build_ring_all_reduce(
+        grads, 1, self.config.all_reduce_num_subchunks,
+        list(range(num_towers)), tf.add, un_op)
+    elif self.config.all_reduce_alg == "recursive_hd":
+      # Hierarchical: recursive halving, then doubling.
+      # Needs a power of 2 towers.
+      return all_reduce.build_recursive_hd_all_reduce(grads, tf.add, un_op)
+    elif self.config.all_reduce_alg == "nccl":
+      return all_reduce.build_nccl_all_reduce(grads, tf.add, un_op)
+    else:
+      raise ValueError("All-reduce algorithm [%s] was not recognized" %
+                       self.config.all_reduce_alg)
+
+  def all_reduce_gradients(self, tower_grads):
+    """Average gradients across towers, keep them on their own device.
+
+    Returns:
+      A list (one per tower) of lists of (averaged gradient, tower variable).
+    """
+    num_towers = len(tower_grads)
+    reduced_grads = [[] for _ in range(num_towers)]
+
+    for grad_and_vars in zip(*tower_grads):
+      # Note that each grad_and_vars looks like the following:
+      #   ((grad0_gpu0, var0_gpu0), ... , (grad0_gpuN, var0_gpuN))
+      if any(g is None for g, _ in grad_and_vars):
+        continue
+
+      if all(isinstance(g, tf.IndexedSlices) for g, _ in grad_and_vars):
+        # Gather the slices of all towers on every tower instead of
+        # densifying them for the all-reduce
+        sparse_grads = [g for g, _ in grad_and_vars]
+        for i, (g, v) in enumerate(grad_and_vars):
+          with tf.device(g.device):
+            reduced_grads[i].append(
+              (self.average_sparse_gradients(sparse_grads), v))
+        continue
+
+      grads = []
+      for i, (g, _) in enumerate(grad_and_vars):
+        # The all-reduce algorithms work on dense tensors
+        with tf.device(g.device):
+          g = tf.convert_to_tensor(g)
+          if self.tower_weights_op is not None:
+            # The all-reduce averages, so the weighted sum needs the
+            # weights scaled by the number of towers
+            g = g * tf.cast(self.tower_weights_op[i] * num_towers, g.dtype)
+          grads.append(g)
+
+      if num_towers > 1:
+        grads = self.all_reduce_fn(grads)
+
+      for i, (g, (_, v)) in enumerate(zip(grads, grad_and_vars)):
+        reduced_grads[i].append((g, v))
+
+    return reduced_grads
+
+  def replicate_graph(self, batch=None):
+    if self.config.mode != "train":
+      # Nothing to update, towers can share the variables
+      return super(ReplicatedRunner, self).replicate_graph(batch)
+
+    assert self.config.reduce_ops, (
+      "ReplicatedRunner requires reduce_ops in training.")
+
+    if batch is None:
+      batch = self.inputter.input_fn()
+
+    trainable_vars = tf.get_collection_ref(tf.GraphKeys.TRAINABLE_VARIABLES)
+
+    output = {}
+    self.tower_optimizers = []
+    for i in range(self.config.gpu_count):
+      with tf.device(self.device_name(i)):
+        # Split input data across multiple devices
+        x = self.stage_batch(self.batch_split(batch, i))
+
+        if i == 0:
+          with xla.jit_scope(self.config.xla):
+            y = self.modeler.model_fn(x, i)
+        else:
+          # The modeler collects the trainable variables of a tower from
+          # the collection, so hide the variables of tower 0 meanwhile.
+          master_vars = list(trainable_vars)
+          del trainable_vars[:]
+          with tf.variable_scope(REPLICA_SCOPE.format(i)), \
+              xla.jit_scope(self.config.xla):
+            y = self.modeler.model_fn(x, i)
+          del trainable_vars[:]
+          trainable_vars.extend(master_vars)
+
+      # Every tower has its own optimizer (and slots)
+      self.tower_optimizers.append(self.modeler.optimizer)
+
+      # Gather output across multiple devices
+      if i == 0:
+        for key in y:
+          output[key] = [y[key]]
+      else:
+        for key in y:
+          output[key].append(y[key])
+
+    ops = {}
+    for key in output:
+      if key == "grads":
+        with tf.name_scope("all_reduce_gradients"):
+          ops[key] = self.all_reduce_gradients(output[key])
+      else:
+        ops[key] = self.reduce_op(output[key])
+    return ops
+
+  def create_train_op(self, grads):
+    train_ops = []
+    for i, (optimizer, tower_grads) in enumerate(
+        zip(self.tower_optimizers, grads)):
+      with tf.device(self.device_name(i)):
+        if i == 0:
+          train_ops.append(optimizer.apply_gradients(
+            tower_grads, global_step=self.modeler.global_step))
+        else:
+          # Create the optimizer's variables next to the tower's copies
+          with tf.name_scope(REPLICA_SCOPE.format(i) + "/"):
+            train_ops.append(optimizer.apply_gradients(tower_grads))
+    update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS)
+    return tf.group(train_ops, update_ops)
+
+  def collect_replica_vars(self):
+    """Move the variable copies of towers > 0 out of GLOBAL_VARIABLES.
+
+    They are neither saved in checkpoints nor initialized by the callbacks,
+    instead they are broadcast from tower 0.
+    """
+    global_vars = tf.get_collection_ref(tf.GraphKeys.GLOBAL_VARIABLES)
+    prefixes = tuple(REPLICA_SCOPE.format(i) + "/"
+                     for i in range(1, self.config.gpu_count))
+    self.replica_vars = [v for v in global_vars
+                         if v.op.name.startswith(prefixes)]
+    for v in self.replica_vars:
+      global_vars.remove(v)
+      tf.add_to_collection(tf.GraphKeys.LOCAL_VARIABLES, v)
+
+    master_vars = {v.op.name: v for v in global_vars}
+    assign_ops = []
+    for v in self.replica_vars:
+      name = v.op.name.split("/", 1)[1]
+      if name in master_vars:
+        with tf.device(v.device):
+          assign_ops.append(tf.assign(v, master_vars[name]))
+    self.broadcast_op = tf.group(*assign_ops)
+
+  def create_graph(self):
+    super(ReplicatedRunner, self).create_graph()
+
+    if self.config.mode == "train":
+      self.collect_replica_vars()
+
+  def before_run(self):
+    # Callbacks initialize or restore the variables of tower 0
+    super(ReplicatedRunner, self).before_run()
+
+    if self.replica_vars:
+      self.sess.run(tf.variables_initializer(self.replica_vars))
+      self.sess.run(self.broadcast_op)
+
+
+def build(config, inputter, modeler, callbacks):
+  return ReplicatedRunner(config, inputter, modeler, callbacks)
@@ -12,6 +12,12 @@ import os
 import matplotlib.pyplot as plt
 
 import tensorflow as tf
+from tensorflow.contrib.framework import nest
+
+from . import xla
+from . import graph_cache
+from .callback_executor import CallbackExecutor
+from source.callback.callback import Callback, StepContext
 
 
 class Runner(object):
@@ -29,12 +35,37 @@ class Runner(object):
     self.session_config = self.create_session_config()
     self.sess = None
 
+    # Master of the session, for example the server of a cluster
+    self.session_target = ""
+
     self.feed_dict = {}
 
     self.outputs = None
     self.run_ops = []
     self.run_ops_names = []
 
+    # Everything fetched by the main session call
+    self.fetches = {}
+    self.context = None
+
+    # Placeholder for the number of steps run by a single session call.
+    # Only set by runners that support steps_per_run > 1.
+    self.num_steps_op = None
+    self.loop_vars = []
+
+    # Op that stages the next batch on the devices (stage_inputs only)
+    self.stage_op = None
+
+    # Attributes set by create_graph, restored from the graph cache
+    self.graph_state_attrs = ["run_ops", "global_step_op", "max_step_op",
+                              "num_steps_op", "loop_vars", "stage_op"]
+
+    # Options and metadata of the next session call, for example to trace it
+    self.run_options = None
+    self.run_metadata = None
+
+    self.callback_executor = None
+
   def create_session_config(self):
     """create session_config
     """
@@ -50,35 +81,187 @@ class Runner(object):
       device_count=device_count,
       gpu_options=gpu_options)
 
+    if self.config.xla == "session":
+      # Let tensorflow cluster and compile every op it can
+      session_config.graph_options.optimizer_options.global_jit_level = (
+        tf.OptimizerOptions.ON_1)
+
     return session_config
 
+  def build_graph(self):
+    """Create the graph, or import it from the graph cache."""
+    if not self.config.graph_cache_dir:
+      self.create_graph()
+      return
+
+    path = os.path.join(
+      os.path.expanduser(self.config.graph_cache_dir),
+      graph_cache.cache_key(
+        [self.config, self.inputter.config, self.modeler.config],
+        [m for m in [self.modeler.network, self.inputter.augmenter] if m],
+        self.inputter.data_files()))
+
+    if graph_cache.exists(path):
+      time_before_import = time.time()
+      state = graph_cache.load_state(path)
+
+      input_map = None
+      if state["input_tensors"]:
+        # Python functions of the input pipeline only live in the process
+        # that created them, so the input pipeline is built again
+        self.inputter.create_nonreplicated_fn()
+        batch = nest.flatten(self.inputter.input_fn())
+        input_map = dict(zip(state["input_tensors"], batch))
+
+      graph_cache.import_graph(path, input_map)
+      self.graph = tf.get_default_graph()
+      for attr in self.graph_state_attrs:
+        setattr(self, attr,
+                graph_cache.from_names(self.graph, state["attrs"][attr]))
+      self.run_ops_names = state["run_ops_names"]
+
+      import_time = time.time() - time_before_import
+      print("Imported cached graph in %.2f s, saved %.2f s of building." %
+            (import_time, state["build_time"] - import_time))
+      return
+
+    time_before_build = time.time()
+    self.create_graph()
+    build_time = time.time() - time_before_build
+
+    graph = tf.get_default_graph()
+    input_tensors = []
+    if self.modeler.feed_dict_pre or self.modeler.feed_dict_seq:
+      print("Graph cache skipped: the modeler feeds tensors.")
+      return
+    elif graph_cache.uses_py_func(graph.as_graph_def()):
+      get_next_ops = [op for op in graph.get_operations()
+                      if op.type == "IteratorGetNext"]
+      if (len(get_next_ops) != 1 or
+          get_next_ops[0]._get_control_flow_context() is not None):
+        print("Graph cache skipped: python functions in the input pipeline "
+              "need a single iterator outside of loops.")
+        return
+      input_tensors = [x.name for x in get_next_ops[0].outputs]
+
+    state = {"attrs": {attr: graph_cache.to_names(getattr(self, attr, None))
+                       for attr in self.graph_state_attrs},
+             "run_ops_names": self.run_ops_names,
+             "input_tensors": input_tensors,
+             "build_time": build_time}
+    graph_cache.save(path, graph, state)
+    print("Built graph in %.2f s, cached in %s" % (build_time, path))
+
+  def prepare_xla(self):
+    if self.config.xla == "off":
+      return
+
+    op_types = set(self.config.xla_excluded_ops +
+                   self.modeler.xla_excluded_ops)
+    if op_types:
+      num_ops = xla.exclude_ops(tf.get_default_graph(), op_types)
+      print("Excluded " + str(num_ops) + " ops from XLA: " +
+            ", ".join(sorted(op_types)))
+
   def before_run(self):
     for callback in self.callbacks:
       callback.before_run(self.sess)
 
+    if self.config.async_callbacks:
+      # Callbacks without an after_step have nothing to run asynchronously
+      async_callbacks = [
+        callback for callback in self.callbacks
+        if not callback.sync_only and
+        type(callback).after_step is not Callback.after_step]
+      if async_callbacks:
+        self.callback_executor = CallbackExecutor(
+          async_callbacks, self.config.callback_queue_size)
+        self.callback_executor.start(self.sess)
+
+  def collect_fetches(self):
+    # Tensors registered by callbacks are fetched with the run ops
+    callback_fetches = {}
+    for callback in self.callbacks:
+      callback_fetches.update(callback.fetches)
+
+    self.fetches = {"run_ops": self.run_ops,
+                    "callback_fetches": callback_fetches}
+
+    if self.config.mode == "train":
+      # Read the global step after the step has been applied
+      with tf.control_dependencies(self.run_ops):
+        self.fetches["global_step"] = tf.identity(self.global_step_op)
+
+    if self.stage_op is not None:
+      self.fetches["stage"] = self.stage_op
+
   def before_step(self):
     for callback in self.callbacks:
       callback.before_step(self.sess)
 
+    # Trace the call as detailed as the most demanding callback asks for
+    for callback in self.callbacks:
+      if callback.run_options is not None:
+        if self.run_options is None:
+          self.run_options = tf.RunOptions()
+        self.run_options.trace_level = max(self.run_options.trace_level,
+                                           callback.run_options.trace_level)
+    if self.run_options is not None and self.run_metadata is None:
+      self.run_metadata = tf.RunMetadata()
+
   def after_step(self):
 
     outputs_dict = {}
     for key, value in zip(self.run_ops_names, self.outputs):
       outputs_dict[key] = value
 
+    self.context.outputs = outputs_dict
+
+    # Hand the outputs to the asynchronous callbacks first, so they work
+    # while the main thread runs the sync callbacks and the next step.
+    messages = {}
+    if self.callback_executor:
+      self.callback_executor.submit(self.feed_dict, self.context)
+      messages = self.callback_executor.pop_messages()
+
     print_msg = "\r"
     for callback in self.callbacks:
-      return_dict = callback.after_step(self.sess, outputs_dict,
-                                        self.feed_dict)
-      if return_dict:
-        for key in return_dict:
-          print_msg = print_msg + return_dict[key] + " "
+      if self.callback_executor and \
+          callback in self.callback_executor.callbacks:
+        return_dicts = messages.get(callback, [])
+      else:
+        return_dicts = [callback.after_step(self.sess, outputs_dict,
+                                            self.feed_dict, self.context)]
+      for return_dict in return_dicts:
+        if return_dict:
+          for key in return_dict:
+            print_msg = print_msg + return_dict[key] + " "
 
     if len(print_msg) > 0:
       print(print_msg, end='')
       sys.stdout.flush()
 
+    self.run_options = None
+    self.run_metadata = None
+
   def after_run(self):
+    if self.callback_executor:
+      self.callback_executor.flush()
+      self.callback_executor.stop()
+
+      # Print the messages of the last steps
+      messages = self.callback_executor.pop_messages()
+      print_msg = "\r"
+      for callback in self.callbacks:
+        for return_dict in messages.get(callback, []):
+          for key in return_dict:
+            print_msg = print_msg + return_dict[key] + " "
+      if len(print_msg) > 1:
+        print(print_msg, end='')
+        sys.stdout.flush()
+
+      self.callback_executor = None
+
     for callback in self.callbacks:
       callback.after_run(self.sess)
 
@@ -106,6 +289,12 @@ class Runner(object):
         tf.summary.scalar(name, op)
     return tf.summary.merge_all()
 
+  def create_train_op(self, grads):
+    minimize_op = self.modeler.optimizer.apply_gradients(
+      grads, global_step=self.modeler.global_step)
+    update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS)
+    return tf.group(minimize_op, update_ops)
+
   def collect_ops(self, ops):
     # Create train_op for gradient, keep other ops unchanged
     run_ops = []
@@ -113,10 +302,7 @@ class Runner(object):
 
     for key in ops:
       if key == "grads":
-        minimize_op = self.modeler.optimizer.apply_gradients(
-          ops[key], global_step=self.modeler.global_step)
-        update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS)
-        op = tf.group(minimize_op, update_ops)
+        op = self.create_train_op(ops[key])
       else:
         op = ops[key]
       run_ops.append(op)
@@ -152,35 +338,84 @@ class Runner(object):
       for op in tf.get_default_graph().get_operations():
           print(str(op.name))
 
-      with tf.Session(config=self.session_config) as self.sess:
+      with tf.Session(self.session_target,
+                      config=self.session_config) as self.sess:
         self.before_run()
     else:
-      self.create_graph()
+      self.build_graph()
+
+      self.prepare_xla()
 
       # self.print_global_variables()
 
-      with tf.Session(config=self.session_config) as self.sess:
+      with tf.Session(self.session_target,
+                      config=self.session_config) as self.sess:
 
         # Before run
         self.before_run()
 
+        if self.loop_vars:
+          self.sess.run(tf.variables_initializer(self.loop_vars))
+
         self.prepare_feed_dict()
 
+        self.collect_fetches()
+
+        if self.stage_op is not None:
+          # Stage the batch of the first step
+          self.sess.run(self.stage_op)
+
         global_step = 0
         if self.config.mode == "train":
           global_step = self.sess.run(self.global_step_op)
 
         max_step = self.sess.run(self.max_step_op)
 
+        accumulation_steps = 1
+        if self.config.mode == "train":
+          accumulation_steps = self.config.accumulation_steps
+
+        num_steps = 1
         while global_step < max_step:
+          # The last call may run fewer steps than steps_per_run
+          if self.num_steps_op is not None:
+            num_steps = min(self.config.steps_per_run,
+                            max_step - global_step)
+            self.feed_dict[self.num_steps_op] = num_steps
+
           self.before_step()
 
-          self.outputs = self.sess.run(self.run_ops,
-                                       feed_dict=self.feed_dict)
+          fetches = self.fetches
+          if self.stage_op is not None and global_step + num_steps >= max_step:
+            # The last step has nothing left to stage
+            fetches = {key: self.fetches[key] for key in self.fetches
+                       if key != "stage"}
+
+          time_before_step = time.time()
+          try:
+            results = self.sess.run(fetches,
+                                    feed_dict=self.feed_dict,
+                                    options=self.run_options,
+                                    run_metadata=self.run_metadata)
+          except tf.errors.OutOfRangeError:
+            # For example a worker that has read all of its shard
+            print("\nInput exhausted at step " + str(global_step))
+            break
+          time_after_step = time.time()
+
+          self.outputs = results["run_ops"]
+          global_step = results.get("global_step", global_step + num_steps)
+
+          self.context = StepContext(global_step,
+                                     num_steps,
+                                     time_before_step,
+                                     time_after_step,
+                                     {},
+                                     results["callback_fetches"],
+                                     accumulation_steps,
+                                     self.run_metadata)
           self.after_step()
 
-          global_step = global_step + 1
-
         self.after_run()
 
   def dev2(self):
@@ -0,0 +1,35 @@
+"""
+Copyright 2018 Lambda Labs. All Rights Reserved.
+Licensed under
+==========================================================================
+
+"""
+from __future__ import print_function
+import contextlib
+
+import tensorflow as tf
+from tensorflow.core.framework import attr_value_pb2
+
+
+@contextlib.contextmanager
+def jit_scope(mode):
+  """Compile the ops created in the scope with XLA (mode "scope" only)."""
+  if mode == "scope":
+    with tf.contrib.compiler.jit.experimental_jit_scope():
+      yield
+  else:
+    yield
+
+
+def exclude_ops(graph, op_types):
+  """Keep the ops of the given types out of the XLA clusters.
+
+  Returns:
+    The number of excluded ops.
+  """
+  num_ops = 0
+  for op in graph.get_operations():
+    if op.type in op_types:
+      op._set_attr("_XlaCompile", attr_value_pb2.AttrValue(b=False))
+      num_ops = num_ops + 1
+  return num_ops
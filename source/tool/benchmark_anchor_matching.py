@@ -0,0 +1,200 @@
+"""
+Copyright 2018 Lambda Labs. All Rights Reserved.
+Licensed under
+==========================================================================
+
+Check that the in-graph anchor matching of ssd_common.encode_gt gives the
+same results as the numpy matching of ssd_common.encode_gt_py_func, and
+compare their time per batch and the memory they allocate. The labels and
+masks of every anchor have to be identical and the encoded boxes of every
+non-background anchor have to match within --box_tolerance (absolute and
+relative, like np.allclose).
+Exits with 1 on a mismatch.
+
+Besides random padded batches, the first timed batch holds edge cases: two
+identical boxes (ties in both the forward and the reverse matching), boxes
+with an IoU just above and just below the thresholds, and padded objects
+between real ones.
+
+Example:
+python source/tool/benchmark_anchor_matching.py \
+--network=ssd300 --batch_size=32 --max_num_objects=50
+"""
+from __future__ import print_function
+import sys
+import time
+import argparse
+import importlib
+
+import numpy as np
+import tensorflow as tf
+
+
+def random_batch(rng, batch_size, max_num_objects, num_classes):
+  """Padded labels and boxes like the batches of the MSCOCO inputter."""
+  labels = np.zeros([batch_size, max_num_objects], dtype=np.int64)
+  boxes = np.zeros([batch_size, max_num_objects, 4], dtype=np.float32)
+  for i in range(batch_size):
+    num_objects = rng.randint(1, max_num_objects + 1)
+    x1y1 = rng.uniform(0.0, 0.9, size=[num_objects, 2])
+    wh = rng.uniform(0.02, 1.0, size=[num_objects, 2]) * (1.0 - x1y1)
+    labels[i, :num_objects] = rng.randint(1, num_classes,
+                                          size=[num_objects])
+    boxes[i, :num_objects] = np.concatenate([x1y1, x1y1 + wh], axis=1)
+  return labels, boxes
+
+
+def add_edge_cases(labels, boxes, anchors_map, iou_margin):
+  """Overwrite the first images of a batch with matching edge cases."""
+  labels[:3] = 0
+  boxes[:3] = 0.0
+
+  # Ties: the same box twice, with a padded object in between
+  labels[0, [0, 2]] = [3, 5]
+  boxes[0, [0, 2]] = [0.2, 0.3, 0.6, 0.7]
+
+  # An IoU just above and just below the thresholds: a box inside an
+  # anchor, as high as the anchor, has the IoU of its share of the width
+  for i, (anchor, iou) in enumerate(
+      [(anchors_map[len(anchors_map) // 3], 0.5 + iou_margin),
+       (anchors_map[2 * len(anchors_map) // 3], 0.5 - iou_margin)]):
+    x1, y1, x2, y2 = anchor
+    labels[1, i] = 7 + i
+    boxes[1, i] = [x1, y1, x1 + iou * (x2 - x1), y2]
+
+  # Padded objects between real ones
+  labels[2, [1, 3]] = [4, 6]
+  boxes[2, [1, 3]] = [[0.1, 0.1, 0.4, 0.5], [0.5, 0.2, 0.9, 0.8]]
+  return labels, boxes
+
+
+def allocated_bytes(sess, ops, feed_dict, scope):
+  """Bytes of the outputs of the ops of a scope in a traced run.
+
+  Their sum bounds the peak memory of the matching from above (nothing
+  freed meanwhile), the largest tensor from below.
+  """
+  run_metadata = tf.RunMetadata()
+  sess.run(ops, feed_dict=feed_dict,
+           options=tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE),
+           run_metadata=run_metadata)
+  sizes = {}
+  for dev_stats in run_metadata.step_stats.dev_stats:
+    for node_stats in dev_stats.node_stats:
+      if not node_stats.node_name.startswith(scope + "/"):
+        continue
+      for output in node_stats.output:
+        # Count every output once, even if several devices recorded it
+        key = (node_stats.node_name, output.slot)
+        num_bytes = (output.tensor_description.allocation_description.
+                     requested_bytes)
+        sizes[key] = max(sizes.get(key, 0), num_bytes)
+  return sum(sizes.values()), max(list(sizes.values()) + [0])
+
+
+def run(sess, ops, feeds, num_warmup):
+  for feed_dict in feeds[:num_warmup]:
+    sess.run(ops, feed_dict=feed_dict)
+
+  results = []
+  start = time.time()
+  for feed_dict in feeds[num_warmup:]:
+    results.append(sess.run(ops, feed_dict=feed_dict))
+  batch_time = (time.time() - start) / max(len(feeds) - num_warmup, 1)
+  return results, batch_time
+
+
+def main():
+  sys.path.append('.')
+  from source.network.detection import ssd_common
+
+  parser = argparse.ArgumentParser(
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("--network", type=str, default="ssd300",
+                      choices=["ssd300", "ssd512"],
+                      help="Network whose anchors are matched")
+  parser.add_argument("--batch_size", type=int, default=32)
+  parser.add_argument("--max_num_objects", type=int, default=50,
+                      help="Objects of an image, before padding")
+  parser.add_argument("--num_classes", type=int, default=81)
+  parser.add_argument("--num_warmup", type=int, default=5)
+  parser.add_argument("--num_steps", type=int, default=20)
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--box_tolerance", type=float, default=1e-4,
+                      help="Tolerance of the encoded boxes")
+  parser.add_argument("--iou_margin", type=float, default=1e-3,
+                      help="Distance to the thresholds of the edge cases")
+  args = parser.parse_args()
+  if args.batch_size < 3:
+    parser.error("--batch_size has to hold the 3 images of edge cases")
+
+  anchors_map = importlib.import_module(
+    "source.network." + args.network).ANCHORS_MAP
+
+  labels = tf.placeholder(tf.int64, [args.batch_size, None])
+  boxes = tf.placeholder(tf.float32, [args.batch_size, None, 4])
+  with tf.name_scope("graph"):
+    graph_ops = ssd_common.encode_gt(labels, boxes, anchors_map,
+                                     args.batch_size)
+  with tf.name_scope("py_func"):
+    py_func_ops = ssd_common.encode_gt_py_func(labels, boxes, anchors_map,
+                                               args.batch_size)
+
+  rng = np.random.RandomState(args.seed)
+  feeds = []
+  for i in range(args.num_warmup + args.num_steps):
+    batch_labels, batch_boxes = random_batch(
+      rng, args.batch_size, max(args.max_num_objects, 4), args.num_classes)
+    if i == args.num_warmup:
+      batch_labels, batch_boxes = add_edge_cases(
+        batch_labels, batch_boxes, anchors_map, args.iou_margin)
+    feeds.append({labels: batch_labels, boxes: batch_boxes})
+
+  with tf.Session() as sess:
+    graph_results, graph_time = run(sess, graph_ops, feeds, args.num_warmup)
+    py_func_results, py_func_time = run(sess, py_func_ops, feeds,
+                                        args.num_warmup)
+    # Random images hold fewer objects, give every image max_num_objects
+    # to measure the largest tensors
+    full_feed = {labels: np.ones([args.batch_size, args.max_num_objects],
+                                 dtype=np.int64),
+                 boxes: np.tile(np.array([0.2, 0.3, 0.6, 0.7], np.float32),
+                                [args.batch_size, args.max_num_objects, 1])}
+    memory = {"graph": allocated_bytes(sess, graph_ops, full_feed, "graph"),
+              "py_func": allocated_bytes(sess, py_func_ops, full_feed,
+                                         "py_func")}
+
+  num_anchors = 0
+  diff_labels = 0
+  diff_masks = 0
+  diff_boxes = 0
+  for (graph_labels, graph_bboxes, graph_masks), \
+      (py_labels, py_bboxes, py_masks) in zip(graph_results, py_func_results):
+    num_anchors = num_anchors + graph_labels.size
+    diff_labels = diff_labels + np.sum(graph_labels != py_labels)
+    diff_masks = diff_masks + np.sum(graph_masks != py_masks)
+    # The boxes of the background anchors are not trained
+    non_bg = py_masks != -1
+    diff_boxes = diff_boxes + np.sum(np.any(~np.isclose(
+      graph_bboxes[non_bg], py_bboxes[non_bg],
+      rtol=args.box_tolerance, atol=args.box_tolerance), axis=-1))
+
+  print("anchors: {}  different labels: {}  masks: {}  boxes: {}".format(
+    num_anchors, diff_labels, diff_masks, diff_boxes))
+
+  print("{:<12}{:>16}{:>16}{:>16}{:>16}".format(
+    "matching", "batch (ms)", "images/s", "allocated (MB)", "largest (MB)"))
+  for name, batch_time in [("graph", graph_time), ("py_func", py_func_time)]:
+    total_bytes, largest_bytes = memory[name]
+    print("{:<12}{:>16.2f}{:>16.1f}{:>16.1f}{:>16.1f}".format(
+      name, batch_time * 1000, args.batch_size / batch_time,
+      total_bytes / 1024.0 / 1024.0, largest_bytes / 1024.0 / 1024.0))
+  print("py_func only counts its outputs, numpy allocates the rest.")
+
+  if diff_labels or diff_masks or diff_boxes:
+    print("encode_gt and encode_gt_py_func differ.")
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
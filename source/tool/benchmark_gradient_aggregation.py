@@ -0,0 +1,144 @@
+"""
+Copyright 2018 Lambda Labs. All Rights Reserved.
+Licensed under
+==========================================================================
+
+Compare the per-variable and the fused (bucketed) gradient averaging of the
+parameter_server_runner: number of ops in the graph and time per step.
+
+Example:
+python source/tool/benchmark_gradient_aggregation.py \
+--network=inception_v4 --gpu_count=2 --image_height=299 --image_width=299
+"""
+from __future__ import print_function
+import sys
+import time
+import argparse
+import importlib
+
+import tensorflow as tf
+
+
+def build_runner(args, gradient_bucket_mb):
+  from source.config.config import (RunnerConfig, InputterConfig,
+                                    ModelerConfig)
+  from source.config.image_classification_config import \
+      ImageClassificationInputterConfig, \
+      ImageClassificationModelerConfig
+
+  runner_config = RunnerConfig(
+    mode="train",
+    batch_size_per_gpu=args.batch_size_per_gpu,
+    gpu_count=args.gpu_count,
+    summary_names=["loss"],
+    reduce_ops=True,
+    train_reduce_ops=True,
+    eval_reduce_ops=True,
+    gradient_bucket_mb=gradient_bucket_mb)
+
+  inputter_config = InputterConfig(
+    mode="train",
+    batch_size_per_gpu=args.batch_size_per_gpu,
+    gpu_count=args.gpu_count,
+    epochs=1000,
+    dataset_meta=None,
+    train_dataset_meta=None,
+    eval_dataset_meta=None,
+    test_samples=None,
+    augmenter=None,
+    augmenter_speed_mode=False)
+  inputter_config = ImageClassificationInputterConfig(
+    inputter_config,
+    image_height=args.image_height,
+    image_width=args.image_width,
+    image_depth=3,
+    num_classes=args.num_classes)
+
+  modeler_config = ModelerConfig(
+    mode="train",
+    batch_size_per_gpu=args.batch_size_per_gpu,
+    gpu_count=args.gpu_count,
+    optimizer="momentum",
+    learning_rate=0.1,
+    trainable_vars=[],
+    piecewise_boundaries=[100.0],
+    piecewise_lr_decay=[1.0, 0.1],
+    skip_l2_loss_vars=["BatchNorm", "preact", "postnorm"],
+    l2_weight_decay=0.0002,
+    network=args.network,
+    tune_config_path=None)
+  modeler_config = ImageClassificationModelerConfig(
+    modeler_config,
+    num_classes=args.num_classes,
+    data_format=args.data_format)
+
+  net = importlib.import_module("source.network." + args.network)
+
+  inputter = importlib.import_module(
+    "source.inputter.image_classification_syn_inputter").build(
+    inputter_config, None)
+
+  modeler = importlib.import_module(
+    "source.modeler.image_classification_modeler").build(
+    modeler_config, net)
+
+  return importlib.import_module(
+    "source.runner.parameter_server_runner").build(
+    runner_config, inputter, modeler, [])
+
+
+def benchmark(args, gradient_bucket_mb):
+  runner = build_runner(args, gradient_bucket_mb)
+
+  start = time.time()
+  runner.create_graph()
+  build_time = time.time() - start
+
+  num_ops = len(tf.get_default_graph().get_operations())
+
+  with tf.Session(config=runner.session_config) as sess:
+    sess.run(tf.global_variables_initializer())
+
+    for _ in range(args.num_warmup):
+      sess.run(runner.run_ops)
+
+    start = time.time()
+    for _ in range(args.num_steps):
+      sess.run(runner.run_ops)
+    step_time = (time.time() - start) / args.num_steps
+
+  return num_ops, build_time, step_time
+
+
+def main():
+  sys.path.append('.')
+
+  parser = argparse.ArgumentParser(
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("--network", type=str, default="resnet32",
+                      help="Name of an image classification network")
+  parser.add_argument("--gpu_count", type=int, default=2)
+  parser.add_argument("--batch_size_per_gpu", type=int, default=16)
+  parser.add_argument("--image_height", type=int, default=32)
+  parser.add_argument("--image_width", type=int, default=32)
+  parser.add_argument("--num_classes", type=int, default=10)
+  parser.add_argument("--data_format", type=str, default="channels_last",
+                      choices=["channels_first", "channels_last"])
+  parser.add_argument("--gradient_bucket_mb", type=float, default=32,
+                      help="Bucket size of the fused path")
+  parser.add_argument("--num_warmup", type=int, default=5)
+  parser.add_argument("--num_steps", type=int, default=20)
+  args = parser.parse_args()
+
+  results = [("per-variable",) + benchmark(args, 0),
+             ("fused",) + benchmark(args, args.gradient_bucket_mb)]
+
+  print("{:<14}{:>10}{:>16}{:>16}".format(
+    "aggregation", "ops", "build (s)", "step (ms)"))
+  for name, num_ops, build_time, step_time in results:
+    print("{:<14}{:>10}{:>16.2f}{:>16.2f}".format(
+      name, num_ops, build_time, step_time * 1000))
+
+
+if __name__ == "__main__":
+  main()
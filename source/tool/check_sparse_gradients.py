@@ -0,0 +1,207 @@
+"""
+Copyright 2018 Lambda Labs. All Rights Reserved.
+Licensed under
+==========================================================================
+
+Check that the parameter_server_runner averages the embedding gradients of
+the text networks across towers without densifying them: the averaged
+gradients have to be IndexedSlices, and the average_gradients scope must not
+hold a tensor as large as the embedding (vocab x dim). Builds the training
+graph of every network with and without sparse_gradient_dedup on synthetic
+batches, so no data or vocabulary is needed. Exits with 1 if a check fails.
+
+Example:
+python source/tool/check_sparse_gradients.py --gpu_count=2
+"""
+from __future__ import print_function
+import sys
+import argparse
+import importlib
+
+import tensorflow as tf
+
+# Embedding tables looked up with tf.gather, by network
+EMBEDDINGS = {
+  "rnn_basic": ["RNN/embedding"],
+  "seq2label_basic": ["seq2label_basic/embedding"],
+  "seq2label_bert": ["bert/embeddings/word_embeddings"],
+}
+
+MODELERS = {
+  "rnn_basic": "text_generation_modeler",
+  "seq2label_basic": "text_classification_modeler",
+  "seq2label_bert": "text_classification_modeler",
+}
+
+
+def build_inputter(args, network):
+  from source.inputter.inputter import Inputter
+
+  class SyntheticTextInputter(Inputter):
+    """Batches of zeros shaped like the batches of the text inputters."""
+    def get_num_samples(self):
+      return 256
+
+    def get_vocab_size(self):
+      return args.vocab_size
+
+    def get_embd(self):
+      return []
+
+    def get_num_epochs(self):
+      return self.config.epochs
+
+    def get_max_length(self):
+      return args.max_length
+
+    def get_items(self):
+      return []
+
+    def get_starter(self):
+      return []
+
+    def create_nonreplicated_fn(self):
+      batch_size = (self.config.batch_size_per_gpu *
+                    self.config.gpu_count)
+      max_step = (self.get_num_samples() * self.config.epochs // batch_size)
+      tf.constant(max_step, name="max_step")
+
+    def input_fn(self, test_samples=[]):
+      batch_size = (self.config.batch_size_per_gpu *
+                    self.config.gpu_count)
+      sequence = tf.zeros([batch_size, args.max_length], tf.int32)
+      if MODELERS[network] == "text_generation_modeler":
+        # Inputs and the next items
+        return (sequence, sequence)
+      else:
+        # Sentences, labels and masks
+        return (sequence, tf.zeros([batch_size, 1], tf.int32),
+                tf.ones([batch_size, args.max_length], tf.int32))
+
+  from source.config.config import InputterConfig
+  inputter_config = InputterConfig(
+    mode="train",
+    batch_size_per_gpu=args.batch_size_per_gpu,
+    gpu_count=args.gpu_count,
+    epochs=1,
+    dataset_meta=None,
+    train_dataset_meta=None,
+    eval_dataset_meta=None,
+    test_samples=None,
+    augmenter=None,
+    augmenter_speed_mode=False)
+  return SyntheticTextInputter(inputter_config, None)
+
+
+def build_runner(args, network, sparse_gradient_dedup):
+  from source.config.config import RunnerConfig, ModelerConfig
+  from source.config.text_classification_config import \
+      TextClassificationModelerConfig
+  from source.config.text_generation_config import \
+      TextGenerationModelerConfig
+
+  runner_config = RunnerConfig(
+    mode="train",
+    batch_size_per_gpu=args.batch_size_per_gpu,
+    gpu_count=args.gpu_count,
+    summary_names=["loss"],
+    reduce_ops=True,
+    train_reduce_ops=True,
+    eval_reduce_ops=True,
+    sparse_gradient_dedup=sparse_gradient_dedup)
+
+  modeler_config = ModelerConfig(
+    mode="train",
+    batch_size_per_gpu=args.batch_size_per_gpu,
+    gpu_count=args.gpu_count,
+    optimizer="adam",
+    learning_rate=0.001,
+    trainable_vars=[],
+    piecewise_boundaries=[100.0],
+    piecewise_lr_decay=[1.0, 0.1],
+    skip_l2_loss_vars=[],
+    l2_weight_decay=0.0,
+    network=network,
+    tune_config_path=None)
+  if MODELERS[network] == "text_generation_modeler":
+    modeler_config = TextGenerationModelerConfig(modeler_config)
+  else:
+    modeler_config = TextClassificationModelerConfig(modeler_config)
+
+  net = importlib.import_module("source.network." + network)
+
+  modeler = importlib.import_module(
+    "source.modeler." + MODELERS[network]).build(modeler_config, net)
+
+  return importlib.import_module(
+    "source.runner.parameter_server_runner").build(
+    runner_config, build_inputter(args, network), modeler, [])
+
+
+def check(args, network, sparse_gradient_dedup):
+  """Messages of the failed checks."""
+  runner = build_runner(args, network, sparse_gradient_dedup)
+
+  with tf.device("/cpu:0"):
+    runner.modeler.create_nonreplicated_fn()
+    runner.inputter.create_nonreplicated_fn()
+    runner.create_tower_sizes()
+  grads = runner.replicate_graph()["grads"]
+
+  errors = []
+  embeddings = {}
+  for grad, var in grads:
+    if var.op.name in EMBEDDINGS[network]:
+      embeddings[var.op.name] = var.shape.num_elements()
+      if not isinstance(grad, tf.IndexedSlices):
+        errors.append("{}: the averaged gradient is a dense {} {}".format(
+          var.op.name, type(grad).__name__, grad.shape))
+
+  for name in EMBEDDINGS[network]:
+    if name not in embeddings:
+      errors.append("{}: no gradient".format(name))
+
+  # A dense copy of an embedding gradient, for example the
+  # UnsortedSegmentSum of tf.convert_to_tensor or its Reshape
+  for op in tf.get_default_graph().get_operations():
+    if not op.name.startswith("average_gradients"):
+      continue
+    for output in op.outputs:
+      num_elements = output.shape.num_elements()
+      for name, size in embeddings.items():
+        if num_elements == size:
+          errors.append("{}: {} op {} has the size of the embedding".format(
+            name, op.type, op.name))
+  return errors
+
+
+def main():
+  sys.path.append('.')
+
+  parser = argparse.ArgumentParser(
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("--networks", type=str,
+                      default="rnn_basic,seq2label_basic,seq2label_bert",
+                      help="Comma separated names of text networks")
+  parser.add_argument("--gpu_count", type=int, default=2)
+  parser.add_argument("--batch_size_per_gpu", type=int, default=4)
+  parser.add_argument("--max_length", type=int, default=32)
+  parser.add_argument("--vocab_size", type=int, default=10000,
+                      help="Vocabulary size of the networks that take it")
+  args = parser.parse_args()
+
+  failed = False
+  for network in args.networks.split(","):
+    for sparse_gradient_dedup in [False, True]:
+      errors = check(args, network, sparse_gradient_dedup)
+      print("{:<18} dedup={:<6} {}".format(
+        network, str(sparse_gradient_dedup), "FAIL" if errors else "OK"))
+      for error in errors:
+        print("  " + error)
+      failed = failed or bool(errors)
+
+  sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+  main()
@@ -1,5 +1,6 @@
 import yaml
 import os
+import json
 import argparse
 
 from tensorflow.python.client import device_lib
@@ -60,6 +61,200 @@ def default_parser():
                       help="Number of epochs.",
                       type=int,
                       default=5)
+  parser.add_argument("--runner",
+                      choices=["parameter_server_runner", "replicated_runner",
+                               "distributed_runner"],
+                      type=str,
+                      help="Choose how to distribute the job across devices",
+                      default="parameter_server_runner")
+  parser.add_argument("--cluster_spec",
+                      help="Cluster of distributed_runner, as a JSON string \
+                            or file, e.g. \
+                            '{\"ps\": [\"host0:2222\"], \
+                              \"worker\": [\"host1:2222\", \"host2:2222\"]}'",
+                      type=str,
+                      default=None)
+  parser.add_argument("--job_name",
+                      choices=["worker", "ps"],
+                      type=str,
+                      help="Job of this process in the cluster.",
+                      default="worker")
+  parser.add_argument("--task_index",
+                      help="Index of this process in its job.",
+                      type=int,
+                      default=0)
+  parser.add_argument("--device_type",
+                      choices=["gpu", "cpu"],
+                      type=str,
+                      help="Type of the devices used by replicated_runner. \
+                            Use cpu (with gpu_count virtual CPU devices) \
+                            to run on a machine without GPU.",
+                      default="gpu")
+  parser.add_argument("--all_reduce_alg",
+                      choices=["ring", "recursive_hd", "nccl"],
+                      type=str,
+                      help="Algorithm used by replicated_runner to \
+                            all-reduce gradients.",
+                      default="ring")
+  parser.add_argument("--all_reduce_num_subchunks",
+                      help="Number of subchunks for the ring all-reduce.",
+                      type=int,
+                      default=1)
+  parser.add_argument("--variable_placement",
+                      choices=["single", "round_robin", "greedy"],
+                      type=str,
+                      help="How parameter_server_runner places variables on \
+                            ps_devices: single (the first one), round_robin \
+                            or greedy (fewest bytes first).",
+                      default="single")
+  parser.add_argument("--ps_devices",
+                      help="Comma separated list of parameter devices.",
+                      type=str,
+                      default="/cpu:0")
+  parser.add_argument("--tower_weights",
+                      help="Comma separated list of the share of the batch \
+                            of every GPU, for GPUs of different speeds. \
+                            Empty splits the batch evenly.",
+                      type=str,
+                      default="")
+  parser.add_argument("--tower_weights_warmup_steps",
+                      help="Trace this number of steps to measure the speed \
+                            of every GPU, then split the batch accordingly. \
+                            0 keeps the split of tower_weights.",
+                      type=int,
+                      default=0)
+  parser.add_argument("--xla",
+                      choices=["off", "session", "scope"],
+                      type=str,
+                      help="Compile with XLA: session (every op of the \
+                            graph) or scope (the ops of the model_fn).",
+                      default="off")
+  parser.add_argument("--xla_excluded_ops",
+                      help="Comma separated list of op types XLA should not \
+                            compile, on top of the ones of the network.",
+                      type=str,
+                      default="")
+  parser.add_argument("--graph_cache_dir",
+                      help="Directory of the built graphs. A run with the \
+                            same config and network imports the graph \
+                            instead of building it.",
+                      type=str,
+                      default="")
+  parser.add_argument("--profile_every_n_iter",
+                      help="Number of steps between the steps traced by \
+                            the profiler callback.",
+                      type=int,
+                      default=100)
+  parser.add_argument("--profile_top_n",
+                      help="Number of ops and name scopes printed by the \
+                            profiler callback.",
+                      type=int,
+                      default=20)
+  parser.add_argument("--profile_scope_depth",
+                      help="Depth of the name scopes the profiler callback \
+                            ranks, e.g. 3 for bert/encoder/layer_0.",
+                      type=int,
+                      default=2)
+  parser.add_argument("--input_stall_every_n_iter",
+                      help="Trace one session call in this many to measure \
+                            the time spent waiting for the input. \
+                            0 disables it.",
+                      type=int,
+                      default=100)
+  parser.add_argument("--input_stall_threshold",
+                      help="Warn when the input wait is above this fraction \
+                            of the step time.",
+                      type=float,
+                      default=0.2)
+  parser.add_argument("--stage_inputs",
+                      help="Copy the slice of every GPU to the GPU one step \
+                            ahead, so the copies overlap with the compute.",
+                      type=str2bool,
+                      default=False)
+  parser.add_argument("--num_parallel_calls",
+                      help="Number of samples the input pipeline parses in \
+                            parallel. 0 lets tf.data tune it.",
+                      type=int,
+                      default=0)
+  parser.add_argument("--prefetch_buffer_size",
+                      help="Number of batches the input pipeline prefetches. \
+                            0 lets tf.data tune it.",
+                      type=int,
+                      default=0)
+  parser.add_argument("--map_and_batch",
+                      help="Parse the samples straight into the batch \
+                            (fused map and batch).",
+                      type=str2bool,
+                      default=True)
+  parser.add_argument("--interleave_cycle_length",
+                      help="Number of dataset_meta files read in parallel.",
+                      type=int,
+                      default=4)
+  parser.add_argument("--input_probe_steps",
+                      help="Measure the speed of the input pipeline for \
+                            this many batches per num_parallel_calls and \
+                            prefetch_buffer_size candidate and use the \
+                            fastest. 0 disables it.",
+                      type=int,
+                      default=0)
+  parser.add_argument("--shuffle_buffer_size",
+                      help="Number of samples shuffled together in \
+                            training, after the order of the files and \
+                            blocks of samples.",
+                      type=int,
+                      default=1000)
+  parser.add_argument("--preprocess_cache",
+                      help="Cache the preprocessed samples of eval and \
+                            infer: memory (for the later epochs of the \
+                            run), or a cache directory (across runs, \
+                            never cleaned up). Empty disables the cache.",
+                      type=str,
+                      default="")
+  parser.add_argument("--gradient_bucket_mb",
+                      help="Average gradients across GPUs in buckets of this \
+                            size (in MB). 0 averages every variable on its own.",
+                      type=float,
+                      default=0)
+  parser.add_argument("--sparse_gradient_dedup",
+                      help="Sum the values of duplicated indices of sparse \
+                            gradients (e.g. embeddings) before applying them.",
+                      type=str2bool,
+                      default=False)
+  parser.add_argument("--accumulation_steps",
+                      help="Number of batches whose gradients are \
+                            accumulated before the variables are updated. \
+                            Steps and epochs count the updates.",
+                      type=int,
+                      default=1)
+  parser.add_argument("--mixed_precision",
+                      help="Build the network in float16 with float32 \
+                            master variables and dynamic loss scaling.",
+                      type=str2bool,
+                      default=False)
+  parser.add_argument("--initial_loss_scale",
+                      help="Initial loss scale of mixed_precision.",
+                      type=float,
+                      default=2.0 ** 15)
+  parser.add_argument("--loss_scale_increment_steps",
+                      help="Number of steps without overflow after which \
+                            the loss scale is doubled.",
+                      type=int,
+                      default=2000)
+  parser.add_argument("--steps_per_run",
+                      help="Number of training steps to run inside a single \
+                            session call.",
+                      type=int,
+                      default=1)
+  parser.add_argument("--async_callbacks",
+                      help="Run callbacks that are not sync-only on worker \
+                            threads, off the training critical path.",
+                      type=str2bool,
+                      default=False)
+  parser.add_argument("--callback_queue_size",
+                      help="Maximum number of pending steps per asynchronous \
+                            callback before the runner blocks.",
+                      type=int,
+                      default=2)
 
   subparsers = parser.add_subparsers(title='mode', dest='action')
 
@@ -409,6 +604,37 @@ def prepare(config):
       [] if not config.output_ops else
       config.output_ops.split(","))
 
+  if hasattr(config, "tower_weights"):
+    config.tower_weights = (
+      [] if not config.tower_weights else
+      [float(x) for x in config.tower_weights.split(",")])
+
+  if hasattr(config, "xla_excluded_ops"):
+    config.xla_excluded_ops = (
+      [] if not config.xla_excluded_ops else
+      config.xla_excluded_ops.split(","))
+
+  if hasattr(config, "ps_devices"):
+    config.ps_devices = (
+      ["/cpu:0"] if not config.ps_devices else
+      config.ps_devices.split(","))
+
+  if hasattr(config, "cluster_spec"):
+    if config.cluster_spec and os.path.isfile(config.cluster_spec):
+      with open(config.cluster_spec) as f:
+        config.cluster_spec = f.read()
+    config.cluster_spec = (
+      None if not config.cluster_spec else
+      json.loads(config.cluster_spec))
+
+  # Every worker reads its own shard of the data, worker 0 is the chief
+  config.num_workers = 1
+  config.worker_index = 0
+  if config.runner == "distributed_runner" and config.cluster_spec:
+    config.num_workers = len(config.cluster_spec["worker"])
+    if config.job_name == "worker":
+      config.worker_index = config.task_index
+
   if hasattr(config, "vocab_file"):
     config.vocab_file = ("" if not config.vocab_file else
                         os.path.expanduser(config.vocab_file))
@@ -440,7 +666,28 @@ def default_config(parser):
     train_reduce_ops=(True if not hasattr(config, "train_reduce_ops")
                 else config.train_reduce_ops),
     eval_reduce_ops=(True if not hasattr(config, "eval_reduce_ops")
-                else config.eval_reduce_ops))
+                else config.eval_reduce_ops),
+    steps_per_run=config.steps_per_run,
+    async_callbacks=config.async_callbacks,
+    callback_queue_size=config.callback_queue_size,
+    runner=config.runner,
+    device_type=config.device_type,
+    all_reduce_alg=config.all_reduce_alg,
+    all_reduce_num_subchunks=config.all_reduce_num_subchunks,
+    gradient_bucket_mb=config.gradient_bucket_mb,
+    sparse_gradient_dedup=config.sparse_gradient_dedup,
+    accumulation_steps=config.accumulation_steps,
+    cluster_spec=config.cluster_spec,
+    job_name=config.job_name,
+    task_index=config.task_index,
+    variable_placement=config.variable_placement,
+    ps_devices=config.ps_devices,
+    tower_weights=config.tower_weights,
+    tower_weights_warmup_steps=config.tower_weights_warmup_steps,
+    xla=config.xla,
+    xla_excluded_ops=config.xla_excluded_ops,
+    graph_cache_dir=config.graph_cache_dir,
+    stage_inputs=config.stage_inputs)
 
   callback_config = CallbackConfig(
     mode=config.mode,
@@ -472,7 +719,14 @@ def default_config(parser):
     input_ops=(None if not hasattr(config, "input_ops")
                     else config.input_ops),
     output_ops=(None if not hasattr(config, "output_ops")
-                    else config.output_ops)
+                    else config.output_ops),
+    num_workers=config.num_workers,
+    worker_index=config.worker_index,
+    profile_every_n_iter=config.profile_every_n_iter,
+    profile_top_n=config.profile_top_n,
+    profile_scope_depth=config.profile_scope_depth,
+    input_stall_every_n_iter=config.input_stall_every_n_iter,
+    input_stall_threshold=config.input_stall_threshold
     )
 
 
@@ -492,7 +746,17 @@ def default_config(parser):
     augmenter=(None if not hasattr(config, "augmenter")
                else config.augmenter),
     augmenter_speed_mode=(None if not hasattr(config, "augmenter_speed_mode")
-                          else config.augmenter_speed_mode))
+                          else config.augmenter_speed_mode),
+    accumulation_steps=config.accumulation_steps,
+    num_workers=config.num_workers,
+    worker_index=config.worker_index,
+    num_parallel_calls=config.num_parallel_calls,
+    prefetch_buffer_size=config.prefetch_buffer_size,
+    map_and_batch=config.map_and_batch,
+    interleave_cycle_length=config.interleave_cycle_length,
+    input_probe_steps=config.input_probe_steps,
+    shuffle_buffer_size=config.shuffle_buffer_size,
+    preprocess_cache=config.preprocess_cache)
 
 
   modeler_config = ModelerConfig(
@@ -516,7 +780,11 @@ def default_config(parser):
     network=(None if not hasattr(config, "network")
                      else config.network),
     tune_config_path=(None if not hasattr(config, "tune_config_path")
-                     else config.tune_config_path))
+                     else config.tune_config_path),
+    accumulation_steps=config.accumulation_steps,
+    mixed_precision=config.mixed_precision,
+    initial_loss_scale=config.initial_loss_scale,
+    loss_scale_increment_steps=config.loss_scale_increment_steps)
 
 
   arg_groups={}
@@ -0,0 +1,115 @@
+"""
+Copyright 2018 Lambda Labs. All Rights Reserved.
+Licensed under
+==========================================================================
+
+Pack the images (and segmentation masks) of a CSV dataset_meta into
+sharded TFRecord files, so they are read with a few large sequential reads
+instead of one small read per sample. Writes a manifest with the number of
+samples of every shard, to use as the dataset_meta of the TFRecord
+inputters (e.g. image_classification_tfrecord_inputter).
+
+Example:
+python source/tool/csv_to_tfrecord.py --task=image_classification \
+--dataset_meta=~/demo/data/cifar10/train.csv \
+--output_dir=~/demo/data/cifar10/tfrecord --num_shards=16
+"""
+from __future__ import print_function
+import os
+import sys
+import csv
+import json
+import random
+import argparse
+
+import tensorflow as tf
+
+
+def bytes_feature(value):
+  return tf.train.Feature(bytes_list=tf.train.BytesList(value=[value]))
+
+
+def int64_feature(value):
+  return tf.train.Feature(int64_list=tf.train.Int64List(value=[value]))
+
+
+def read_file(path):
+  with open(path, "rb") as f:
+    return f.read()
+
+
+def create_example(task, dirname, row):
+  """Example of a CSV row, the features the TFRecord inputters parse."""
+  features = {"image": bytes_feature(read_file(os.path.join(dirname,
+                                                            row[0])))}
+  if task == "image_classification":
+    features["label"] = int64_feature(int(row[1]))
+  elif task == "image_segmentation":
+    features["label"] = bytes_feature(read_file(os.path.join(dirname,
+                                                             row[1])))
+  return tf.train.Example(features=tf.train.Features(feature=features))
+
+
+def main():
+  sys.path.append('.')
+  from source.tool.config_parser import str2bool
+
+  parser = argparse.ArgumentParser(
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("--task",
+                      choices=["image_classification",
+                               "image_segmentation",
+                               "style_transfer"],
+                      type=str,
+                      help="Task of the CSV file, sets its columns",
+                      default="image_classification")
+  parser.add_argument("--dataset_meta", type=str, required=True,
+                      help="CSV file of the samples")
+  parser.add_argument("--output_dir", type=str, required=True,
+                      help="Directory of the shards and the manifest")
+  parser.add_argument("--num_shards", type=int, default=16,
+                      help="Number of TFRecord files")
+  parser.add_argument("--shuffle", type=str2bool, default=True,
+                      help="Shuffle the samples before splitting them")
+  parser.add_argument("--seed", type=int, default=0,
+                      help="Seed of the shuffle")
+  args = parser.parse_args()
+
+  dataset_meta = os.path.expanduser(args.dataset_meta)
+  output_dir = os.path.expanduser(args.output_dir)
+  if not os.path.isdir(output_dir):
+    os.makedirs(output_dir)
+
+  with open(dataset_meta) as f:
+    rows = list(csv.reader(f, delimiter=",", quotechar="'"))
+  if args.shuffle:
+    random.Random(args.seed).shuffle(rows)
+
+  name = os.path.splitext(os.path.basename(dataset_meta))[0]
+  dirname = os.path.dirname(dataset_meta)
+  num_shards = max(1, min(args.num_shards, len(rows)))
+
+  shards = []
+  for i in range(num_shards):
+    shard_rows = rows[i * len(rows) // num_shards:
+                      (i + 1) * len(rows) // num_shards]
+    path = "{}-{:05d}-of-{:05d}.tfrecord".format(name, i, num_shards)
+    with tf.python_io.TFRecordWriter(os.path.join(output_dir, path)) as writer:
+      for row in shard_rows:
+        writer.write(
+          create_example(args.task, dirname, row).SerializeToString())
+    shards.append({"path": path, "num_samples": len(shard_rows)})
+    print("\rWrote shard {}/{}".format(i + 1, num_shards), end="")
+    sys.stdout.flush()
+
+  manifest = {"task": args.task,
+              "num_samples": len(rows),
+              "shards": shards}
+  manifest_path = os.path.join(output_dir, name + ".json")
+  with open(manifest_path, "w") as f:
+    json.dump(manifest, f, indent=2)
+  print("\nWrote " + str(len(rows)) + " samples, manifest: " + manifest_path)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,109 @@
+"""
+Copyright 2018 Lambda Labs. All Rights Reserved.
+Licensed under
+==========================================================================
+
+Run a distributed_runner job on localhost, with one process per ps and
+worker task. Everything after "--" is the command of a demo. The cluster
+flags are added to it.
+
+Example:
+python source/tool/launch_localhost_cluster.py --num_workers=2 --cpu=True -- \
+python demo/image/image_classification.py \
+--mode=train --model_dir=~/demo/model/cifar10-resnet32-dist \
+--network=resnet32 --augmenter=cifar_augmenter --gpu_count=1 \
+--batch_size_per_gpu=64 --epochs=4 \
+train_args --learning_rate=0.5 --optimizer=momentum \
+--piecewise_boundaries=2 --piecewise_lr_decay=1.0,0.1 \
+--dataset_meta=~/demo/data/cifar10/train.csv
+"""
+from __future__ import print_function
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+
+def main():
+  sys.path.append('.')
+  from source.tool.config_parser import str2bool
+
+  if "--" not in sys.argv:
+    sys.exit("Usage: launch_localhost_cluster.py [options] -- <command>")
+  idx = sys.argv.index("--")
+  argv, command = sys.argv[1:idx], sys.argv[idx + 1:]
+
+  parser = argparse.ArgumentParser(
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("--num_workers", type=int, default=2,
+                      help="Number of worker processes")
+  parser.add_argument("--num_ps", type=int, default=1,
+                      help="Number of parameter server processes")
+  parser.add_argument("--port", type=int, default=2222,
+                      help="First port of the cluster")
+  parser.add_argument("--cpu", type=str2bool, default=False,
+                      help="Hide the GPUs from the workers")
+  parser.add_argument("--log_dir", type=str, default="~/demo/cluster_log",
+                      help="Logs of the tasks other than the chief")
+  args = parser.parse_args(argv)
+
+  # The cluster flags go right after the script
+  scripts = [i for i, x in enumerate(command) if x.endswith(".py")]
+  if not scripts:
+    sys.exit("The command must run a python script.")
+  script_idx = scripts[0] + 1
+
+  port = args.port
+  cluster_spec = {"ps": [], "worker": []}
+  for job, num_tasks in [("ps", args.num_ps), ("worker", args.num_workers)]:
+    for _ in range(num_tasks):
+      cluster_spec[job].append("localhost:{}".format(port))
+      port = port + 1
+
+  log_dir = os.path.expanduser(args.log_dir)
+  if not os.path.isdir(log_dir):
+    os.makedirs(log_dir)
+
+  processes = {"ps": [], "worker": []}
+  for job in ["ps", "worker"]:
+    for task_index in range(len(cluster_spec[job])):
+      task_command = (command[:script_idx] +
+                      ["--runner=distributed_runner",
+                       "--cluster_spec=" + json.dumps(cluster_spec),
+                       "--job_name=" + job,
+                       "--task_index=" + str(task_index)] +
+                      command[script_idx:])
+
+      env = dict(os.environ)
+      if job == "ps" or args.cpu:
+        env["CUDA_VISIBLE_DEVICES"] = ""
+
+      if job == "worker" and task_index == 0:
+        # The chief prints to the console
+        stdout = None
+      else:
+        log_path = os.path.join(log_dir, "{}_{}.log".format(job, task_index))
+        print("Log of {} {}: {}".format(job, task_index, log_path))
+        stdout = open(log_path, "w")
+
+      processes[job].append(subprocess.Popen(task_command,
+                                             env=env,
+                                             stdout=stdout,
+                                             stderr=subprocess.STDOUT))
+
+  returncode = 0
+  try:
+    for process in processes["worker"]:
+      returncode = max(returncode, process.wait())
+  finally:
+    # Parameter servers never stop on their own
+    for process in processes["ps"] + processes["worker"]:
+      if process.poll() is None:
+        process.terminate()
+
+  sys.exit(returncode)
+
+
+if __name__ == "__main__":
+  main()